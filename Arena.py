@@ -0,0 +1,320 @@
+"""
+Arena: paired games between two AI configurations with SPRT early stopping.
+
+Both configurations play a game from every seed, so each pair of games
+starts from the same board and gets the same tile spawns for as long as the
+two play the same moves. A pair is won by the configuration with the higher
+score. The sequential probability ratio test decides between
+
+    H0: P(B beats A) = p0    (B is weaker)
+    H1: P(B beats A) = p1    (B is at least as strong)
+
+after every pair, ignoring drawn pairs, and the run stops as soon as the
+log-likelihood ratio leaves (log(beta / (1 - alpha)), log((1 - beta) / alpha)),
+or after --games pairs. Pairs are processed in seed order however the workers
+finish, so a run is reproducible.
+
+Every process plays a few untimed moves with both configurations before its
+first pair, so the tables built on first use (moves, heuristics, n-tuple
+weights) are not charged to the CPU time of a game, and the configuration
+that plays first alternates from pair to pair.
+
+A configuration is a JSON object of Ai keyword arguments, with an optional
+"set" object of values to override while it plays, as "config.NAME" for the
+settings in Constants or "Module.NAME" for a module constant:
+
+    python -m Arena --a '{"mode": "expectimax", "depth": 2}' \\
+        --b '{"mode": "expectimax", "depth": 2, "set": {"Heuristic.BJ2_WEIGHT": 3.5}}' \\
+        --games 2000 --workers 8 --seed 1
+"""
+
+import argparse
+import importlib
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+import PlayerAI
+from Game import Game
+from Simulate import game_seed, play_game
+
+# Untimed moves each configuration plays in every process before the first pair
+WARM_UP_MOVES = 8
+
+
+@contextmanager
+def overrides(values):
+    """
+    Set module constants and config settings for the duration of a block.
+
+    Args:
+        values (dict): "config.NAME" or "Module.NAME" -> value.
+    """
+    saved = []
+    try:
+        for name, value in values.items():
+            module, _, attr = name.rpartition('.')
+            target = PlayerAI.config if module == 'config' else importlib.import_module(module)
+            if not hasattr(target, attr):
+                raise ValueError('Unknown setting: {}'.format(name))
+            saved.append((target, attr, getattr(target, attr)))
+            setattr(target, attr, value)
+        yield
+    finally:
+        for target, attr, value in reversed(saved):
+            setattr(target, attr, value)
+
+
+def play_config(seed, size, engine, config):
+    """
+    Play one game with a configuration.
+
+    Args:
+        seed (int): The seed of the game.
+        size (int): The size of the grid.
+        engine (str): The grid engine.
+        config (dict): Ai keyword arguments and an optional "set" of overrides.
+
+    Returns:
+        dict: The result of the game, as Simulate.play_game returns it.
+    """
+    options = dict(config)
+    with overrides(options.pop('set', {})):
+        return play_game(seed, size, engine, options)
+
+
+def warm_up(size, engine, configs, moves=WARM_UP_MOVES):
+    """
+    Play a few moves with every configuration, so that this process has built what they build on first use.
+
+    Args:
+        size (int): The size of the grid.
+        engine (str): The grid engine.
+        configs (tuple): The configurations.
+        moves (int): The number of moves per configuration (default: WARM_UP_MOVES).
+    """
+    for config in configs:
+        options = dict(config)
+        with overrides(options.pop('set', {})):
+            game = Game(size, engine=engine, seed=0)
+            ai = PlayerAI.Ai(seed=0, **options)
+            for _ in range(moves):
+                if game.state != 'run':
+                    break
+                game.run(ai.get_next(game.grid.exponents, exponents=True)[0])
+            ai.close()
+
+
+def play_pair(args):
+    """Play the games of one seed with both configurations, B first in every other pair."""
+    index, seed, size, engine, a, b = args
+    if index % 2:
+        result_b = play_config(seed, size, engine, b)
+        return play_config(seed, size, engine, a), result_b
+    return play_config(seed, size, engine, a), play_config(seed, size, engine, b)
+
+
+class SPRT:
+    """Sequential probability ratio test on the outcome of game pairs."""
+
+    def __init__(self, p0=0.45, p1=0.55, alpha=0.05, beta=0.05):
+        """
+        Initialize the test.
+
+        Args:
+            p0 (float): The probability that B wins a pair under H0 (default: 0.45).
+            p1 (float): The probability that B wins a pair under H1 (default: 0.55).
+            alpha (float): The chance of accepting H1 when H0 holds (default: 0.05).
+            beta (float): The chance of accepting H0 when H1 holds (default: 0.05).
+        """
+        if not 0 < p0 < p1 < 1:
+            raise ValueError('SPRT needs 0 < p0 < p1 < 1')
+        self.win = math.log(p1 / p0)
+        self.loss = math.log((1 - p1) / (1 - p0))
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.llr = 0.0
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+
+    def add(self, a_score, b_score):
+        """
+        Add the outcome of one pair.
+
+        Args:
+            a_score (int): The score of configuration A.
+            b_score (int): The score of configuration B.
+        """
+        if b_score > a_score:
+            self.wins += 1
+            self.llr += self.win
+        elif b_score < a_score:
+            self.losses += 1
+            self.llr += self.loss
+        else:
+            self.draws += 1
+
+    @property
+    def decision(self):
+        """str: 'H1' (B at least as strong), 'H0' (B weaker) or None while undecided."""
+        if self.llr >= self.upper:
+            return 'H1'
+        if self.llr <= self.lower:
+            return 'H0'
+        return None
+
+
+def run(a, b, games=1000, size=4, workers=1, seed=0, engine='numpy', sprt=None, log_every=0):
+    """
+    Play pairs of games until the SPRT decides or the games run out.
+
+    Args:
+        a (dict): Configuration A.
+        b (dict): Configuration B.
+        games (int): The largest number of pairs (default: 1000).
+        size (int): The size of the grid (default: 4).
+        workers (int): The number of worker processes (default: 1).
+        seed (int): The seed of the run (default: 0).
+        engine (str): The grid engine (default: 'numpy').
+        sprt (SPRT): The test (default: SPRT()).
+        log_every (int): Print the state of the test every this many pairs, 0 to not print (default: 0).
+
+    Returns:
+        tuple: The results of A and of B in seed order, and the test.
+    """
+    sprt = sprt or SPRT()
+    tasks = ((i, game_seed(seed, i), size, engine, a, b) for i in range(games))
+    results_a, results_b = [], []
+    executor = (
+        ProcessPoolExecutor(workers, initializer=warm_up, initargs=(size, engine, (a, b))) if workers > 1 else None
+    )
+    try:
+        if executor is None:
+            warm_up(size, engine, (a, b))
+            pairs = map(play_pair, tasks)
+        else:
+            pairs = _ordered(executor, tasks, 2 * workers)
+        for result_a, result_b in pairs:
+            results_a.append(result_a)
+            results_b.append(result_b)
+            sprt.add(result_a['score'], result_b['score'])
+            if log_every and len(results_a) % log_every == 0:
+                print('{:>6} pairs  B +{} ={} -{}  LLR {:.2f} ({:.2f}, {:.2f})'.format(
+                    len(results_a), sprt.wins, sprt.draws, sprt.losses, sprt.llr, sprt.lower, sprt.upper
+                ), flush=True)
+            if sprt.decision is not None:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return results_a, results_b, sprt
+
+
+def _ordered(executor, tasks, window):
+    """Run tasks with at most `window` in flight and yield their results in task order."""
+    pending = []
+    for task in tasks:
+        pending.append(executor.submit(play_pair, task))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+def summary(results, win_tile=2048):
+    """
+    Get the statistics of the games of one configuration.
+
+    Args:
+        results (list): Results of Simulate.play_game.
+        win_tile (int): The tile that counts as a win (default: 2048).
+
+    Returns:
+        dict: Mean score and its standard error, median score, win rate, mean max tile,
+            CPU milliseconds per move and score per CPU second.
+    """
+    scores = np.array([r['score'] for r in results], dtype=np.float64)
+    cpu = sum(r['cpu'] for r in results)
+    moves = sum(r['moves'] for r in results)
+    return {
+        'games': len(results),
+        'score': scores.mean(),
+        'score_stderr': scores.std(ddof=1) / math.sqrt(len(scores)) if len(scores) > 1 else 0.0,
+        'median': float(np.median(scores)),
+        'win_rate': float(np.mean([r['max_tile'] >= win_tile for r in results])),
+        'max_tile': float(np.mean([r['max_tile'] for r in results])),
+        'cpu_ms_per_move': 1000 * cpu / max(moves, 1),
+        'score_per_cpu_second': scores.sum() / cpu if cpu else 0.0,
+    }
+
+
+def report(results_a, results_b, sprt, elapsed, win_tile=2048):
+    """
+    Format the outcome of a run.
+
+    Args:
+        results_a (list): The results of configuration A.
+        results_b (list): The results of configuration B.
+        sprt (SPRT): The test.
+        elapsed (float): The wall time of the run in seconds.
+        win_tile (int): The tile that counts as a win (default: 2048).
+
+    Returns:
+        str: The report.
+    """
+    lines = ['Pairs: {}  Time: {:.1f}s'.format(len(results_a), elapsed)]
+    for name, results in (('A', results_a), ('B', results_b)):
+        s = summary(results, win_tile)
+        lines.append(
+            '{}: score {:.0f} +- {:.0f}  median {:.0f}  win rate {:.1%}  mean max tile {:.0f}  '
+            'CPU/move {:.2f} ms  score/CPU s {:.0f}'.format(
+                name, s['score'], s['score_stderr'], s['median'], s['win_rate'], s['max_tile'],
+                s['cpu_ms_per_move'], s['score_per_cpu_second']
+            )
+        )
+    lines.append('B vs A: +{} ={} -{}  LLR {:.2f} ({:.2f}, {:.2f})'.format(
+        sprt.wins, sprt.draws, sprt.losses, sprt.llr, sprt.lower, sprt.upper
+    ))
+    verdict = {
+        'H1': 'B is not weaker than A',
+        'H0': 'B is weaker than A',
+        None: 'undecided, more pairs needed',
+    }[sprt.decision]
+    lines.append('SPRT: {}'.format(verdict))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two AI configurations on paired games.')
+    parser.add_argument('--a', type=json.loads, default={}, help='configuration A (JSON)')
+    parser.add_argument('--b', type=json.loads, default={}, help='configuration B (JSON)')
+    parser.add_argument('--games', type=int, default=1000, help='largest number of game pairs')
+    parser.add_argument('--size', type=int, default=4, help='grid size')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the run')
+    parser.add_argument('--engine', default='numpy', choices=['numpy', 'exponent', 'bitboard'], help='grid engine')
+    parser.add_argument('--p0', type=float, default=0.45, help='P(B wins a pair) if B is weaker')
+    parser.add_argument('--p1', type=float, default=0.55, help='P(B wins a pair) if B is not weaker')
+    parser.add_argument('--alpha', type=float, default=0.05, help='chance of wrongly accepting B')
+    parser.add_argument('--beta', type=float, default=0.05, help='chance of wrongly rejecting B')
+    parser.add_argument('--win-tile', type=int, default=2048, help='tile that counts as a win')
+    parser.add_argument('--log-every', type=int, default=0, help='pairs between progress lines')
+    args = parser.parse_args(argv)
+
+    for config in (args.a, args.b):
+        config.setdefault('workers', 0)
+    start = time.time()
+    results_a, results_b, sprt = run(
+        args.a, args.b, args.games, args.size, args.workers, args.seed, args.engine,
+        SPRT(args.p0, args.p1, args.alpha, args.beta), args.log_every
+    )
+    print(report(results_a, results_b, sprt, time.time() - start, args.win_tile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""
+Microbenchmarks for the engine and AI hot paths.
+
+Times each hot function on fixed, seeded board corpora (sparse, mid-game and
+nearly full boards, 4x4 to 8x8), writes the results as JSON together with
+machine metadata, and compares them with a saved baseline:
+
+    python -m Benchmark --out bench.json
+    python -m Benchmark --baseline bench.json --threshold 0.1
+
+The exit status is 1 when a benchmark got slower than the baseline by more
+than the threshold.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+
+import Batch
+import Bitboard
+import Heuristic
+import NTuple
+import Packed
+from Game import ExpGrid, Grid
+from PlayerAI import Ai
+
+SIZES = (4, 5, 6, 8)
+# Fraction of filled cells of each corpus
+FILL = {'sparse': 0.2, 'mid': 0.6, 'full': 0.95}
+# Late-game boards for the sample-mode AI: get_next_sample only searches boards with fewer than
+# size * size / 3 empty cells and moves at random on the others, so it is timed on these and 'full'
+CORPORA = dict(FILL, late=0.75)
+SAMPLE_KINDS = ('late', 'full')
+CORPUS_BOARDS = 64
+
+
+def make_corpus(size, kind, n=CORPUS_BOARDS, seed=0):
+    """
+    Build a fixed set of random boards.
+
+    Args:
+        size (int): The size of the boards.
+        kind (str): 'sparse', 'mid', 'late' or 'full'.
+        n (int): The number of boards (default: CORPUS_BOARDS).
+        seed (int): The seed (default: 0).
+
+    Returns:
+        np.ndarray: The boards, shape (n, size, size), each with at least one empty cell.
+    """
+    rng = np.random.default_rng([seed, size, list(CORPORA).index(kind)])
+    cells = size * size
+    boards = np.zeros((n, cells), dtype=np.int32)
+    filled = max(1, min(cells - 1, int(round(cells * CORPORA[kind]))))
+    for b in boards:
+        idx = rng.choice(cells, filled, replace=False)
+        b[idx] = 1 << rng.integers(1, 11, filled)
+    return boards.reshape(n, size, size)
+
+
+def _grid(tiles):
+    g = Grid(len(tiles))
+    g.tiles = tiles.copy()
+    return g
+
+
+def benchmarks(quick=False):
+    """
+    Get the benchmarks to run.
+
+    Args:
+        quick (bool): Leave out the slow AI benchmarks (default: False).
+
+    Returns:
+        list: (name, setup) pairs; setup() returns the list of calls to time.
+    """
+    cases = []
+    for size in SIZES:
+        for kind in FILL:
+            tag = '{}x{}/{}'.format(size, size, kind)
+            corpus = make_corpus(size, kind)
+
+            def grid_run(corpus=corpus):
+                grids = [_grid(t) for t in corpus]
+                return [lambda g=g, d=d: g.run(d, is_fake=True) for g in grids for d in 'ULRD']
+
+            def exp_grid_run(corpus=corpus):
+                grids = [ExpGrid(len(t)) for t in corpus]
+                for g, t in zip(grids, corpus):
+                    g.tiles = t
+                return [lambda g=g, d=d: g.run(d, is_fake=True) for g in grids for d in 'ULRD']
+
+            def grid_move_hl(corpus=corpus):
+                grids = [_grid(t) for t in corpus]
+                return [lambda g=g, i=i: g.move_hl(g.tiles[i].copy()) for g in grids for i in range(len(g.tiles))]
+
+            def grid_is_over(corpus=corpus):
+                return [g.is_over for g in (_grid(t) for t in corpus)]
+
+            def grid_random_xy(corpus=corpus):
+                random.seed(0)
+                return [g.get_random_xy for g in (_grid(t) for t in corpus)]
+
+            def batch_move(corpus=corpus):
+                return [lambda d=d: Batch.move_batch(corpus, d) for d in 'ULRD']
+
+            def heuristic_batch(corpus=corpus):
+                return [lambda: Heuristic.evaluate_batch(corpus)]
+
+            cases += [
+                ('Grid.run/' + tag, grid_run),
+                ('ExpGrid.run/' + tag, exp_grid_run),
+                ('Grid.move_hl/' + tag, grid_move_hl),
+                ('Grid.is_over/' + tag, grid_is_over),
+                ('Grid.get_random_xy/' + tag, grid_random_xy),
+                ('Batch.move_batch[{}]/'.format(CORPUS_BOARDS) + tag, batch_move),
+                ('Heuristic.evaluate_batch[{}]/'.format(CORPUS_BOARDS) + tag, heuristic_batch),
+            ]
+            if size != Bitboard.SIZE:
+
+                # The row memos fill up on the first repeat, later repeats time the lookups
+                def packed_move(corpus=corpus, size=size):
+                    engine = Packed.engine(size)
+                    boards = [engine.pack(t) for t in corpus]
+                    return [lambda b=b, d=d: engine.move(b, d) for b in boards for d in 'ULRD']
+
+                def row_heuristic(corpus=corpus, size=size):
+                    engine = Packed.engine(size)
+                    boards = [engine.pack(t) for t in corpus]
+                    heuristic = Heuristic.RowHeuristic(engine)
+                    return [lambda b=b: heuristic.evaluate(b) for b in boards]
+
+                cases += [
+                    ('Packed.move/' + tag, packed_move),
+                    ('Heuristic.RowHeuristic/' + tag, row_heuristic),
+                ]
+                continue
+
+            def bitboard_move(corpus=corpus):
+                boards = [Bitboard.pack(t) for t in corpus]
+                Bitboard.init_tables()
+                return [lambda b=b, d=d: Bitboard.move(b, d) for b in boards for d in 'ULRD']
+
+            def heuristic_packed(corpus=corpus):
+                boards = [Bitboard.pack(t) for t in corpus]
+                Heuristic.init_tables()
+                return [lambda b=b: Heuristic.evaluate_packed(b) for b in boards]
+
+            def ntuple_packed(corpus=corpus):
+                boards = [Bitboard.pack(t) for t in corpus]
+                network = NTuple.NTupleNetwork()
+                return [lambda b=b: network.evaluate_packed(b) for b in boards]
+
+            def ntuple_batch(corpus=corpus):
+                network = NTuple.NTupleNetwork()
+                return [lambda: network.evaluate_batch(corpus)]
+
+            cases += [
+                ('Bitboard.move/' + tag, bitboard_move),
+                ('Heuristic.evaluate_packed/' + tag, heuristic_packed),
+                ('NTuple.evaluate_packed/' + tag, ntuple_packed),
+                ('NTuple.evaluate_batch[{}]/'.format(CORPUS_BOARDS) + tag, ntuple_batch),
+            ]
+        if quick:
+            continue
+        for mode, depth, kinds in (('sample', None, SAMPLE_KINDS), ('expectimax', 2, FILL)):
+            for kind in kinds:
+
+                def ai_get_next(corpus=make_corpus(size, kind), mode=mode, depth=depth):
+                    ai = Ai(seed=0, mode=mode, depth=depth, workers=0)
+                    # A fresh cache per board keeps the calls independent of each other
+                    return [lambda t=t: (ai.clear_cache(), ai.get_next(t)) for t in corpus[:8]]
+
+                cases.append(('Ai.get_next[{}]/{}x{}/{}'.format(mode, size, size, kind), ai_get_next))
+    return cases
+
+
+def time_calls(calls, repeat=5, min_time=0.05):
+    """
+    Time a list of calls.
+
+    Args:
+        calls (list): The calls to time.
+        repeat (int): The number of measurements; the fastest one is kept (default: 5).
+        min_time (float): Run the calls in a loop until a measurement takes at least this long (default: 0.05).
+
+    Returns:
+        float: The time of one call in seconds.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            for call in calls:
+                call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            for call in calls:
+                call()
+        best = min(best, time.perf_counter() - start)
+    return best / (loops * len(calls))
+
+
+def machine_info():
+    """
+    Describe the machine and software the benchmarks ran on.
+
+    Returns:
+        dict: The metadata.
+    """
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(pattern=None, quick=False, repeat=5):
+    """
+    Run the benchmarks.
+
+    Args:
+        pattern (str): Only run the benchmarks whose name matches this regular expression (default: None).
+        quick (bool): Leave out the slow AI benchmarks (default: False).
+        repeat (int): The number of measurements of each benchmark (default: 5).
+
+    Returns:
+        dict: The machine metadata and the time per call of every benchmark, in seconds.
+    """
+    results = {}
+    for name, setup in benchmarks(quick):
+        if pattern and not re.search(pattern, name):
+            continue
+        with redirect_stdout(io.StringIO()):
+            results[name] = time_calls(setup(), repeat)
+        print('{:<55} {:>12.2f} us'.format(name, results[name] * 1e6))
+    return {'meta': machine_info(), 'results': results}
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Compare results with a baseline.
+
+    Args:
+        current (dict): The results of run.
+        baseline (dict): The saved results to compare with.
+        threshold (float): The relative slowdown that counts as a regression (default: 0.1).
+
+    Returns:
+        list: The names of the benchmarks that regressed.
+    """
+    regressions = []
+    old = baseline['results']
+    for name, seconds in current['results'].items():
+        if name not in old:
+            continue
+        ratio = seconds / old[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print('{:<55} {:>7.2f}x {}'.format(name, ratio, flag))
+    if baseline.get('meta', {}).get('platform') != current['meta']['platform']:
+        print('Warning: the baseline was recorded on a different platform')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the engine and AI hot paths.')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown flagged as a regression')
+    parser.add_argument('--filter', help='only run benchmarks matching this regular expression')
+    parser.add_argument('--quick', action='store_true', help='skip the AI benchmarks')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements per benchmark')
+    args = parser.parse_args(argv)
+
+    current = run(args.filter, args.quick, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,400 @@
+"""
+Packed 4x4 board engine.
+
+A board is a single 64-bit integer holding one 4-bit exponent per cell
+(0 = empty, e = tile 2**e). Cell (x, y) lives at bit 4 * (4 * y + x), so each
+row is a 16-bit group and moves are done with 65536-entry row lookup tables
+that are computed once, on first use.
+
+Tiles are limited to 2**15 = 32768; two 32768 tiles are never merged.
+"""
+
+import numpy as np
+
+SIZE = 4
+CELL_BITS = 4
+ROW_BITS = SIZE * CELL_BITS
+ROW_MASK = (1 << ROW_BITS) - 1
+CELL_MASK = (1 << CELL_BITS) - 1
+MAX_EXPONENT = CELL_MASK
+
+# Directions in the same order as Game.nmap
+DIRECTIONS = 'URDL'
+
+_row_left = None
+_row_right = None
+_score_left = None
+_score_right = None
+
+
+def move_row(cells, max_exponent=MAX_EXPONENT):
+    """
+    Move a row of exponents towards index 0, exactly like Grid.move_hl.
+
+    Args:
+        cells (list): The exponents of the row, modified in place.
+        max_exponent (int): Tiles of this exponent are never merged (default: MAX_EXPONENT).
+
+    Returns:
+        int: The score of the move, counted the same way as Grid.move_hl.
+    """
+    score = 0
+    len_hl = len(cells)
+    for i in range(len_hl - 1):
+        if cells[i] == 0:
+            for j in range(i + 1, len_hl):
+                if cells[j] != 0:
+                    cells[i] = cells[j]
+                    cells[j] = 0
+                    score += 1
+                    break
+        if cells[i] == 0:
+            break
+        for j in range(i + 1, len_hl):
+            if cells[j] == cells[i] and cells[i] < max_exponent:
+                score += 1 << cells[j]
+                cells[i] += 1
+                cells[j] = 0
+                break
+            if cells[j] != 0:
+                break
+    return score
+
+
+def row_cells(row):
+    """Split a packed row into a list of exponents, index 0 first."""
+    return [(row >> (CELL_BITS * i)) & CELL_MASK for i in range(SIZE)]
+
+
+def cells_row(cells):
+    """Pack a list of exponents (index 0 first) into a row."""
+    row = 0
+    for i, e in enumerate(cells):
+        row |= e << (CELL_BITS * i)
+    return row
+
+
+def reverse_row(row):
+    """Reverse the order of the cells in a packed row."""
+    return cells_row(row_cells(row)[::-1])
+
+
+def init_tables():
+    """Build the row move tables if they have not been built yet."""
+    global _row_left, _row_right, _score_left, _score_right
+    if _row_left is not None:
+        return
+    n = 1 << ROW_BITS
+    row_left = [0] * n
+    row_right = [0] * n
+    score_left = [0] * n
+    score_right = [0] * n
+    for row in range(n):
+        cells = row_cells(row)
+        score = move_row(cells)
+        result = cells_row(cells)
+        row_left[row] = result
+        score_left[row] = score
+        rev = reverse_row(row)
+        row_right[rev] = reverse_row(result)
+        score_right[rev] = score
+    _row_left, _row_right = row_left, row_right
+    _score_left, _score_right = score_left, score_right
+
+
+def pack(tiles):
+    """
+    Pack a 4x4 array of tile values into a board.
+
+    Args:
+        tiles (np.ndarray): The tile values.
+
+    Returns:
+        int: The packed board.
+    """
+    board = 0
+    shift = 0
+    for row in tiles:
+        for v in row:
+            v = int(v)
+            if v:
+                board |= (v.bit_length() - 1) << shift
+            shift += CELL_BITS
+    return board
+
+
+def unpack(board):
+    """
+    Unpack a board into a 4x4 array of tile values.
+
+    Args:
+        board (int): The packed board.
+
+    Returns:
+        np.ndarray: The tile values as an int32 array.
+    """
+    tiles = np.zeros((SIZE, SIZE), dtype=np.int32)
+    for i in range(SIZE * SIZE):
+        e = (board >> (CELL_BITS * i)) & CELL_MASK
+        if e:
+            tiles[i // SIZE][i % SIZE] = 1 << e
+    return tiles
+
+
+def pack_exponents(exponents):
+    """
+    Pack a 4x4 array of tile exponents (0 for an empty cell) into a board.
+
+    Args:
+        exponents (np.ndarray): The exponents.
+
+    Returns:
+        int: The packed board.
+    """
+    board = 0
+    shift = 0
+    for e in np.asarray(exponents).ravel().tolist():
+        board |= e << shift
+        shift += CELL_BITS
+    return board
+
+
+def unpack_exponents(board):
+    """
+    Unpack a board into a 4x4 array of tile exponents.
+
+    Args:
+        board (int): The packed board.
+
+    Returns:
+        np.ndarray: The exponents as a uint8 array.
+    """
+    return np.array([row_cells(board >> (ROW_BITS * y)) for y in range(SIZE)], dtype=np.uint8)
+
+
+def transpose(board):
+    """Transpose a board (swap x and y)."""
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def mirror(board):
+    """Reverse the order of the cells in every row (x -> 3 - x)."""
+    return (
+        ((board & 0x000F000F000F000F) << 12)
+        | ((board & 0x00F000F000F000F0) << 4)
+        | ((board >> 4) & 0x00F000F000F000F0)
+        | ((board >> 12) & 0x000F000F000F000F)
+    )
+
+
+def flip(board):
+    """Reverse the order of the rows (y -> 3 - y)."""
+    return (
+        ((board & 0xFFFF) << 48)
+        | (((board >> 16) & 0xFFFF) << 32)
+        | (((board >> 32) & 0xFFFF) << 16)
+        | (board >> 48)
+    )
+
+
+def symmetries(board):
+    """
+    Get the 8 rotations and reflections of a board.
+
+    Args:
+        board (int): The packed board.
+
+    Returns:
+        list: Transform k of the board at index k (see apply_symmetry), the identity first.
+    """
+    f = flip(board)
+    t = transpose(board)
+    tf = flip(t)
+    return [board, mirror(board), f, mirror(f), t, mirror(t), tf, mirror(tf)]
+
+
+def apply_symmetry(board, k):
+    """
+    Apply one of the 8 rotations and reflections to a board.
+
+    Transform k transposes the board if bit 2 of k is set, then flips it if bit 1 is set, then
+    mirrors it if bit 0 is set. Every transform is its own inverse except 6 and 5, which undo each other.
+
+    Args:
+        board (int): The packed board.
+        k (int): The transform, 0-7.
+
+    Returns:
+        int: The transformed board.
+    """
+    if k & 4:
+        board = transpose(board)
+    if k & 2:
+        board = flip(board)
+    if k & 1:
+        board = mirror(board)
+    return board
+
+
+def canonical(board):
+    """
+    Get the canonical form of a board, the smallest of its 8 symmetries.
+
+    Boards that are rotations or reflections of each other have the same canonical form, so it
+    can key caches and tables of anything that does not depend on the orientation.
+
+    Args:
+        board (int): The packed board.
+
+    Returns:
+        tuple: The canonical board and the transform k that gives it (apply_symmetry(board, k)).
+    """
+    boards = symmetries(board)
+    best = min(boards)
+    return best, boards.index(best)
+
+
+def canonical_key(board):
+    """Get the canonical form of a board without the transform."""
+    return min(symmetries(board))
+
+
+def _direction_maps():
+    swaps = ({'U': 'L', 'L': 'U', 'D': 'R', 'R': 'D'}, {'U': 'D', 'D': 'U'}, {'L': 'R', 'R': 'L'})
+    maps = []
+    for k in range(8):
+        forward = {}
+        for d in DIRECTIONS:
+            t = d
+            for bit, swap in zip((4, 2, 1), swaps):
+                if k & bit:
+                    t = swap.get(t, t)
+            forward[d] = t
+        maps.append((forward, {t: d for d, t in forward.items()}))
+    return maps
+
+
+# For each transform: the direction on the transformed board of a move, and back
+_DIRECTION_MAPS = _direction_maps()
+
+
+def transform_direction(direction, k):
+    """
+    Map a move to the same move on a transformed board.
+
+    move(apply_symmetry(board, k), transform_direction(d, k)) is the transform of move(board, d).
+
+    Args:
+        direction (str): The direction ('U', 'D', 'L', 'R').
+        k (int): The transform, 0-7.
+
+    Returns:
+        str: The direction on the transformed board.
+    """
+    return _DIRECTION_MAPS[k][0][direction]
+
+
+def inverse_direction(direction, k):
+    """
+    Map a move on a transformed board back to the original board (undoes transform_direction).
+
+    Args:
+        direction (str): The direction on the transformed board.
+        k (int): The transform, 0-7.
+
+    Returns:
+        str: The direction on the original board.
+    """
+    return _DIRECTION_MAPS[k][1][direction]
+
+
+def _move_rows(board, rows, scores):
+    new = 0
+    score = 0
+    for shift in (0, 16, 32, 48):
+        row = (board >> shift) & ROW_MASK
+        new |= rows[row] << shift
+        score += scores[row]
+    return new, score
+
+
+def move(board, direction):
+    """
+    Move a board in the given direction.
+
+    Args:
+        board (int): The packed board.
+        direction (str|int): The direction ('U', 'D', 'L', 'R' or 0-3 as in Game.nmap).
+
+    Returns:
+        tuple: The new board and the score of the move, as Grid.run would return it.
+    """
+    if _row_left is None:
+        init_tables()
+    if isinstance(direction, int):
+        direction = DIRECTIONS[direction]
+    if direction == 'L':
+        return _move_rows(board, _row_left, _score_left)
+    if direction == 'R':
+        return _move_rows(board, _row_right, _score_right)
+    if direction == 'U':
+        new, score = _move_rows(transpose(board), _row_left, _score_left)
+    else:
+        new, score = _move_rows(transpose(board), _row_right, _score_right)
+    return transpose(new), score
+
+
+def empty_shifts(board):
+    """
+    Get the bit offsets of the empty cells of a board.
+
+    Args:
+        board (int): The packed board.
+
+    Returns:
+        list: The bit offsets of the empty cells, in cell order.
+    """
+    return [s for s in range(0, SIZE * SIZE * CELL_BITS, CELL_BITS) if not (board >> s) & CELL_MASK]
+
+
+def board_full(board):
+    """Check whether a board has no empty cell."""
+    for s in range(0, SIZE * SIZE * CELL_BITS, CELL_BITS):
+        if not (board >> s) & CELL_MASK:
+            return False
+    return True
+
+
+def count_empty(board):
+    """Count the empty cells of a board."""
+    return len(empty_shifts(board))
+
+
+def max_exponent(board):
+    """Get the largest exponent on a board."""
+    return max((board >> s) & CELL_MASK for s in range(0, SIZE * SIZE * CELL_BITS, CELL_BITS))
+
+
+def is_over(board):
+    """
+    Check whether no move changes the board.
+
+    Args:
+        board (int): The packed board.
+
+    Returns:
+        bool: True if the game is over, False otherwise.
+    """
+    if not board_full(board):
+        return False
+    for direction in DIRECTIONS:
+        if move(board, direction)[0] != board:
+            return False
+    return True
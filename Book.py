@@ -0,0 +1,304 @@
+"""
+Opening book: best moves of common early positions, precomputed offline.
+
+The book is a file with a small header (format version, grid size, search
+depth, whether boards are stored in canonical form and a stamp of the
+evaluation) followed by entries sorted by packed board:
+
+    header | (board uint64, value float32, move uint8) * entries
+
+At run time the entries are memory-mapped and binary-searched, so opening a
+book costs nothing and a lookup a few microseconds. The stamp is a hash of
+the values the evaluation gives a fixed set of boards (and of the n-tuple
+weights), so a book built for another evaluation, or for an earlier version
+of the same heuristic, is refused instead of giving moves the current one
+would not make. With a symmetric evaluation the boards are stored in canonical form
+(Bitboard.canonical) and a move is mapped back to the board it is asked for.
+
+Build a book from the positions of the first moves of self-play games:
+
+    python -m Book --out book.bin --games 500 --moves 12 --depth 4 --max-entries 20000
+"""
+
+import argparse
+import hashlib
+import itertools
+import struct
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import Bitboard
+import Heuristic
+import NTuple
+from Bitboard import DIRECTIONS
+from Cache import TranspositionTable
+from Search import Expectimax
+
+MAGIC = b'2048BOOK'
+VERSION = 1
+# Magic, version, grid size, search depth, canonical boards, stamp (SHA-1 of the evaluation), entries
+HEADER = struct.Struct('<8sHHH?x20sq')
+ENTRY_DTYPE = np.dtype([('board', '<u8'), ('value', '<f4'), ('move', 'u1')], align=True)
+BOOK = 'book.bin'
+# Boards evaluated for the stamp of an evaluation
+STAMP_BOARDS = 256
+
+
+def evaluator_stamp(heuristic, weights=None):
+    """
+    Get the stamp of an evaluation, which changes whenever its values can change.
+
+    The stamp hashes the values the evaluation gives a fixed, seeded set of boards (as float32, the
+    precision of the book values), so any change to how the heuristic is computed changes it, and
+    for the 'ntuple' heuristic the weights file as well.
+
+    Args:
+        heuristic (str): The heuristic mode.
+        weights (str): The weights file of the 'ntuple' heuristic (default: NTuple.WEIGHTS).
+
+    Returns:
+        bytes: A 20-byte digest.
+    """
+    digest = hashlib.sha1('{}:{}'.format(VERSION, heuristic).encode())
+    packed, _ = Heuristic.evaluator(heuristic, weights)
+    values = [packed(board) for board in stamp_boards()]
+    digest.update(np.array(values, dtype='<f4').tobytes())
+    if heuristic == 'ntuple':
+        with open(weights or NTuple.WEIGHTS, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.digest()
+
+
+def stamp_boards(n=STAMP_BOARDS, seed=0):
+    """
+    Get the boards evaluated for the stamp of an evaluation.
+
+    Args:
+        n (int): The number of boards (default: STAMP_BOARDS).
+        seed (int): The seed (default: 0).
+
+    Returns:
+        list: Packed 4x4 boards with every exponent and many empty cells.
+    """
+    rng = np.random.default_rng(seed)
+    exponents = rng.integers(1, Bitboard.CELL_MASK + 1, (n, Bitboard.SIZE, Bitboard.SIZE))
+    exponents[rng.random(exponents.shape) < 0.4] = 0
+    return [Bitboard.pack_exponents(e) for e in exponents]
+
+
+class OpeningBook:
+    """Memory-mapped, read-only opening book."""
+
+    def __init__(self, path, stamp=None):
+        """
+        Open a book.
+
+        Args:
+            path (str): The book file.
+            stamp (bytes): The stamp the book must have been built with, see evaluator_stamp (default: None,
+                any stamp).
+        """
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if len(self.data) < HEADER.size:
+            raise ValueError('Not an opening book: {}'.format(path))
+        magic, version, self.size, self.depth, self.canonical, self.stamp, count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not an opening book (or an unknown version): {}'.format(path))
+        if stamp is not None and stamp != self.stamp:
+            raise ValueError('The opening book {} was built for another evaluation'.format(path))
+        if len(self.data) < HEADER.size + count * ENTRY_DTYPE.itemsize:
+            raise ValueError('Truncated opening book: {}'.format(path))
+        end = HEADER.size + count * ENTRY_DTYPE.itemsize
+        self.entries = self.data[HEADER.size:end].view(ENTRY_DTYPE)
+        self.boards = self.entries['board']
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """The number of positions."""
+        return len(self.entries)
+
+    def close(self):
+        """Release the memory map."""
+        self.data = self.entries = self.boards = None
+
+    def lookup(self, board):
+        """
+        Look up a packed 4x4 board.
+
+        Args:
+            board (int): The packed board.
+
+        Returns:
+            tuple: The best direction for the board and its value, or None if the board is not in the book.
+        """
+        k = 0
+        if self.canonical:
+            board, k = Bitboard.canonical(board)
+        i = int(np.searchsorted(self.boards, np.uint64(board)))
+        if i == len(self.boards) or int(self.boards[i]) != board:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = self.entries[i]
+        direction = DIRECTIONS[int(entry['move'])]
+        if k:
+            direction = Bitboard.inverse_direction(direction, k)
+        return direction, float(entry['value'])
+
+
+def write(path, entries, depth, canonical, stamp):
+    """
+    Write a book file.
+
+    Args:
+        path (str): The file to write.
+        entries (dict): Packed board -> (direction, value).
+        depth (int): The depth of the searches behind the entries.
+        canonical (bool): Whether the boards are in canonical form.
+        stamp (bytes): The stamp of the evaluation.
+    """
+    table = np.zeros(len(entries), dtype=ENTRY_DTYPE)
+    for row, board in zip(table, sorted(entries)):
+        direction, value = entries[board]
+        row['board'] = board
+        row['value'] = value
+        row['move'] = DIRECTIONS.index(direction)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, Bitboard.SIZE, depth, canonical, stamp, len(table)))
+        f.write(table.tobytes())
+
+
+def start_boards():
+    """Get every board a game can start from (two tiles of 2 or 4)."""
+    boards = []
+    for a, b in itertools.combinations(range(Bitboard.SIZE * Bitboard.SIZE), 2):
+        for ea, eb in itertools.product((1, 2), repeat=2):
+            boards.append((ea << (Bitboard.CELL_BITS * a)) | (eb << (Bitboard.CELL_BITS * b)))
+    return boards
+
+
+def _opening(args):
+    """Play the first moves of one seeded game and return the boards met before each move."""
+    from Game import Game
+    from PlayerAI import Ai
+    from Simulate import game_seed
+
+    seed, index, moves, heuristic = args
+    game = Game(Bitboard.SIZE, engine='bitboard', seed=game_seed(seed, index))
+    ai = Ai(seed=index, mode='expectimax', heuristic=heuristic, workers=0)
+    boards = []
+    for _ in range(moves):
+        if game.state != 'run':
+            break
+        boards.append(game.grid.board)
+        game.run(ai.get_next(game.grid.exponents, exponents=True)[0])
+    ai.close()
+    return boards
+
+
+_search = None
+
+
+def _init_search(heuristic, weights, depth, prob_cutoff):
+    global _search
+    evaluate, _ = Heuristic.evaluator(heuristic, weights)
+    _search = Expectimax(evaluate, depth, prob_cutoff, TranspositionTable(64 << 20, policy='depth'))
+
+
+def _solve(board):
+    # Cached values depend on the probability of the path they were reached by, so each position gets a clean
+    # cache and the book holds exactly what a search of the position alone finds
+    _search.cache.clear()
+    direction, value = _search.search(board)
+    return board, direction, value
+
+
+def build(path, heuristic='compat', weights=None, games=500, moves=12, depth=4, prob_cutoff=1e-4,
+          max_entries=1 << 15, seed=0, workers=1):
+    """
+    Build a book from every starting board and the most common boards of the first moves of self-play games.
+
+    Args:
+        path (str): The book file to write.
+        heuristic (str): The heuristic mode the book is for (default: 'compat').
+        weights (str): The weights file of the 'ntuple' heuristic (default: NTuple.WEIGHTS).
+        games (int): The number of self-play games to collect positions from (default: 500).
+        moves (int): The number of moves of each game to collect (default: 12).
+        depth (int): The depth of the search of every position (default: 4).
+        prob_cutoff (float): The probability cutoff of the searches (default: 1e-4).
+        max_entries (int): The largest number of positions, which bounds the size of the file (default: 32768).
+        seed (int): The seed of the self-play games (default: 0).
+        workers (int): The number of worker processes (default: 1).
+
+    Returns:
+        int: The number of positions written.
+    """
+    Bitboard.init_tables()
+    canonical = Heuristic.is_symmetric(heuristic)
+    key = Bitboard.canonical_key if canonical else (lambda board: board)
+    counts = Counter()
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        run = map if executor is None else executor.map
+        for boards in run(_opening, [(seed, i, moves, heuristic) for i in range(games)]):
+            counts.update(key(board) for board in boards)
+        # Starting boards go first, then the most common boards, ties by board for a reproducible book
+        chosen = dict.fromkeys(key(board) for board in start_boards())
+        for board, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+            if len(chosen) >= max_entries:
+                break
+            chosen[board] = None
+        chosen = list(chosen)[:max_entries]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    entries = {}
+    start = time.time()
+    args = (heuristic, weights, depth, prob_cutoff)
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=_init_search, initargs=args)
+        solved = executor.map(_solve, chosen, chunksize=16)
+    else:
+        executor = None
+        _init_search(*args)
+        solved = map(_solve, chosen)
+    try:
+        for n, (board, direction, value) in enumerate(solved, 1):
+            if direction is not None:
+                entries[board] = (direction, value)
+            if n % 1000 == 0:
+                print('{:>8} / {} positions  {:.0f}s'.format(n, len(chosen), time.time() - start), flush=True)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    write(path, entries, depth, canonical, evaluator_stamp(heuristic, weights))
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build an opening book by deep searches of early positions.')
+    parser.add_argument('--out', default=BOOK, help='book file to write')
+    parser.add_argument('--heuristic', default='compat', choices=Heuristic.EVALUATORS, help='evaluation')
+    parser.add_argument('--weights', default=None, help='weights file of the ntuple heuristic')
+    parser.add_argument('--games', type=int, default=500, help='self-play games to collect positions from')
+    parser.add_argument('--moves', type=int, default=12, help='moves collected from each game')
+    parser.add_argument('--depth', type=int, default=4, help='search depth of every position')
+    parser.add_argument('--max-entries', type=int, default=1 << 15, help='largest number of positions')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the self-play games')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    n = build(args.out, args.heuristic, args.weights, args.games, args.moves, args.depth,
+              max_entries=args.max_entries, seed=args.seed, workers=args.workers)
+    print('{} positions written to {} in {:.0f}s'.format(n, args.out, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
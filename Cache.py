@@ -0,0 +1,100 @@
+"""
+Transposition table for board evaluations and search results.
+
+Entries map a compact board key (a packed board or the board bytes) to a
+value and the search depth it was computed at. The table is bounded; when it
+is full the least recently used entry is dropped, or with the 'depth' policy
+the shallowest of the few least recently used entries.
+"""
+
+from collections import OrderedDict
+from itertools import islice
+
+# Rough size of one entry (dict slot, key, value tuple), used to turn a memory cap into an entry count
+ENTRY_BYTES = 200
+# Number of least recently used entries the 'depth' policy chooses from
+DEPTH_WINDOW = 8
+
+
+class TranspositionTable:
+    """Bounded key -> (depth, value) table with hit and miss counters."""
+
+    def __init__(self, max_bytes=64 << 20, policy='lru'):
+        """
+        Initialize the table.
+
+        Args:
+            max_bytes (int): Approximate memory cap in bytes (default: 64 MB).
+            policy (str): Eviction policy, 'lru' or 'depth' (default: 'lru').
+        """
+        if policy not in ('lru', 'depth'):
+            raise ValueError('Unknown eviction policy: {}'.format(policy))
+        self.max_entries = max(1, max_bytes // ENTRY_BYTES)
+        self.policy = policy
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, depth=0):
+        """
+        Look up a key.
+
+        Args:
+            key: The board key.
+            depth (int): The minimum depth the stored value must have been computed at (default: 0).
+
+        Returns:
+            The stored value, or None on a miss.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < depth:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value, depth=0):
+        """
+        Store a value, evicting an old entry if the table is full.
+
+        Args:
+            key: The board key.
+            value: The value to store.
+            depth (int): The depth the value was computed at (default: 0).
+        """
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+        elif len(entries) >= self.max_entries:
+            self.evict()
+        entries[key] = (depth, value)
+
+    def evict(self):
+        """Remove one entry according to the eviction policy."""
+        if self.policy == 'lru':
+            self.entries.popitem(last=False)
+            return
+        oldest = islice(self.entries.items(), DEPTH_WINDOW)
+        key = min(oldest, key=lambda item: item[1][0])[0]
+        del self.entries[key]
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        """float: The fraction of lookups that were hits."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return 'TranspositionTable({}/{} entries, {} hits, {} misses)'.format(
+            len(self.entries), self.max_entries, self.hits, self.misses
+        )
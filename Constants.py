@@ -9,6 +9,47 @@ class Base:
     SIZE_8x8 = 8
     FPS = 60
     DEBUG = False
+    # Grid engine: 'numpy' (Game.Grid), 'exponent' (Game.ExpGrid, uint8 exponents) or 'bitboard'
+    # (Game.BitGrid, packed boards of any size)
+    ENGINE = 'numpy'
+    # AI: 'sample' (random sequences), 'expectimax' or 'rollout' (Monte Carlo playouts, see Rollout)
+    AI_MODE = 'sample'
+    # Sample mode: random outcomes per sequence of three moves, (number of tiles) ** 2 clamped to these
+    SAMPLE_MIN = 20
+    SAMPLE_MAX = 40
+    SEARCH_DEPTH = 2
+    PROB_CUTOFF = 0.001
+    # Deepest iteration of a search with a deadline, and the least time a move may take in Main
+    MAX_DEPTH = 6
+    MIN_THINK_TIME = 0.05
+    # Rollout mode: playouts per root move, moves per playout (None = to the end), 'random' or 'greedy' moves,
+    # playouts per move advanced together, and seconds per move when there is no deadline (None = no limit)
+    ROLLOUTS = 256
+    ROLLOUT_DEPTH = None
+    ROLLOUT_POLICY = 'random'
+    ROLLOUT_BATCH = 64
+    ROLLOUT_TIME = None
+    # Heuristic: 'compat' (same scores as Ai.get_score), 'log2' (tile exponents), 'corners' (best corner)
+    # or 'ntuple' (NTuple network); the last two give symmetric boards the same value
+    HEURISTIC = 'compat'
+    # Key the AI caches by the canonical form of a board (Bitboard.canonical) with a symmetric heuristic;
+    # a search rarely meets two symmetric boards, so it only pays off when positions recur across moves
+    CANONICAL_CACHE = False
+    # Weights of the 'ntuple' heuristic, trained with python -m NTuple
+    NTUPLE_WEIGHTS = 'ntuple.npy'
+    # Memory cap of each AI cache (evaluations, search results)
+    CACHE_BYTES = 64 << 20
+    # Parallel root search: worker processes (0 = serial), split by first move (1) or first move and spawn (2)
+    WORKERS = 0
+    PARALLEL_SPLIT = 1
+    # Clear the worker search caches before every root branch: results no longer depend on which worker
+    # searched a branch, but every move is searched from scratch
+    PARALLEL_FRESH_CACHE = False
+    # Opening book of the heuristic (python -m Book), None to always search; a book built for another
+    # evaluation is ignored
+    OPENING_BOOK = None
+    # Directory Main records every game to (see Recording), None to not record
+    RECORD_DIR = None
     COLORS = {
         '0': (205, 193, 180),
         '2': (238, 228, 218),
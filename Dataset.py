@@ -0,0 +1,243 @@
+"""
+Self-play datasets.
+
+Positions from AI games are stored column by column in fixed-size shards of
+.npy files, one file per column and shard:
+
+    <directory>/shard-00000.board.npy     uint8 (rows, cells), tile exponents
+    <directory>/shard-00000.move.npy      uint8 (rows,), index of the move in DIRECTIONS
+    <directory>/shard-00000.values.npy    float32 (rows, 4), value of each move, NaN if not considered
+    <directory>/shard-00000.game.npy      int64 (rows,), the id (seed) of the game
+    <directory>/shard-00000.step.npy      int32 (rows,), the number of the move in the game
+    <directory>/shard-00000.score.npy     int64 (rows,), the final score of the game
+    <directory>/shard-00000.max_tile.npy  int32 (rows,), the final largest tile of the game
+    <directory>/index.json                the grid size and the number of rows of every shard
+
+DatasetWriter takes whole games, since the outcome is only known at the end,
+and writes them to memory-mapped shards on a background thread so the game
+loop never waits for the disk. DatasetReader memory-maps the shards and
+yields batches without loading the dataset into memory.
+"""
+
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+from Bitboard import DIRECTIONS
+from Game import to_exponents, to_values
+
+VERSION = 1
+INDEX = 'index.json'
+
+
+def columns(size):
+    """
+    Get the columns of a dataset of a grid size.
+
+    Args:
+        size (int): The size of the grid.
+
+    Returns:
+        dict: name -> (dtype, shape of one row).
+    """
+    return {
+        'board': (np.uint8, (size * size,)),
+        'move': (np.uint8, ()),
+        'values': (np.float32, (len(DIRECTIONS),)),
+        'game': (np.int64, ()),
+        'step': (np.int32, ()),
+        'score': (np.int64, ()),
+        'max_tile': (np.int32, ()),
+    }
+
+
+def shard_path(directory, shard, column):
+    """Get the file of one column of one shard."""
+    return os.path.join(directory, 'shard-{:05d}.{}.npy'.format(shard, column))
+
+
+class DatasetWriter:
+    """Appends self-play games to a sharded dataset from a background thread."""
+
+    def __init__(self, directory, size=4, shard_rows=1 << 16, max_pending=64):
+        """
+        Create the dataset directory and start the writer thread.
+
+        Args:
+            directory (str): The dataset directory; existing shards in it are overwritten.
+            size (int): The size of the grid (default: 4).
+            shard_rows (int): The number of rows of a shard (default: 65536).
+            max_pending (int): Games queued for writing before add_game waits for the disk (default: 64).
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.size = size
+        self.shard_rows = shard_rows
+        self.columns = columns(size)
+        self.shards = []  # Rows of every shard, the last one being filled
+        self.arrays = None
+        self.error = None
+        self.queue = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self._write_loop, name='DatasetWriter', daemon=True)
+        self.thread.start()
+
+    def add_game(self, boards, moves, values, game, score, max_tile, exponents=False):
+        """
+        Queue a finished game for writing.
+
+        Args:
+            boards (np.ndarray): The tile values before every move, shape (moves, size, size).
+            moves (sequence): The direction of every move ('U', 'R', 'D', 'L').
+            values (sequence): The value of every move considered at each position, as dicts direction -> value.
+            game (int): The id (seed) of the game.
+            score (int): The final score of the game.
+            max_tile (int): The final largest tile of the game.
+            exponents (bool): Whether the boards hold exponents instead of tile values (default: False).
+        """
+        if self.error is not None:
+            raise self.error
+        n = len(moves)
+        table = np.full((n, len(DIRECTIONS)), np.nan, dtype=np.float32)
+        for row, move_values in zip(table, values):
+            for d, v in move_values.items():
+                row[DIRECTIONS.index(d)] = v
+        rows = {
+            'board': (np.asarray(boards, dtype=np.uint8) if exponents else to_exponents(boards)).reshape(n, -1),
+            'move': np.array([DIRECTIONS.index(d) for d in moves], dtype=np.uint8),
+            'values': table,
+            'game': np.full(n, game, dtype=np.int64),
+            'step': np.arange(n, dtype=np.int32),
+            'score': np.full(n, score, dtype=np.int64),
+            'max_tile': np.full(n, max_tile, dtype=np.int32),
+        }
+        self.queue.put(rows)
+
+    def close(self):
+        """Write the queued games, flush the shards and write the index."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_loop(self):
+        try:
+            while True:
+                rows = self.queue.get()
+                if rows is None:
+                    break
+                self._write(rows)
+            self._flush()
+        except Exception as e:  # Reported to the game loop by add_game or close
+            self.error = e
+
+    def _write(self, rows):
+        n = len(rows['move'])
+        done = 0
+        while done < n:
+            if self.arrays is None or self.shards[-1] == self.shard_rows:
+                self._open_shard()
+            start = self.shards[-1]
+            count = min(n - done, self.shard_rows - start)
+            for name, array in self.arrays.items():
+                array[start:start + count] = rows[name][done:done + count]
+            self.shards[-1] += count
+            done += count
+
+    def _open_shard(self):
+        self._flush()
+        shard = len(self.shards)
+        self.arrays = {
+            name: np.lib.format.open_memmap(
+                shard_path(self.directory, shard, name), mode='w+', dtype=dtype, shape=(self.shard_rows,) + shape
+            )
+            for name, (dtype, shape) in self.columns.items()
+        }
+        self.shards.append(0)
+
+    def _flush(self):
+        if self.arrays is not None:
+            for array in self.arrays.values():
+                array.flush()
+        index = {'version': VERSION, 'size': self.size, 'shard_rows': self.shard_rows, 'shards': self.shards}
+        with open(os.path.join(self.directory, INDEX), 'w') as f:
+            json.dump(index, f)
+
+
+class DatasetReader:
+    """Lazy, memory-mapped view of a sharded dataset."""
+
+    def __init__(self, directory):
+        """
+        Open a dataset.
+
+        Args:
+            directory (str): The dataset directory.
+        """
+        with open(os.path.join(directory, INDEX)) as f:
+            index = json.load(f)
+        if index.get('version') != VERSION:
+            raise ValueError('Unknown dataset version: {}'.format(index.get('version')))
+        self.directory = directory
+        self.size = index['size']
+        self.shards = index['shards']
+        self.columns = columns(self.size)
+
+    def __len__(self):
+        """The number of rows."""
+        return sum(self.shards)
+
+    def shard(self, shard, names=None):
+        """
+        Memory-map one shard.
+
+        Args:
+            shard (int): The number of the shard.
+            names (iterable): The columns to open (default: all of them).
+
+        Returns:
+            dict: name -> read-only array of the rows written to the shard.
+        """
+        rows = self.shards[shard]
+        return {
+            name: np.load(shard_path(self.directory, shard, name), mmap_mode='r')[:rows]
+            for name in (names or self.columns)
+        }
+
+    def batches(self, batch_size=4096, names=None):
+        """
+        Iterate over the dataset in batches, one shard mapped at a time.
+
+        Args:
+            batch_size (int): The maximum number of rows of a batch (default: 4096).
+            names (iterable): The columns to read (default: all of them).
+
+        Yields:
+            dict: name -> array of the rows of the batch; a batch does not span two shards.
+        """
+        for shard in range(len(self.shards)):
+            arrays = self.shard(shard, names)
+            for start in range(0, self.shards[shard], batch_size):
+                yield {name: np.asarray(array[start:start + batch_size]) for name, array in arrays.items()}
+
+    def boards(self, exponents):
+        """
+        Convert a batch of stored boards back to tile values.
+
+        Args:
+            exponents (np.ndarray): The 'board' column of a batch.
+
+        Returns:
+            np.ndarray: The tile values, shape (rows, size, size), int32.
+        """
+        return to_values(exponents).reshape(-1, self.size, self.size)
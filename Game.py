@@ -1,25 +1,144 @@
 import random
 import numpy as np
 
+import Bitboard
+import Packed
+from Recording import Recorder
+
+# Highest exponent a Zobrist table covers; tiles are int32
+ZOBRIST_EXPONENTS = 32
+# Highest exponent ExpGrid stores (uint8), which is never merged
+MAX_EXPONENT = np.iinfo(np.uint8).max
+_zobrist = {}
+
+
+def zobrist_table(size):
+    """
+    Get the Zobrist keys of a grid size, built on first use.
+
+    The keys are fixed (seeded by the size), so hashes are the same in every process and run.
+
+    Args:
+        size (int): The size of the grid.
+
+    Returns:
+        np.ndarray: The keys, shape (size * size, ZOBRIST_EXPONENTS), uint64; the key of an empty
+            cell (exponent 0) is 0.
+    """
+    table = _zobrist.get(size)
+    if table is None:
+        table = np.random.default_rng(size).integers(
+            0, np.iinfo(np.uint64).max, (size * size, ZOBRIST_EXPONENTS), dtype=np.uint64, endpoint=True
+        )
+        table[:, 0] = 0
+        _zobrist[size] = table
+    return table
+
+
+def to_exponents(tiles):
+    """
+    Convert tile values to exponents (0 for an empty cell).
+
+    Args:
+        tiles (np.ndarray): Tile values, any shape.
+
+    Returns:
+        np.ndarray: The exponents, uint8, same shape.
+    """
+    return np.log2(np.maximum(np.asarray(tiles), 1)).astype(np.uint8)
+
+
+def to_values(exponents):
+    """
+    Convert exponents (0 for an empty cell) to tile values.
+
+    Args:
+        exponents (np.ndarray): Exponents, any shape.
+
+    Returns:
+        np.ndarray: The tile values, int32, same shape.
+    """
+    exponents = np.asarray(exponents)
+    return np.where(exponents > 0, np.left_shift(1, exponents.astype(np.int32)), 0).astype(np.int32)
+
+
+def legal_moves(tiles):
+    """
+    Find the directions in which a board can move.
+
+    Args:
+        tiles (np.ndarray): The tile values, or their exponents.
+
+    Returns:
+        int: A mask with bit i set if the move nmap[i] changes the board.
+    """
+    mask = 0
+    pairs = (
+        (tiles[:-1, :], tiles[1:, :]),  # U: the cell above receives from the cell below
+        (tiles[:, 1:], tiles[:, :-1]),  # R
+        (tiles[1:, :], tiles[:-1, :]),  # D
+        (tiles[:, :-1], tiles[:, 1:]),  # L
+    )
+    for i, (to, frm) in enumerate(pairs):
+        if ((frm != 0) & ((to == 0) | (to == frm))).any():
+            mask |= 1 << i
+    return mask
+
 
 class Grid:
     """Class representing the game grid."""
 
     size = 4
-    tiles = []
     max_tile = 0
 
-    def __init__(self, size=4):
+    def __init__(self, size=4, rng=None):
         """
         Initialize the grid.
 
         Args:
             size (int): The size of the grid (default: 4).
+            rng (random.Random): The random generator for new tiles (default: the random module).
         """
         self.size = size
         self.score = 0
+        self.rng = random if rng is None else rng
         self.tiles = np.zeros((size, size)).astype(np.int32)
 
+    @property
+    def tiles(self):
+        """np.ndarray: The tile values; assign to replace the whole board, use set_tiles for one tile."""
+        return self._tiles
+
+    @tiles.setter
+    def tiles(self, tiles):
+        self._tiles = tiles
+        self.reindex()
+
+    @property
+    def exponents(self):
+        """np.ndarray: The exponents of the tiles, uint8 (0 for an empty cell)."""
+        return to_exponents(self._tiles)
+
+    def reindex(self):
+        """
+        Rebuild the index of empty cells and the board summary from the tiles.
+
+        The empty cells are kept as a list of flat indices (y * size + x) plus the position of each
+        cell in that list (-1 if not empty), so a cell can be added or removed in O(1). The summary
+        is the largest tile (highest), the Zobrist hash of the board (hash) and the mask of legal
+        moves, which is worked out on first use after a change.
+        """
+        flat = self._tiles.ravel()
+        self.empty = np.flatnonzero(flat == 0).tolist()
+        self.empty_pos = [-1] * (self.size * self.size)
+        for pos, i in enumerate(self.empty):
+            self.empty_pos[i] = pos
+        self.zobrist = zobrist_table(self.size)
+        exponents = np.log2(np.maximum(flat, 1)).astype(np.intp)
+        self.hash = int(np.bitwise_xor.reduce(self.zobrist[np.arange(flat.size), exponents]))
+        self.highest = int(flat.max()) if flat.size else 0
+        self._legal = None
+
     def is_zero(self, x, y):
         """
         Check if the tile at the given coordinates is zero.
@@ -40,7 +159,27 @@ class Grid:
         Returns:
             bool: True if the grid is full, False otherwise.
         """
-        return 0 not in self.tiles
+        return not self.empty
+
+    def count_empty(self):
+        """
+        Get the number of empty cells.
+
+        Returns:
+            int: The number of empty cells.
+        """
+        return len(self.empty)
+
+    def legal_moves(self):
+        """
+        Get the directions in which the grid can move.
+
+        Returns:
+            int: A mask with bit i set if the move nmap[i] changes the grid.
+        """
+        if self._legal is None:
+            self._legal = legal_moves(self._tiles)
+        return self._legal
 
     def set_tiles(self, xy, number):
         """
@@ -50,20 +189,53 @@ class Grid:
             xy (tuple): The coordinates of the tile as a tuple (x, y).
             number (int): The value to set on the tile.
         """
-        self.tiles[xy[1]][xy[0]] = number
+        i = xy[1] * self.size + xy[0]
+        old = int(self._tiles[xy[1]][xy[0]])
+        was_empty = old == 0
+        self._tiles[xy[1]][xy[0]] = number
+        self.hash ^= int(self.zobrist[i, old.bit_length() - 1 if old else 0])
+        self.hash ^= int(self.zobrist[i, int(number).bit_length() - 1 if number else 0])
+        if number > self.highest:
+            self.highest = int(number)
+        elif old == self.highest and number < old:
+            self.highest = int(self._tiles.max())
+        self._legal = None
+        self.index_cell(i, was_empty, number == 0)
+
+    def index_cell(self, i, was_empty, is_empty):
+        """
+        Update the index of empty cells after one cell changed.
+
+        Args:
+            i (int): The flat index of the cell (y * size + x).
+            was_empty (bool): Whether the cell was empty before the change.
+            is_empty (bool): Whether the cell is empty now.
+        """
+        if was_empty and not is_empty:
+            # Swap the last empty cell into the freed slot
+            pos = self.empty_pos[i]
+            last = self.empty.pop()
+            if last != i:
+                self.empty[pos] = last
+                self.empty_pos[last] = pos
+            self.empty_pos[i] = -1
+        elif not was_empty and is_empty:
+            self.empty_pos[i] = len(self.empty)
+            self.empty.append(i)
 
     def get_random_xy(self):
         """
         Get random empty coordinates on the grid.
 
+        The index keeps the empty cells in no particular order, so the cell is picked among them in
+        cell order, as BitGrid picks it; every engine then spawns on the same cell for the same seed.
+
         Returns:
             tuple: The coordinates of an empty tile as a tuple (x, y), or (-1, -1) if the grid is full.
         """
         if not self.is_full():
-            while 1:
-                x, y = random.randint(0, self.size - 1), random.randint(0, self.size - 1)
-                if self.is_zero(x, y):
-                    return x, y
+            i = sorted(self.empty)[self.rng.randrange(len(self.empty))]
+            return i % self.size, i // self.size
         return -1, -1
 
     def add_tile_init(self):
@@ -72,10 +244,18 @@ class Grid:
         self.add_random_tile()
 
     def add_random_tile(self):
-        """Add a random tile (either 2 or 4) to the grid at an empty position."""
+        """
+        Add a random tile (either 2 or 4) to the grid at an empty position.
+
+        Returns:
+            tuple: ((x, y), value) of the new tile, or None if the grid is full.
+        """
         if not self.is_full():
-            value = 2 if random.random() < 0.9 else 4
-            self.set_tiles(self.get_random_xy(), value)
+            value = 2 if self.rng.random() < 0.9 else 4
+            xy = self.get_random_xy()
+            self.set_tiles(xy, value)
+            return xy, value
+        return None
 
     def run(self, direction, is_fake=False):
         """
@@ -95,6 +275,7 @@ class Grid:
             t = self.tiles.copy()
         else:
             t = self.tiles
+            before = t.ravel().tolist()
         if direction == 'U':
             for i in range(self.size):
                 self.move_hl(t[:, i])
@@ -107,8 +288,35 @@ class Grid:
         elif direction == 'R':
             for i in range(self.size):
                 self.move_hl(t[i, ::-1])
+        if not is_fake and self.score:
+            self.update_cells(before, t.ravel().tolist())
         return self.score
 
+    def update_cells(self, before, after):
+        """
+        Update the index of empty cells and the board summary after a move, cell by cell as set_tiles does.
+
+        A move never removes the largest tile, so highest can only grow.
+
+        Args:
+            before (list): The flat tile values before the move.
+            after (list): The flat tile values after the move.
+        """
+        zobrist = self.zobrist
+        h = self.hash
+        highest = self.highest
+        for i, old in enumerate(before):
+            new = after[i]
+            if new != old:
+                h ^= int(zobrist[i, old.bit_length() - 1 if old else 0])
+                h ^= int(zobrist[i, new.bit_length() - 1 if new else 0])
+                if new > highest:
+                    highest = new
+                self.index_cell(i, old == 0, new == 0)
+        self.hash = h
+        self.highest = highest
+        self._legal = None
+
     def move_hl(self, hl):
         """
         Move a single row or column.
@@ -147,13 +355,7 @@ class Grid:
         Returns:
             bool: True if the game is over, False otherwise.
         """
-        if not self.is_full():
-            return False
-        for y in range(self.size - 1):
-            for x in range(self.size - 1):
-                if self.tiles[y][x] == self.tiles[y][x + 1] or self.tiles[y][x] == self.tiles[y + 1][x]:
-                    return False
-        return True
+        return self.is_full() and not self.legal_moves()
 
     def is_win(self):
         """
@@ -162,10 +364,7 @@ class Grid:
         Returns:
             bool: True if the player has won, False otherwise.
         """
-        if self.max_tile > 0:
-            return self.max_tile in self.tiles
-        else:
-            return False
+        return 0 < self.max_tile <= self.highest
 
     def __str__(self):
         """
@@ -185,6 +384,246 @@ class Grid:
         return str_
 
 
+class ExpGrid(Grid):
+    """Grid storing the exponents of its tiles as uint8, a quarter of the memory of Grid's int32 values."""
+
+    def __init__(self, size=4, rng=None):
+        """
+        Initialize the grid.
+
+        Args:
+            size (int): The size of the grid (default: 4).
+            rng (random.Random): The random generator for new tiles (default: the random module).
+        """
+        self.size = size
+        self.score = 0
+        self.rng = random if rng is None else rng
+        self.exponents = np.zeros((size, size), dtype=np.uint8)
+
+    @property
+    def exponents(self):
+        """np.ndarray: The exponents of the tiles; assign to replace the whole board."""
+        return self._exponents
+
+    @exponents.setter
+    def exponents(self, exponents):
+        self._exponents = np.asarray(exponents, dtype=np.uint8)
+        self.reindex()
+
+    @property
+    def tiles(self):
+        """np.ndarray: A copy of the tile values, for display and scoring; assign to replace the whole board."""
+        return to_values(self._exponents)
+
+    @tiles.setter
+    def tiles(self, tiles):
+        self.exponents = to_exponents(tiles)
+
+    def reindex(self):
+        """Rebuild the index of empty cells and the board summary from the exponents, as Grid.reindex does."""
+        flat = self._exponents.ravel()
+        self.empty = np.flatnonzero(flat == 0).tolist()
+        self.empty_pos = [-1] * (self.size * self.size)
+        for pos, i in enumerate(self.empty):
+            self.empty_pos[i] = pos
+        self.zobrist = zobrist_table(self.size)
+        self.hash = int(np.bitwise_xor.reduce(self.zobrist[np.arange(flat.size), flat]))
+        e = int(flat.max()) if flat.size else 0
+        self.highest = 1 << e if e else 0
+        self._legal = None
+
+    def is_zero(self, x, y):
+        return self._exponents[y][x] == 0
+
+    def legal_moves(self):
+        if self._legal is None:
+            self._legal = legal_moves(self._exponents)
+        return self._legal
+
+    def set_tiles(self, xy, number):
+        self.set_exponent(xy, int(number).bit_length() - 1 if number else 0)
+
+    def set_exponent(self, xy, e):
+        """
+        Set the exponent of a tile at the given coordinates.
+
+        Args:
+            xy (tuple): The coordinates of the tile as a tuple (x, y).
+            e (int): The exponent, 0 for an empty cell.
+        """
+        i = xy[1] * self.size + xy[0]
+        old = int(self._exponents[xy[1]][xy[0]])
+        self._exponents[xy[1]][xy[0]] = e
+        self.hash ^= int(self.zobrist[i, old]) ^ int(self.zobrist[i, e])
+        highest = self.highest.bit_length() - 1 if self.highest else 0
+        if e > highest:
+            self.highest = 1 << e
+        elif old == highest and e < old:
+            top = int(self._exponents.max())
+            self.highest = 1 << top if top else 0
+        self._legal = None
+        self.index_cell(i, old == 0, e == 0)
+
+    def run(self, direction, is_fake=False):
+        if isinstance(direction, int):
+            direction = nmap[direction]
+        self.score = 0
+        t = self._exponents.copy() if is_fake else self._exponents
+        before = None if is_fake else t.ravel().tolist()
+        if direction == 'U':
+            for i in range(self.size):
+                self.move_hl(t[:, i])
+        elif direction == 'D':
+            for i in range(self.size):
+                self.move_hl(t[::-1, i])
+        elif direction == 'L':
+            for i in range(self.size):
+                self.move_hl(t[i, :])
+        elif direction == 'R':
+            for i in range(self.size):
+                self.move_hl(t[i, ::-1])
+        if not is_fake and self.score:
+            self.update_cells(before, t.ravel().tolist())
+        return self.score
+
+    def update_cells(self, before, after):
+        """Update the index of empty cells and the board summary after a move, from the exponents."""
+        zobrist = self.zobrist
+        h = self.hash
+        top = self.highest.bit_length() - 1 if self.highest else 0
+        for i, old in enumerate(before):
+            new = after[i]
+            if new != old:
+                h ^= int(zobrist[i, old]) ^ int(zobrist[i, new])
+                if new > top:
+                    top = new
+                self.index_cell(i, old == 0, new == 0)
+        self.hash = h
+        self.highest = 1 << top if top else 0
+        self._legal = None
+
+    def move_hl(self, hl):
+        """
+        Move a single row or column of exponents, scoring like Grid.move_hl.
+
+        Args:
+            hl (np.ndarray): The exponents of the row or column, modified in place.
+
+        Returns:
+            np.ndarray: The moved row or column.
+        """
+        cells = hl.tolist()
+        self.score += Bitboard.move_row(cells, MAX_EXPONENT)
+        hl[:] = cells
+        return hl
+
+
+class BitGrid(Grid):
+    """Grid backed by a packed board and move tables (Bitboard for 4x4, Packed for other sizes)."""
+
+    def __init__(self, size=4, rng=None):
+        """
+        Initialize the grid.
+
+        Args:
+            size (int): The size of the grid.
+            rng (random.Random): The random generator for new tiles (default: the random module).
+        """
+        self.size = size
+        self.score = 0
+        self.rng = random if rng is None else rng
+        self.engine = Packed.engine(size)
+        self.board = 0
+
+    @property
+    def tiles(self):
+        """np.ndarray: A copy of the tile values; assign to replace the whole board."""
+        return self.engine.unpack(self.board)
+
+    @tiles.setter
+    def tiles(self, tiles):
+        self.board = self.engine.pack(tiles)
+
+    @property
+    def exponents(self):
+        """np.ndarray: A copy of the exponents of the tiles, uint8; assign to replace the whole board."""
+        return self.engine.unpack_exponents(self.board)
+
+    @exponents.setter
+    def exponents(self, exponents):
+        self.board = self.engine.pack_exponents(exponents)
+
+    def is_zero(self, x, y):
+        shift = self.engine.CELL_BITS * (y * self.size + x)
+        return not (self.board >> shift) & self.engine.CELL_MASK
+
+    def is_full(self):
+        return self.engine.board_full(self.board)
+
+    def count_empty(self):
+        return self.engine.count_empty(self.board)
+
+    def legal_moves(self):
+        mask = 0
+        for i, direction in enumerate(self.engine.DIRECTIONS):
+            if self.engine.move(self.board, direction)[0] != self.board:
+                mask |= 1 << i
+        return mask
+
+    @property
+    def highest(self):
+        """int: The largest tile."""
+        e = self.engine.max_exponent(self.board)
+        return 1 << e if e else 0
+
+    @property
+    def hash(self):
+        """int: The packed board, which is already a unique key of the board."""
+        return self.board
+
+    def set_tiles(self, xy, number):
+        cell_bits = self.engine.CELL_BITS
+        shift = cell_bits * (xy[1] * self.size + xy[0])
+        e = int(number).bit_length() - 1 if number else 0
+        self.board = (self.board & ~(self.engine.CELL_MASK << shift)) | (e << shift)
+
+    def get_random_xy(self):
+        shifts = self.engine.empty_shifts(self.board)
+        if not shifts:
+            return -1, -1
+        i = shifts[self.rng.randrange(len(shifts))] // self.engine.CELL_BITS
+        return i % self.size, i // self.size
+
+    def run(self, direction, is_fake=False):
+        board, self.score = self.engine.move(self.board, direction)
+        if not is_fake:
+            self.board = board
+        return self.score
+
+    def is_over(self):
+        return self.engine.is_over(self.board)
+
+
+ENGINES = {'numpy': Grid, 'exponent': ExpGrid, 'bitboard': BitGrid}
+
+
+def new_grid(size=4, engine='numpy', rng=None):
+    """
+    Create an empty grid with the given engine.
+
+    Args:
+        size (int): The size of the grid (default: 4).
+        engine (str): 'numpy' for Grid, 'exponent' for ExpGrid or 'bitboard' for BitGrid (default: 'numpy').
+        rng (random.Random): The random generator for new tiles (default: the random module).
+
+    Returns:
+        Grid: The new grid.
+    """
+    if engine not in ENGINES:
+        raise ValueError('Unknown grid engine: {}'.format(engine))
+    return ENGINES[engine](size, rng)
+
+
 nmap = {0: 'U', 1: 'R', 2: 'D', 3: 'L'}
 fmap = dict([val, key] for key, val in nmap.items())
 
@@ -197,21 +636,50 @@ class Game:
     state = 'start'
     grid = None
 
-    def __init__(self, grid_size=4, env='production'):
+    def __init__(self, grid_size=4, env='production', engine='numpy', seed=None, rng=None):
         """
         Initialize the game.
 
         Args:
             grid_size (int): The size of the game grid (default: 4).
             env (str): The environment of the game ('production' or 'testing') (default: 'production').
+            engine (str): The grid engine, 'numpy', 'exponent' or 'bitboard' (default: 'numpy').
+            seed (int): Seed of a random generator of the game's own (default: None).
+            rng (random.Random): The random generator for new tiles (default: the random module, or
+                random.Random(seed) if a seed is given).
         """
         self.env = env
         self.grid_size = grid_size
+        self.engine = engine
+        self.seed = seed
+        if rng is None and seed is not None:
+            rng = random.Random(seed)
+        self.rng = rng
+        self.recorder = None
         self.start()
 
+    def record(self, path, interval=64):
+        """
+        Record the game from the current position on to a file (see Recording).
+
+        Args:
+            path (str): The recording file.
+            interval (int): The number of moves between two keyframes (default: 64).
+        """
+        self.stop_recording()
+        self.recorder = Recorder(path, self.grid_size, self.seed, interval)
+        self.recorder.keyframe(self.grid.tiles, self.score)
+
+    def stop_recording(self):
+        """Close the recording of the game, if any."""
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
     def start(self):
-        """Start or restart the game."""
-        self.grid = Grid(self.grid_size)
+        """Start or restart the game; a recording of the previous game is closed."""
+        self.stop_recording()
+        self.grid = new_grid(self.grid_size, self.engine, self.rng)
         if self.env == 'production':
             self.grid.add_tile_init()
         self.state = 'run'
@@ -240,8 +708,11 @@ class Game:
         if self.grid.is_win():
             self.state = 'win'
 
+        spawn = None
         if self.env == 'production':
-            self.grid.add_random_tile()
+            spawn = self.grid.add_random_tile()
+        if self.recorder is not None:
+            self.recorder.record(direction, spawn, self.grid.tiles, self.score)
         return self.grid
 
     def printf(self):
@@ -0,0 +1,307 @@
+"""
+Table-driven and vectorized versions of the Ai corner heuristic.
+
+The evaluation is get_bj2__4(tiles) * 2.8 + get_bj__4(tiles):
+
+- get_bj__4 is a sum of per-cell terms (corner-weighted position of a tile,
+  or a bonus for an empty cell), so it is a sum of per-row terms;
+- get_bj2__4 is a monotonicity penalty over the left, upper and upper-left
+  neighbour of every cell not in the first row or column. The left pairs are
+  per-row terms, the upper pairs per-column terms and the diagonal pairs are
+  looked up in a small table of tile pairs.
+
+For packed 4x4 boards every term comes from a lookup table; for packed boards
+of other sizes (see Packed) RowHeuristic memoizes the same per-row and
+row-pair terms as rows are met; for any size the same sums are computed as
+NumPy expressions over a batch of boards.
+
+Modes:
+    - 'compat': the tile values, reproducing Ai.get_score exactly.
+    - 'log2': the tile exponents instead of the values (what my_log2 was meant for).
+
+evaluator() also offers:
+    - 'corners': the best 'compat' value over the four corners, which does not
+      depend on the orientation of the board.
+    - 'ntuple': the learned n-tuple network of NTuple, in place of the corner heuristic.
+
+Both are symmetric: the 8 rotations and reflections of a board get the same
+value, so caches can key them by Bitboard.canonical_key.
+"""
+
+import numpy as np
+
+import Bitboard
+import NTuple
+import Packed
+
+MODES = ('compat', 'log2')
+EVALUATORS = MODES + ('corners', 'ntuple')
+SYMMETRIC = ('corners', 'ntuple')
+BJ2_WEIGHT = 2.8
+
+_tables = {}
+
+
+def _cell_values(e, mode):
+    """Map exponents to the quantity the heuristic works on."""
+    if mode == 'compat':
+        return np.where(e > 0, np.left_shift(1, e), 0)
+    return e
+
+
+def _smallest(mode):
+    """The value of the smallest tile, subtracted in the position term."""
+    return 2 if mode == 'compat' else 1
+
+
+def init_tables(mode='compat'):
+    """
+    Build the lookup tables of a mode if they have not been built yet.
+
+    Args:
+        mode (str): The heuristic mode (default: 'compat').
+
+    Returns:
+        tuple: The position tables of each row, the left-pair table and the pair table.
+    """
+    if mode in _tables:
+        return _tables[mode]
+    if mode not in MODES:
+        raise ValueError('Unknown heuristic mode: {}'.format(mode))
+    size = Bitboard.SIZE
+    rows = np.arange(1 << Bitboard.ROW_BITS, dtype=np.int64)
+    cells = [_cell_values((rows >> (Bitboard.CELL_BITS * x)) & Bitboard.CELL_MASK, mode) for x in range(size)]
+
+    corner = size * 2 - 3
+    position = []
+    for y in range(size):
+        total = np.zeros_like(rows)
+        for x in range(size):
+            w = x + y - corner
+            total += np.where(cells[x] != 0, (cells[x] - _smallest(mode)) * w, 100 - 20 * w)
+        position.append(total.tolist())
+
+    left = np.zeros_like(rows)
+    for x in range(1, size):
+        left += np.maximum(cells[x - 1] - cells[x], 0)
+
+    e = np.arange(Bitboard.CELL_MASK + 1)
+    v = _cell_values(e, mode)
+    pair = np.maximum(v[:, np.newaxis] - v[np.newaxis, :], 0)
+
+    _tables[mode] = (position, left.tolist(), pair.ravel().tolist())
+    return _tables[mode]
+
+
+def evaluate_packed(board, mode='compat'):
+    """
+    Evaluate a packed 4x4 board with the lookup tables.
+
+    Args:
+        board (int): The packed board.
+        mode (str): The heuristic mode (default: 'compat').
+
+    Returns:
+        float: The evaluation, equal to Ai.get_score in 'compat' mode.
+    """
+    tables = _tables.get(mode) or init_tables(mode)
+    position, left, pair = tables
+    r0 = board & 0xFFFF
+    r1 = (board >> 16) & 0xFFFF
+    r2 = (board >> 32) & 0xFFFF
+    r3 = board >> 48
+    bj = position[0][r0] + position[1][r1] + position[2][r2] + position[3][r3]
+
+    t = Bitboard.transpose(board)
+    penalty = left[r1] + left[r2] + left[r3]
+    penalty += left[(t >> 16) & 0xFFFF] + left[(t >> 32) & 0xFFFF] + left[t >> 48]
+    rows = (r0, r1, r2, r3)
+    for upper, lower in zip(rows, rows[1:]):
+        penalty += pair[((upper & 0xF) << 4) | ((lower >> 4) & 0xF)]
+        penalty += pair[(upper & 0xF0) | ((lower >> 8) & 0xF)]
+        penalty += pair[((upper >> 4) & 0xF0) | (lower >> 12)]
+    return -penalty * BJ2_WEIGHT + bj
+
+
+def evaluate_batch(boards, mode='compat', exponents=False):
+    """
+    Evaluate a stack of boards of any size with NumPy.
+
+    Args:
+        boards (np.ndarray): The boards, shape (N, size, size).
+        mode (str): The heuristic mode (default: 'compat').
+        exponents (bool): Whether the boards hold exponents instead of tile values (default: False).
+
+    Returns:
+        np.ndarray: The evaluation of each board, shape (N,).
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown heuristic mode: {}'.format(mode))
+    boards = np.asarray(boards, dtype=np.int64)
+    if exponents and mode == 'compat':
+        boards = _cell_values(boards, mode)
+    elif not exponents and mode == 'log2':
+        boards = _exponents(boards)
+    size = boards.shape[-1]
+    yx = np.add.outer(np.arange(size), np.arange(size)) - (size * 2 - 3)
+    bj = np.where(boards != 0, (boards - _smallest(mode)) * yx, 100 - 20 * yx).sum(axis=(1, 2))
+
+    cell = boards[:, 1:, 1:]
+    penalty = np.maximum(boards[:, 1:, :-1] - cell, 0).sum(axis=(1, 2))
+    penalty += np.maximum(boards[:, :-1, 1:] - cell, 0).sum(axis=(1, 2))
+    penalty += np.maximum(boards[:, :-1, :-1] - cell, 0).sum(axis=(1, 2))
+    return -penalty * BJ2_WEIGHT + bj
+
+
+def evaluate_corners(board):
+    """
+    Evaluate a packed 4x4 board in 'compat' mode towards its best corner.
+
+    The 'compat' heuristic favours the bottom right corner and is symmetric about the diagonal
+    through it, so the mirrored and flipped boards cover the other three corners.
+
+    Args:
+        board (int): The packed board.
+
+    Returns:
+        float: The largest of the four corner evaluations.
+    """
+    f = Bitboard.flip(board)
+    return max(
+        evaluate_packed(board), evaluate_packed(Bitboard.mirror(board)),
+        evaluate_packed(f), evaluate_packed(Bitboard.mirror(f))
+    )
+
+
+def evaluate_corners_batch(boards):
+    """Evaluate a stack of tile values like evaluate_corners."""
+    boards = np.asarray(boards)
+    return np.max([
+        evaluate_batch(boards), evaluate_batch(boards[:, :, ::-1]),
+        evaluate_batch(boards[:, ::-1, :]), evaluate_batch(boards[:, ::-1, ::-1])
+    ], axis=0)
+
+
+class RowHeuristic:
+    """The corner heuristic of packed boards of any size, with lazily memoized row terms."""
+
+    def __init__(self, engine, mode='compat'):
+        """
+        Initialize the heuristic.
+
+        Args:
+            engine: The board engine of the size (Packed.engine(size)).
+            mode (str): The heuristic mode (default: 'compat').
+        """
+        if mode not in MODES:
+            raise ValueError('Unknown heuristic mode: {}'.format(mode))
+        self.engine = engine
+        self.mode = mode
+        self.size = engine.SIZE
+        # row -> term, one position table per y; (upper row << row bits) | lower row -> term
+        self.position = [{} for _ in range(self.size)]
+        self.left = {}
+        self.pairs = {}
+
+    def _values(self, row):
+        e = np.array(self.engine.row_cells(row), dtype=np.int64)
+        return _cell_values(e, self.mode)
+
+    def _position(self, y, row):
+        v = self._values(row)
+        w = np.arange(self.size) + y - (self.size * 2 - 3)
+        return int(np.where(v != 0, (v - _smallest(self.mode)) * w, 100 - 20 * w).sum())
+
+    def _left(self, row):
+        v = self._values(row)
+        return int(np.maximum(v[:-1] - v[1:], 0).sum())
+
+    def _pair(self, key):
+        upper = self._values(key >> self.engine.row_bits)
+        lower = self._values(key & self.engine.row_mask)
+        return int(np.maximum(upper[1:] - lower[1:], 0).sum() + np.maximum(upper[:-1] - lower[1:], 0).sum())
+
+    def _memo(self, table, key, compute, *args):
+        value = table.get(key)
+        if value is None:
+            if len(table) >= Packed.MAX_MEMO:
+                table.clear()
+            value = table[key] = compute(*args)
+        return value
+
+    def evaluate(self, board):
+        """
+        Evaluate a packed board.
+
+        Args:
+            board (int): The packed board.
+
+        Returns:
+            float: The evaluation, equal to evaluate_batch of the unpacked board.
+        """
+        engine = self.engine
+        mask, row_bits = engine.row_mask, engine.row_bits
+        rows = [(board >> shift) & mask for shift in engine.row_shifts]
+        bj = 0
+        for y, row in enumerate(rows):
+            bj += self._memo(self.position[y], row, self._position, y, row)
+        penalty = 0
+        for row in rows[1:]:
+            penalty += self._memo(self.left, row, self._left, row)
+        for upper, lower in zip(rows, rows[1:]):
+            key = (upper << row_bits) | lower
+            penalty += self._memo(self.pairs, key, self._pair, key)
+        return -penalty * BJ2_WEIGHT + bj
+
+    def evaluate_corners(self, board):
+        """Evaluate a packed board in 'compat' mode towards its best corner, like evaluate_corners."""
+        engine = self.engine
+        f = engine.flip(board)
+        return max(
+            self.evaluate(board), self.evaluate(engine.mirror(board)),
+            self.evaluate(f), self.evaluate(engine.mirror(f))
+        )
+
+
+def is_symmetric(mode):
+    """Check whether an evaluation gives the same value to every rotation and reflection of a board."""
+    return mode in SYMMETRIC
+
+
+def evaluator(mode='compat', weights=None, size=4):
+    """
+    Get the evaluation functions of a heuristic mode or of the n-tuple network.
+
+    Args:
+        mode (str): 'compat', 'log2', 'corners' or 'ntuple' (default: 'compat').
+        weights (str): The weights file of the 'ntuple' evaluator (default: NTuple.WEIGHTS).
+        size (int): The size of the grid; 'ntuple' only evaluates 4x4 grids (default: 4).
+
+    Returns:
+        tuple: (packed, batch); packed(board) evaluates a board packed by Packed.engine(size),
+            batch(boards) an (N, size, size) stack of tile values.
+    """
+    if size != Bitboard.SIZE:
+        if mode == 'ntuple':
+            raise ValueError('The n-tuple network only evaluates {0}x{0} boards'.format(Bitboard.SIZE))
+        if mode == 'corners':
+            return RowHeuristic(Packed.engine(size)).evaluate_corners, evaluate_corners_batch
+        if mode not in MODES:
+            raise ValueError('Unknown heuristic mode: {}'.format(mode))
+        return RowHeuristic(Packed.engine(size), mode).evaluate, (lambda boards: evaluate_batch(boards, mode))
+    if mode == 'ntuple':
+        network = NTuple.load(weights or NTuple.WEIGHTS)
+        return network.evaluate_packed, network.evaluate_batch
+    if mode == 'corners':
+        init_tables()
+        return evaluate_corners, evaluate_corners_batch
+    init_tables(mode)
+    return (lambda board: evaluate_packed(board, mode)), (lambda boards: evaluate_batch(boards, mode))
+
+
+def _exponents(values):
+    """Map tile values to exponents."""
+    e = np.zeros_like(values)
+    nz = values > 0
+    e[nz] = np.log2(values[nz]).round().astype(values.dtype)
+    return e
@@ -1,7 +1,10 @@
-import pygame, os, time
+import pygame, argparse, logging, math, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
 
 from Game import Game
 from PlayerAI import Ai
+from Profiler import SamplingProfiler
+from Recording import GameReader
 from Constants import *
 
 """
@@ -23,7 +26,7 @@ Constants and Configurations:
     - SIZE: Default grid size for the game.
     - SIZE_5x5, SIZE_6x6, SIZE_8x8: Alternative grid sizes for the game.
     - DEBUG: Flag for enabling debug mode.
-    - colors: Dictionary of colors for different tile values.
+    - colors: Dictionary of colors for different tile values (exponent_colors: the same by exponent).
     - GAME_WH: Width and height of the game grid.
     - WINDOW_W, WINDOW_H: Width and height of the game window.
 
@@ -39,7 +42,16 @@ Usage:
     - Arrow keys or 'W', 'A', 'S', 'D': Move the tiles in the corresponding directions.
     - 'Start' button: Start a new game renders 4x4 grid.
     - 'Auto' button: Enable or disable auto-play mode.
-    - '5x5', '6x6', '8x8' buttons: Change the grid size.
+    - '4x4', '5x5', '6x6', '8x8' buttons: Start a new game on a grid of that size.
+    - 'I': Show or hide the AI search statistics.
+    - 'P': Start or stop the sampling profiler; stopping writes profile-<time>.txt.
+
+    Replay:
+    Run "python Main.py --replay game.rec" to step through a recorded game (see Recording and
+    Simulate --record; Main records its own games when RECORD_DIR is set in the config).
+    - Left/Right arrows: One move back or forward.
+    - Page Up/Page Down: One keyframe interval back or forward.
+    - Home/End: The first or the last position.
 
     Enjoy playing 2048!
 
@@ -56,6 +68,8 @@ SIZE_6x6 = config.SIZE_6x6
 SIZE_8x8 = config.SIZE_8x8
 DEBUG = config.DEBUG
 colors = config.COLORS
+# Tile colors by exponent, so drawing never turns a tile into a string key
+exponent_colors = [colors[str(1 << e if e else 0)] for e in range(len(colors))]
 GAME_WH = config.GAME_WH
 WINDOW_W = config.WINDOW_W
 WINDOW_H = config.WINDOW_H
@@ -64,7 +78,7 @@ WINDOW_H = config.WINDOW_H
 
 
 class Main:
-    def __init__(self):
+    def __init__(self, replay=None):
         global FPS
         pygame.init()
         os.environ["SDL_VIDEO_WINDOW_POS"] = "%d,%d" % (100, 50)
@@ -73,8 +87,13 @@ class Main:
         self.fps = FPS
         self.catch_n = 0
         self.clock = pygame.time.Clock()
-        self.game = Game(SIZE)
+        self.game = Game(SIZE, engine=config.ENGINE)
         self.ai = Ai()
+        # The AI searches on a background thread so the window keeps running meanwhile;
+        # a short switch interval lets the UI thread get the GIL back quickly from a pure Python search
+        sys.setswitchinterval(0.001)
+        self.ai_executor = ThreadPoolExecutor(max_workers=1)
+        self.ai_future = None
         self.step_time = config.STEP_TIME
         self.next_f = ""
         self.last_time = time.time()
@@ -89,6 +108,14 @@ class Main:
         self.start_time = 0  # Thời gian bắt đầu chơi
         self.time_mode = False
         self.icon_path = "icon.ico"
+        self.show_stats = DEBUG
+        self.ai.set_timing(self.show_stats)
+        self.profiler = SamplingProfiler()
+        self.last_frame = None  # What is on screen, to redraw only what changed
+        self.replay = None
+        self.replay_pos = 0
+        if replay is not None:
+            self.open_replay(replay)
 
     def start(self):
         # Load buttons
@@ -96,9 +123,10 @@ class Main:
             Button("start", "Restart", (GAME_WH + 60, 130)),
             Button("ai", "Auto", (GAME_WH + 60, 220)),
             Button("time", "Time", (GAME_WH + 60, 310)),  # Thêm button "Time"
-            # Button('size_5x5', '5x5', (GAME_WH + 60, 310)),
-            # Button('size_6x6', '6x6', (GAME_WH + 60, 400)),
-            # Button('size_8x8', '8x8', (GAME_WH + 60, 490))
+            Button("size_4x4", "4x4", (GAME_WH + 5, 520), size=(45, 40)),
+            Button("size_5x5", "5x5", (GAME_WH + 53, 520), size=(45, 40)),
+            Button("size_6x6", "6x6", (GAME_WH + 101, 520), size=(45, 40)),
+            Button("size_8x8", "8x8", (GAME_WH + 149, 520), size=(45, 40)),
         ]
         self.run()
 
@@ -119,14 +147,62 @@ class Main:
                 self.last_time = time.time()
             elif self.state == "start":
                 self.game.start()
+                self.start_recording()
                 self.state = "run"
-            self.set_background((146, 135, 125))
-            self.draw_info()
-            self.draw_buttons(self.button_list)
-            self.draw_grid()
-            self.update()
+            self.play_sounds()
+            self.update(self.render())
+        if self.profiler.is_running:
+            self.toggle_profiler()
+        self.cancel_ai()
+        self.ai_executor.shutdown(wait=False, cancel_futures=True)
+        self.ai.close()
+        self.game.stop_recording()
         print("Exiting the game")
 
+    # Record the new game to RECORD_DIR, if the config sets one
+    def start_recording(self):
+        if config.RECORD_DIR:
+            os.makedirs(config.RECORD_DIR, exist_ok=True)
+            now = time.time()
+            name = "game-{}-{:03d}.rec".format(
+                time.strftime("%Y%m%d-%H%M%S", time.localtime(now)), int(now % 1 * 1000)
+            )
+            self.game.record(os.path.join(config.RECORD_DIR, name))
+
+    def open_replay(self, path):
+        self.replay = GameReader(path)
+        self.game = Game(self.replay.size, env="testing")
+        self.state = "replay"
+        self.seek(0)
+
+    def close_replay(self):
+        self.replay.close()
+        self.replay = None
+        self.game = Game(SIZE, engine=config.ENGINE)
+        self.state = "start"
+
+    # Show the position after n moves of the replay
+    def seek(self, n):
+        n = min(max(n, 0), len(self.replay))
+        tiles, score = self.replay.board(n)
+        self.game.grid.tiles = tiles
+        self.game.score = score
+        self.replay_pos = n
+
+    def replay_key(self, key):
+        steps = {
+            pygame.K_LEFT: -1,
+            pygame.K_RIGHT: 1,
+            pygame.K_PAGEUP: -self.replay.interval,
+            pygame.K_PAGEDOWN: self.replay.interval,
+        }
+        if key in steps:
+            self.seek(self.replay_pos + steps[key])
+        elif key == pygame.K_HOME:
+            self.seek(0)
+        elif key == pygame.K_END:
+            self.seek(len(self.replay))
+
     def end_game(self):
         # ...
         if (
@@ -140,10 +216,66 @@ class Main:
 
     # ...
 
+    # Draw what changed since the last frame and return the changed screen areas
+    def render(self):
+        background = (146, 135, 125)
+        tiles = self.game.grid.exponents.copy()
+        overlay = self.state if self.state in ["over", "win"] else None
+        panel = self.panel_key()
+        last = self.last_frame
+        if last is None or last["overlay"] != overlay or last["tiles"].shape != tiles.shape:
+            self.set_background(background)
+            self.draw_info()
+            self.draw_buttons(self.button_list)
+            self.draw_grid()
+            rects = [self.screen.get_rect()]
+        else:
+            rects = []
+            if panel != last["panel"]:
+                panel_rect = pygame.Rect(GAME_WH, 0, WINDOW_W - GAME_WH, WINDOW_H)
+                self.screen.fill(background, panel_rect)
+                self.draw_info()
+                self.draw_buttons(self.button_list)
+                rects.append(panel_rect)
+            for y, x in zip(*(tiles != last["tiles"]).nonzero()):
+                rect = self.block_rect((x, y))
+                self.screen.fill(background, rect)
+                self.draw_block((x, y), tiles[y][x])
+                rects.append(rect)
+        self.last_frame = {"tiles": tiles, "overlay": overlay, "panel": panel}
+        return rects
+
+    # Everything draw_info and draw_buttons depend on
+    def panel_key(self):
+        key = [
+            self.game.score,
+            self.state,
+            self.step_time,
+            self.jm,
+            self.show_stats and self.ai.stats.moves,
+            self.profiler.is_running,
+            self.replay_pos,
+            [(b.text, b.is_show) for b in self.button_list],
+        ]
+        if self.state == "time":
+            key.append(int(self.time_limit - (time.time() - self.start_time)))
+        return key
+
+    def block_rect(self, xy):
+        one_size = GAME_WH / self.game.grid.size
+        return pygame.Rect(
+            int(xy[0] * one_size),
+            int((xy[1] + 0.5) * one_size),
+            math.ceil(one_size),
+            math.ceil(one_size),
+        )
+
     def draw_grid(self):
-        for y in range(SIZE):
-            for x in range(SIZE):
-                self.draw_block((x, y), self.game.grid.tiles[y][x])
+        size = self.game.grid.size
+        exponents = self.game.grid.exponents
+        for y in range(size):
+            for x in range(size):
+                self.draw_block((x, y), exponents[y][x])
         if self.state == "over":
             pygame.draw.rect(self.screen, (0, 0, 0, 0.5), (0, 0, GAME_WH, GAME_WH))
             self.draw_text(
@@ -154,6 +286,8 @@ class Main:
             self.draw_text(
                 "You Win!", (GAME_WH / 2, GAME_WH / 2), size=25, center="center"
             )
+
+    def play_sounds(self):
         if self.next_f != "":
             if not self.sound_played:
                 self.move_sound.play()
@@ -169,32 +303,68 @@ class Main:
 
     # Draw a block
     # Vẽ một ô vuông
-    def draw_block(self, xy, number):
-        one_size = GAME_WH / SIZE
+    def draw_block(self, xy, exponent):
+        one_size = GAME_WH / self.game.grid.size
+        x, y = xy[0] * one_size, (xy[1] + 0.5) * one_size
+        dx = int(one_size * 0.05)  # Khoảng cách giữa các ô vuông
+        self.screen.blit(self.get_tile(exponent, one_size), (x + dx, y + dx))
+
+    # Pre-rendered tile (rounded rect and label), built once per exponent and tile size
+    def get_tile(self, exponent, one_size):
+        key = (int(exponent), one_size)
+        tile = self.tile_cache.get(key)
+        if tile is not None:
+            return tile
+        if self.tile_cache and next(iter(self.tile_cache))[1] != one_size:
+            self.tile_cache.clear()  # The grid size changed
         dx = int(one_size * 0.05)  # Khoảng cách giữa các ô vuông
         radius = int(one_size * 0.1)  # Độ cong của góc bo tròn
-        x, y = xy[0] * one_size, (xy[1] + 0.5) * one_size
-        color = colors[str(int(number))] if number <= 2048 else (0, 0, 255)
-        pygame.draw.rect(
-            self.screen,
-            color,
-            (x + dx, y + dx, one_size - 2 * dx, one_size - 2 * dx),
-            border_radius=radius,
-        )
+        side = one_size - 2 * dx
+        tile = pygame.Surface((side, side), pygame.SRCALPHA)
+        exponent = key[0]
+        if exponent < len(exponent_colors):
+            color = exponent_colors[exponent]
+        else:
+            color = (0, 0, 255)
+        pygame.draw.rect(tile, color, (0, 0, side, side), border_radius=radius)
 
-        if number != 0:
+        if exponent != 0:
             font_size = int(one_size * 0.4)
-            font_color = (20, 20, 20) if number <= 4 else (250, 250, 250)
-            font = pygame.font.SysFont("None", font_size)
-            text = font.render(str(int(number)), True, font_color)
-            text_rect = text.get_rect(center=(x + one_size / 2, y + one_size / 2))
-            self.screen.blit(text, text_rect)
+            font_color = (20, 20, 20) if exponent <= 2 else (250, 250, 250)
+            font = self.get_font("None", font_size, sys_font=True)
+            text = font.render(str(1 << exponent), True, font_color)
+            text_rect = text.get_rect(center=(side / 2, side / 2))
+            tile.blit(text, text_rect)
+        self.tile_cache[key] = tile
+        return tile
+
+    def get_font(self, name, size, sys_font=False):
+        key = (name, size, sys_font)
+        font = self.font_cache.get(key)
+        if font is None:
+            if sys_font:
+                font = pygame.font.SysFont(name, size)
+            else:
+                font = pygame.font.Font(name, size)
+            self.font_cache[key] = font
+        return font
 
     def draw_info(self):
         self.draw_text("Score: {}".format(self.game.score), (GAME_WH + 60, 40))
         if self.state == "ai":
             self.draw_text("Interval: {}".format(self.step_time), (GAME_WH + 60, 60))
             self.draw_text("Evaluation: {}".format(self.jm), (GAME_WH + 60, 80))
+            if self.show_stats:
+                self.draw_stats()
+        if self.state == "replay":
+            self.draw_text(
+                "Move: {}/{}".format(self.replay_pos, len(self.replay)), (GAME_WH + 60, 60)
+            )
+            if self.replay_pos < len(self.replay):
+                direction = self.replay.move(self.replay_pos)[0]
+                self.draw_text("Next: {}".format(direction), (GAME_WH + 60, 80))
+        if self.profiler.is_running:
+            self.draw_text("Profiling...", (GAME_WH + 60, 570), color=(200, 0, 0))
         if self.state == "time":
             current_time = time.time() - self.start_time
             remaining_time = self.time_limit - current_time
@@ -209,6 +379,27 @@ class Main:
             # Vẽ thông tin thời gian lên màn hình
             self.draw_text("Time: {}".format(time_text), (GAME_WH + 60, 100))
 
+    def draw_stats(self):
+        stats = self.ai.get_stats()
+        lines = [
+            "Depth: {}".format(stats["last_depth"]),
+            "Move time: {:.0f} ms".format(stats["last_time"] * 1000),
+            "Avg time: {:.0f} ms".format(stats["time_per_move"] * 1000),
+            "Nodes: {}".format(stats["last_nodes"]),
+            "Evals/s: {:.0f}".format(stats["evals_per_second"]),
+            "Cache hits: {:.0%}".format(stats["cache_hit_rate"]),
+            "Move/Eval: {:.1f}/{:.1f} s".format(stats["move_time"], stats["eval_time"]),
+        ]
+        for i, line in enumerate(lines):
+            self.draw_text(line, (GAME_WH + 10, 380 + 18 * i), size=16)
+
+    def toggle_profiler(self):
+        if self.profiler.is_running:
+            path = self.profiler.stop("profile-{}.txt".format(time.strftime("%Y%m%d-%H%M%S")))
+            logging.getLogger(__name__).info("Profile written to %s", path)
+        else:
+            self.profiler.start()
+
     def set_background(self, color=(255, 0, 0)):
         self.screen.fill(color)
 
@@ -223,8 +414,13 @@ class Main:
                 )
 
     def draw_text(self, text, xy, color=(0, 0, 0), size=18, center=None):
-        font = pygame.font.Font(None, round(size))
-        text_obj = font.render(text, True, color)
+        key = (text, color, round(size))
+        text_obj = self.text_cache.get(key)
+        if text_obj is None:
+            if len(self.text_cache) >= 256:
+                self.text_cache.clear()  # Changing labels (score, timer) would grow it forever
+            text_obj = self.get_font(None, round(size)).render(text, True, color)
+            self.text_cache[key] = text_obj
         text_rect = text_obj.get_rect()
         if center == "center":
             text_rect.center = xy
@@ -237,6 +433,10 @@ class Main:
         self.screen2 = pygame.display.set_mode((w, h), pygame.DOUBLEBUF, 32)
         self.screen = self.screen2.convert_alpha()
         pygame.display.set_caption(title)
+        # Rendered tiles, fonts and labels, rebuilt for the new window
+        self.tile_cache = {}
+        self.font_cache = {}
+        self.text_cache = {}
         icon_path = "icon.ico"  # Thay đổi thành đường dẫn thực tế của icon
         # Đọc file icon
         icon = pygame.image.load(icon_path)
@@ -244,11 +444,14 @@ class Main:
         # Đặt icon cho cửa sổ
         pygame.display.set_icon(icon)
 
-    def update(self):
-        self.screen2.blit(self.screen, (0, 0))
-        # Refresh the screen
-        # pygame.display.update()
-        pygame.display.flip()
+    def update(self, rects=None):
+        # Refresh only the changed areas; with nothing changed the loop just waits for the next tick
+        if rects is None:
+            rects = [self.screen.get_rect()]
+        for rect in rects:
+            self.screen2.blit(self.screen, rect, rect)
+        if rects:
+            pygame.display.update(rects)
         time_passed = self.clock.tick(self.fps)
         if self.state == "time":
             current_time = time.time() - self.start_time
@@ -264,17 +467,44 @@ class Main:
             if remaining_time <= 0:
                 self.end_game()
 
-    # Event handling
+    # Start an AI search in the background, or pick up its move once it is done
+    def poll_ai(self):
+        if self.ai_future is None:
+            # The search gets the step time to think, so the AI keeps the chosen pace
+            deadline = time.time() + max(self.step_time, config.MIN_THINK_TIME)
+            self.ai_future = self.ai_executor.submit(
+                self.ai.get_next, self.game.grid.exponents.copy(), deadline, exponents=True
+            )
+        elif self.ai_future.done():
+            future, self.ai_future = self.ai_future, None
+            self.next_f, self.jm = future.result()
+
+    # Drop a pending AI search; a search already running is stopped and its move ignored
+    def cancel_ai(self):
+        if self.ai_future is not None:
+            if not self.ai_future.cancel():
+                self.ai.stop()
+            self.ai_future = None
+
     # Event handling
     def handle_events(self):
         if self.state == "ai" and self.next_f == "":
-            self.next_f, self.jm = self.ai.get_next(self.game.grid.tiles)
+            self.poll_ai()
+        elif self.state != "ai":
+            self.cancel_ai()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.state = "exit"
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.state = "exit"
+                elif event.key == pygame.K_i:
+                    self.show_stats = not self.show_stats
+                    self.ai.set_timing(self.show_stats)
+                elif event.key == pygame.K_p:
+                    self.toggle_profiler()
+                elif self.state == "replay":
+                    self.replay_key(event.key)
                 elif event.key in [pygame.K_LEFT, pygame.K_a] and self.state in [
                     "run",
                     "time",
@@ -312,6 +542,8 @@ class Main:
             if event.type == pygame.MOUSEBUTTONDOWN:
                 for i in self.button_list:
                     if i.is_click(event.pos):
+                        if self.replay is not None:
+                            self.close_replay()
                         if i.name == "time":
                             if not self.time_mode:
                                 self.time_mode = True
@@ -320,20 +552,25 @@ class Main:
                             else:
                                 self.time_mode = False
 
-                        if i.name == "size_5x5":
-                            self.game = Game(SIZE_5x5)
-                            self.state = "start"
-                        elif i.name == "size_6x6":
-                            self.game = Game(SIZE_6x6)
-                            self.state = "start"
-                        elif i.name == "size_8x8":
-                            self.game = Game(SIZE_8x8)
+                        sizes = {
+                            "size_4x4": SIZE,
+                            "size_5x5": SIZE_5x5,
+                            "size_6x6": SIZE_6x6,
+                            "size_8x8": SIZE_8x8,
+                        }
+                        if i.name in ["start", "run"] or i.name in sizes:
+                            self.cancel_ai()
+                        if i.name in sizes:
+                            # The Ai switches its engine and evaluation to the new size on its next move
+                            self.game.stop_recording()
+                            self.game = Game(sizes[i.name], engine=config.ENGINE)
                             self.state = "start"
                         else:
                             self.state = i.name
                             if i.name == "start":
                                 self.game.start()  # Bắt đầu trò chơi
                                 self.game.score = 0  # Đặt điểm số về 0
+                                self.start_recording()
                                 self.state = "run"
                             if i.name == "ai":
                                 i.name = "run"
@@ -351,8 +588,12 @@ def main_menu():
     main_game.start()
 
 
-def run():
-    Main().start()
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Play 2048.")
+    parser.add_argument("--replay", metavar="FILE", help="step through a recorded game")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO)
+    Main(args.replay).start()
 
 
 # Button class
@@ -0,0 +1,280 @@
+"""
+N-tuple network evaluator for packed 4x4 boards.
+
+The value of a board is a sum of weights looked up by the tile exponents of
+a few groups of cells (tuples), in each of the 8 rotations and reflections
+of the board:
+
+    value(board) = sum over symmetries s, tuples p of W[p][exponents of p in s(board)]
+
+The default tuples are the outer and inner row and three 2x2 squares; with
+4 cells of 4 bits each a table has 65536 weights, so the network is 1.3 MB.
+The weights approximate the score still to be made after a move (the
+afterstate value) and are learned by TD(0) from games the network plays
+against itself:
+
+    python -m NTuple --games 20000 --out ntuple.npy
+
+At run time the weights are memory-mapped from the .npy file and read with
+one table lookup per tuple and symmetry.
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+import Bitboard
+
+# Cells of each tuple, as flat indices y * 4 + x in increasing order
+PATTERNS = (
+    (0, 1, 2, 3),
+    (4, 5, 6, 7),
+    (0, 1, 4, 5),
+    (1, 2, 5, 6),
+    (5, 6, 9, 10),
+)
+TUPLE_SIZE = 4
+TABLE_SIZE = 1 << (Bitboard.CELL_BITS * TUPLE_SIZE)
+WEIGHTS = 'ntuple.npy'
+
+_networks = {}
+
+
+def _runs(pattern):
+    """
+    Split a tuple into runs of adjacent cells, to read each run with one shift and mask.
+
+    Returns:
+        list: (board shift, mask, index shift) of every run.
+    """
+    runs = []
+    start = 0
+    for k in range(1, len(pattern) + 1):
+        if k == len(pattern) or pattern[k] != pattern[k - 1] + 1:
+            length = k - start
+            runs.append((
+                Bitboard.CELL_BITS * pattern[start],
+                (1 << (Bitboard.CELL_BITS * length)) - 1,
+                Bitboard.CELL_BITS * start,
+            ))
+            start = k
+    return runs
+
+
+def _symmetric_cells():
+    """For each symmetry, the cell of the board that ends up at each cell of the transformed board."""
+    cells = np.arange(Bitboard.SIZE * Bitboard.SIZE).reshape(Bitboard.SIZE, Bitboard.SIZE)
+    # Unpack the transforms of a board whose cell i holds i (exponents only go up to 15)
+    board = Bitboard.pack(np.where(cells > 0, np.left_shift(1, cells), 0))
+    return [
+        np.log2(np.maximum(Bitboard.unpack(s), 1)).astype(np.intp).ravel()
+        for s in Bitboard.symmetries(board)
+    ]
+
+
+class NTupleNetwork:
+    """Weight tables of an n-tuple network and their evaluation and TD update."""
+
+    def __init__(self, weights=None, patterns=PATTERNS):
+        """
+        Initialize the network.
+
+        Args:
+            weights (np.ndarray): The weights, shape (len(patterns), TABLE_SIZE), float32; may be a
+                read-only memory map (default: None, all zero and writable).
+            patterns (tuple): The cells of each tuple (default: PATTERNS).
+        """
+        if weights is None:
+            weights = np.zeros((len(patterns), TABLE_SIZE), dtype=np.float32)
+        if weights.shape != (len(patterns), TABLE_SIZE):
+            raise ValueError('Weights of shape {} do not fit {} tuples'.format(weights.shape, len(patterns)))
+        self.weights = weights
+        self.patterns = patterns
+        # A flat memoryview reads single weights much faster than indexing the array
+        self.table = memoryview(weights.reshape(-1)).cast('B').cast('f')
+        self.features = [(p * TABLE_SIZE, _runs(pattern)) for p, pattern in enumerate(patterns)]
+        # Tuples of one or two runs of cells (all the default ones) get an unrolled lookup
+        self.one_run = [(offset, *runs[0][:2]) for offset, runs in self.features if len(runs) == 1]
+        self.two_runs = [(offset, *runs[0][:2], *runs[1]) for offset, runs in self.features if len(runs) == 2]
+        self.more_runs = [feature for feature in self.features if len(feature[1]) > 2]
+        # For evaluate_batch: the board cells and table offset of every tuple in every symmetry
+        self.cells = np.array([[cells[c] for c in pattern] for cells in _symmetric_cells() for pattern in patterns])
+        self.offsets = np.tile(np.arange(len(patterns)) * TABLE_SIZE, len(self.cells) // len(patterns))
+        self.cell_shifts = Bitboard.CELL_BITS * np.arange(self.cells.shape[1])
+
+    def indices(self, board):
+        """
+        Get the weight of every tuple and symmetry of a board.
+
+        Args:
+            board (int): The packed board.
+
+        Returns:
+            list: Indices into the flattened weights.
+        """
+        result = []
+        for b in Bitboard.symmetries(board):
+            for offset, runs in self.features:
+                index = offset
+                for shift, mask, to in runs:
+                    index |= ((b >> shift) & mask) << to
+                result.append(index)
+        return result
+
+    def evaluate_packed(self, board):
+        """
+        Evaluate a packed board.
+
+        Args:
+            board (int): The packed board.
+
+        Returns:
+            float: The value of the board.
+        """
+        table, one_run, two_runs, more_runs = self.table, self.one_run, self.two_runs, self.more_runs
+        total = 0.0
+        for b in Bitboard.symmetries(board):
+            for offset, shift, mask in one_run:
+                total += table[offset | ((b >> shift) & mask)]
+            for offset, shift, mask, shift2, mask2, to2 in two_runs:
+                total += table[offset | ((b >> shift) & mask) | (((b >> shift2) & mask2) << to2)]
+            for offset, runs in more_runs:
+                index = offset
+                for shift, mask, to in runs:
+                    index |= ((b >> shift) & mask) << to
+                total += table[index]
+        return total
+
+    def evaluate_batch(self, boards, exponents=False):
+        """
+        Evaluate a stack of 4x4 boards with NumPy.
+
+        Args:
+            boards (np.ndarray): The boards, shape (N, 4, 4).
+            exponents (bool): Whether the boards hold exponents instead of tile values (default: False).
+
+        Returns:
+            np.ndarray: The value of each board, shape (N,).
+        """
+        boards = np.asarray(boards)
+        if boards.shape[1:] != (Bitboard.SIZE, Bitboard.SIZE):
+            raise ValueError('The n-tuple network only evaluates {0}x{0} boards'.format(Bitboard.SIZE))
+        e = boards.reshape(len(boards), -1).astype(np.intp)
+        if not exponents:
+            e = np.log2(np.maximum(e, 1)).astype(np.intp)
+        index = (e[:, self.cells] << self.cell_shifts).sum(axis=2) + self.offsets
+        return self.weights.reshape(-1)[index].sum(axis=1, dtype=np.float64)
+
+    def update(self, board, delta):
+        """
+        Move the value of a board by delta, spread over its weights.
+
+        Args:
+            board (int): The packed board.
+            delta (float): The change of the value.
+        """
+        indices = self.indices(board)
+        step = delta / len(indices)
+        table = self.table
+        for i in indices:
+            table[i] += step
+
+    def save(self, path):
+        """Write the weights to a .npy file."""
+        np.save(path, self.weights)
+
+
+def load(path=WEIGHTS):
+    """
+    Memory-map a network, once per path.
+
+    Args:
+        path (str): The .npy weights file (default: WEIGHTS).
+
+    Returns:
+        NTupleNetwork: The network, read-only.
+    """
+    network = _networks.get(path)
+    if network is None:
+        network = NTupleNetwork(np.load(path, mmap_mode='r'))
+        _networks[path] = network
+    return network
+
+
+def _spawn(board, rng):
+    shifts = Bitboard.empty_shifts(board)
+    if not shifts:
+        return board
+    return board | ((1 if rng.random() < 0.9 else 2) << shifts[rng.randrange(len(shifts))])
+
+
+def train(network, games, learning_rate=0.1, seed=0, log_every=1000):
+    """
+    Learn afterstate values by TD(0) from games the network plays greedily against itself.
+
+    Args:
+        network (NTupleNetwork): The network to train, with writable weights.
+        games (int): The number of games.
+        learning_rate (float): The step size of a value update (default: 0.1).
+        seed (int): The seed of the tile spawns (default: 0).
+        log_every (int): Print the mean score and the best tiles every this many games, 0 to not print (default: 1000).
+
+    Returns:
+        list: The score of every game.
+    """
+    Bitboard.init_tables()
+    rng = random.Random(seed)
+    evaluate = network.evaluate_packed
+    scores = []
+    start = time.time()
+    for game in range(games):
+        board = _spawn(_spawn(0, rng), rng)
+        score = 0
+        previous = None
+        while True:
+            best = None
+            for d in Bitboard.DIRECTIONS:
+                after, reward = Bitboard.move(board, d)
+                if after != board:
+                    value = reward + evaluate(after)
+                    if best is None or value > best[0]:
+                        best = (value, after, reward)
+            if best is None:
+                if previous is not None:
+                    network.update(previous, -learning_rate * evaluate(previous))
+                break
+            value, after, reward = best
+            if previous is not None:
+                network.update(previous, learning_rate * (value - evaluate(previous)))
+            previous = after
+            score += reward
+            board = _spawn(after, rng)
+        scores.append(score)
+        if log_every and (game + 1) % log_every == 0:
+            recent = scores[-log_every:]
+            print('{:>8} games  mean score {:>8.0f}  max score {:>7}  {:.0f}s'.format(
+                game + 1, np.mean(recent), max(recent), time.time() - start
+            ), flush=True)
+    return scores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the n-tuple network evaluator by self-play.')
+    parser.add_argument('--games', type=int, default=10000, help='number of training games')
+    parser.add_argument('--out', default=WEIGHTS, help='weights file to write')
+    parser.add_argument('--init', help='weights file to continue training from')
+    parser.add_argument('--learning-rate', type=float, default=0.1, help='TD step size')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the training games')
+    parser.add_argument('--log-every', type=int, default=1000, help='games between progress lines')
+    args = parser.parse_args(argv)
+
+    weights = np.load(args.init).astype(np.float32) if args.init else None
+    network = NTupleNetwork(weights)
+    train(network, args.games, args.learning_rate, args.seed, args.log_every)
+    network.save(args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Packed board engine for grids of any size.
+
+A board is a Python integer holding one 5-bit exponent per cell (0 = empty,
+e = tile 2**e); cell (x, y) lives at bit 5 * (size * y + x), so each row is a
+5 * size bit group (25 to 40 bits for 5x5 to 8x8). Row tables that big
+cannot be built up front, so the move, reverse and transpose results of a
+row are memoized the first time the row is seen; a game only ever meets a
+small fraction of the possible rows.
+
+PackedEngine has the same interface as the Bitboard module, and engine(4)
+returns Bitboard itself, so callers can take an engine for any size.
+"""
+
+import numpy as np
+
+import Bitboard
+from Bitboard import DIRECTIONS
+
+CELL_BITS = 5
+CELL_MASK = (1 << CELL_BITS) - 1
+# Tiles are int32, so 2**30 is the largest tile that can be made; 2**31 is never merged
+MAX_EXPONENT = 31
+# Memoized rows per table before it is cleared
+MAX_MEMO = 1 << 18
+
+_engines = {}
+
+
+class PackedEngine:
+    """Moves and queries on packed boards of one size, with lazily memoized row tables."""
+
+    CELL_BITS = CELL_BITS
+    CELL_MASK = CELL_MASK
+    MAX_EXPONENT = MAX_EXPONENT
+    DIRECTIONS = DIRECTIONS
+
+    def __init__(self, size):
+        """
+        Initialize the engine.
+
+        Args:
+            size (int): The size of the grid.
+        """
+        self.SIZE = size
+        self.row_bits = CELL_BITS * size
+        self.row_mask = (1 << self.row_bits) - 1
+        self.row_shifts = [self.row_bits * y for y in range(size)]
+        self.cell_shifts = list(range(0, CELL_BITS * size * size, CELL_BITS))
+        # row -> (moved row, score), for moves towards index 0 and towards the end
+        self.left = {}
+        self.right = {}
+        # row -> the row with its cells reversed; row -> its cells spread over column 0 of a board
+        self.reversed = {}
+        self.spread = {}
+
+    def row_cells(self, row):
+        """Split a packed row into a list of exponents, index 0 first."""
+        return [(row >> s) & CELL_MASK for s in range(0, self.row_bits, CELL_BITS)]
+
+    def cells_row(self, cells):
+        """Pack a list of exponents (index 0 first) into a row."""
+        row = 0
+        for i, e in enumerate(cells):
+            row |= e << (CELL_BITS * i)
+        return row
+
+    def _memo(self, table, row, compute):
+        value = table.get(row)
+        if value is None:
+            if len(table) >= MAX_MEMO:
+                table.clear()
+            value = table[row] = compute(row)
+        return value
+
+    def _move_left(self, row):
+        cells = self.row_cells(row)
+        score = Bitboard.move_row(cells, MAX_EXPONENT)
+        return self.cells_row(cells), score
+
+    def _move_right(self, row):
+        cells = self.row_cells(row)[::-1]
+        score = Bitboard.move_row(cells, MAX_EXPONENT)
+        return self.cells_row(cells[::-1]), score
+
+    def _reverse(self, row):
+        return self.cells_row(self.row_cells(row)[::-1])
+
+    def _spread(self, row):
+        spread = 0
+        for x, e in enumerate(self.row_cells(row)):
+            spread |= e << (self.row_bits * x)
+        return spread
+
+    def pack(self, tiles):
+        """
+        Pack an array of tile values into a board.
+
+        Args:
+            tiles (np.ndarray): The tile values, shape (size, size).
+
+        Returns:
+            int: The packed board.
+        """
+        board = 0
+        shift = 0
+        for row in tiles:
+            for v in row:
+                v = int(v)
+                if v:
+                    board |= (v.bit_length() - 1) << shift
+                shift += CELL_BITS
+        return board
+
+    def unpack(self, board):
+        """
+        Unpack a board into an array of tile values.
+
+        Args:
+            board (int): The packed board.
+
+        Returns:
+            np.ndarray: The tile values as an int32 array.
+        """
+        size = self.SIZE
+        tiles = np.zeros((size, size), dtype=np.int32)
+        for i, s in enumerate(self.cell_shifts):
+            e = (board >> s) & CELL_MASK
+            if e:
+                tiles[i // size][i % size] = 1 << e
+        return tiles
+
+    def pack_exponents(self, exponents):
+        """
+        Pack an array of tile exponents (0 for an empty cell) into a board.
+
+        Args:
+            exponents (np.ndarray): The exponents, shape (size, size).
+
+        Returns:
+            int: The packed board.
+        """
+        board = 0
+        for e, s in zip(np.asarray(exponents).ravel().tolist(), self.cell_shifts):
+            board |= e << s
+        return board
+
+    def unpack_exponents(self, board):
+        """
+        Unpack a board into an array of tile exponents.
+
+        Args:
+            board (int): The packed board.
+
+        Returns:
+            np.ndarray: The exponents as a uint8 array.
+        """
+        rows = [self.row_cells((board >> s) & self.row_mask) for s in self.row_shifts]
+        return np.array(rows, dtype=np.uint8)
+
+    def transpose(self, board):
+        """Transpose a board (swap x and y)."""
+        spread = self.spread
+        result = 0
+        for y, shift in enumerate(self.row_shifts):
+            row = (board >> shift) & self.row_mask
+            s = spread.get(row)
+            if s is None:
+                s = self._memo(spread, row, self._spread)
+            result |= s << (CELL_BITS * y)
+        return result
+
+    def mirror(self, board):
+        """Reverse the order of the cells in every row."""
+        result = 0
+        for shift in self.row_shifts:
+            row = (board >> shift) & self.row_mask
+            result |= self._memo(self.reversed, row, self._reverse) << shift
+        return result
+
+    def flip(self, board):
+        """Reverse the order of the rows."""
+        result = 0
+        last = self.row_shifts[-1]
+        for shift in self.row_shifts:
+            result |= ((board >> shift) & self.row_mask) << (last - shift)
+        return result
+
+    def _move_rows(self, board, table, compute):
+        new = 0
+        score = 0
+        for shift in self.row_shifts:
+            row = (board >> shift) & self.row_mask
+            moved = table.get(row)
+            if moved is None:
+                moved = self._memo(table, row, compute)
+            new |= moved[0] << shift
+            score += moved[1]
+        return new, score
+
+    def move(self, board, direction):
+        """
+        Move a board in the given direction.
+
+        Args:
+            board (int): The packed board.
+            direction (str|int): The direction ('U', 'D', 'L', 'R' or 0-3 as in Game.nmap).
+
+        Returns:
+            tuple: The new board and the score of the move, as Grid.run would return it.
+        """
+        if isinstance(direction, int):
+            direction = DIRECTIONS[direction]
+        if direction == 'L':
+            return self._move_rows(board, self.left, self._move_left)
+        if direction == 'R':
+            return self._move_rows(board, self.right, self._move_right)
+        if direction == 'U':
+            new, score = self._move_rows(self.transpose(board), self.left, self._move_left)
+        else:
+            new, score = self._move_rows(self.transpose(board), self.right, self._move_right)
+        return self.transpose(new), score
+
+    def empty_shifts(self, board):
+        """Get the bit offsets of the empty cells of a board, in cell order."""
+        return [s for s in self.cell_shifts if not (board >> s) & CELL_MASK]
+
+    def board_full(self, board):
+        """Check whether a board has no empty cell."""
+        for s in self.cell_shifts:
+            if not (board >> s) & CELL_MASK:
+                return False
+        return True
+
+    def count_empty(self, board):
+        """Count the empty cells of a board."""
+        return len(self.empty_shifts(board))
+
+    def max_exponent(self, board):
+        """Get the largest exponent on a board."""
+        return max((board >> s) & CELL_MASK for s in self.cell_shifts)
+
+    def is_over(self, board):
+        """Check whether no move changes the board."""
+        if not self.board_full(board):
+            return False
+        for direction in DIRECTIONS:
+            if self.move(board, direction)[0] != board:
+                return False
+        return True
+
+
+def engine(size):
+    """
+    Get the engine of a grid size.
+
+    Args:
+        size (int): The size of the grid.
+
+    Returns:
+        The Bitboard module for 4x4 grids, else a shared PackedEngine of the size.
+    """
+    if size == Bitboard.SIZE:
+        return Bitboard
+    if size not in _engines:
+        _engines[size] = PackedEngine(size)
+    return _engines[size]
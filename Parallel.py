@@ -0,0 +1,217 @@
+"""
+Parallel root search for Ai.get_next.
+
+The root branches of a search (the first move, or the first move and the
+tile spawn after it) are spread over a persistent process pool. Boards are
+sent packed, every worker builds the lookup tables once when it starts, and
+results are merged in submission order, so the outcome does not depend on
+which worker finished first.
+
+Like the serial search, every worker keeps its search cache from task to
+task and from move to move, so the transpositions of one move save work in
+the next. A cached chance value depends on the path that first reached it
+(through the probability cutoff), so a value can then depend on which
+worker searched a branch. With fresh_cache the workers clear their cache
+before every branch and results are exactly reproducible, at the cost of
+searching every move from scratch.
+"""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import Bitboard
+import Heuristic
+from Cache import TranspositionTable
+from Search import Expectimax, MOVE_ORDER
+
+# Per-process search state, set up by _init_worker
+_search = None
+_evaluate_batch = None
+_fresh_cache = False
+
+
+def _init_worker(heuristic, cache_bytes, weights=None, canonical=False, fresh_cache=False):
+    """Build the lookup tables and the search of a worker process."""
+    global _search, _evaluate_batch, _fresh_cache
+    _fresh_cache = fresh_cache
+    Bitboard.init_tables()
+    evaluate_packed, _evaluate_batch = Heuristic.evaluator(heuristic, weights)
+    eval_cache = TranspositionTable(cache_bytes)
+    key = Bitboard.canonical_key if canonical else None
+
+    def evaluate(board):
+        if key is not None:
+            board = key(board)
+        value = eval_cache.get(board)
+        if value is None:
+            value = evaluate_packed(board)
+            eval_cache.put(board, value)
+        return value
+
+    _search = Expectimax(evaluate, cache=TranspositionTable(cache_bytes, policy='depth'), key=key)
+
+
+def _expectimax_task(task):
+    """
+    Search one root branch in a worker.
+
+    Args:
+        task (tuple): (board, kind, depth, prob, prob_cutoff); kind is 'chance' for the board after a
+            root move, 'max' for the board after a root move and a spawn.
+
+    Returns:
+        float: The value of the branch.
+    """
+    board, kind, depth, prob, prob_cutoff = task
+    if _fresh_cache:
+        _search.cache.clear()
+    _search.prob_cutoff = prob_cutoff
+    if kind == 'chance':
+        return _search.chance_node(board, depth, prob)
+    return _search.max_node(board, depth, prob)
+
+
+def _sample_task(task):
+    """
+    Score a group of direction sequences like the sampling Ai.get_next in a worker.
+
+    Args:
+        task (tuple): (board, sequences, kn, seed); board is packed.
+
+    Returns:
+        list: The minimum evaluation over kn samples of each sequence.
+    """
+    from PlayerAI import get_grids
+
+    board, sequences, kn, seed = task
+    tiles = Bitboard.unpack(board)
+    rng = np.random.default_rng(seed)
+    return [_evaluate_batch(get_grids(tiles, d, kn, rng)).min() for d in sequences]
+
+
+class RootPool:
+    """Persistent process pool searching root branches in parallel."""
+
+    def __init__(self, workers, heuristic='compat', split=1, min_empty=4, cache_bytes=16 << 20, weights=None,
+                 canonical=False, fresh_cache=False):
+        """
+        Initialize the pool; the worker processes start on the first search.
+
+        Args:
+            workers (int): The number of worker processes.
+            heuristic (str): The evaluation the workers use, see Heuristic.evaluator (default: 'compat').
+            split (int): Split the root by the first move (1) or by the first move and spawn (2) (default: 1).
+            min_empty (int): Below this many empty cells the search is cheap and runs serially (default: 4).
+            cache_bytes (int): Memory cap of each worker cache (default: 16 MB).
+            weights (str): The weights file of the 'ntuple' evaluation (default: None, NTuple.WEIGHTS).
+            canonical (bool): Key the worker caches by Bitboard.canonical_key; only for a symmetric
+                evaluation (default: False).
+            fresh_cache (bool): Clear the worker search cache before every root branch, so that results do not
+                depend on which worker searched which branch (default: False).
+        """
+        self.workers = workers
+        self.heuristic = heuristic
+        self.split = split
+        self.min_empty = min_empty
+        self.cache_bytes = cache_bytes
+        self.weights = weights
+        self.canonical = canonical
+        self.fresh_cache = fresh_cache
+        self.executor = None
+        # Value of every root move of the last expectimax search
+        self.root_values = {}
+
+    def start(self):
+        """Start the worker processes if they are not running."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self.heuristic, self.cache_bytes, self.weights, self.canonical, self.fresh_cache)
+            )
+            # Wait for every worker to finish building its tables
+            list(self.executor.map(abs, range(self.workers)))
+        return self.executor
+
+    def close(self):
+        """Shut the worker processes down."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def worth_it(self, board, depth):
+        """
+        Check whether a search is big enough to be worth sending to the pool.
+
+        Args:
+            board (int): The packed board.
+            depth (int): The search depth.
+
+        Returns:
+            bool: True to search in parallel, False to search serially.
+        """
+        return self.workers > 1 and depth >= 2 and Bitboard.count_empty(board) >= self.min_empty
+
+    def search_expectimax(self, board, depth, prob_cutoff):
+        """
+        Find the best move for a board with the root branches searched in parallel.
+
+        Args:
+            board (int): The packed board.
+            depth (int): The number of moves to look ahead, at least 2.
+            prob_cutoff (float): The probability cutoff.
+
+        Returns:
+            tuple: The best direction and its value, or (None, None) if no move is possible.
+        """
+        moves = []
+        tasks = []
+        for d in MOVE_ORDER:
+            new, _ = Bitboard.move(board, d)
+            if new == board:
+                continue
+            if self.split == 1:
+                moves.append((d, [1.0]))
+                tasks.append((new, 'chance', depth - 1, 1.0, prob_cutoff))
+                continue
+            shifts = Bitboard.empty_shifts(new)
+            weights = []
+            for s in shifts:
+                for exponent, p in ((1, 0.9), (2, 0.1)):
+                    weights.append(p / len(shifts))
+                    tasks.append((new | (exponent << s), 'max', depth - 1, p / len(shifts), prob_cutoff))
+            moves.append((d, weights))
+        if not moves:
+            self.root_values = {}
+            return None, None
+        results = iter(self.start().map(_expectimax_task, tasks, chunksize=max(1, len(tasks) // (4 * self.workers))))
+        best_d, best = None, None
+        self.root_values = {}
+        for d, weights in moves:
+            value = sum(w * next(results) for w in weights)
+            self.root_values[d] = value
+            if best is None or value > best:
+                best_d, best = d, value
+        return best_d, best
+
+    def search_sample(self, board, kn, seed):
+        """
+        Score the 64 direction triples of the sampling search in parallel.
+
+        Args:
+            board (int): The packed board.
+            kn (int): The number of samples per triple.
+            seed (int): Seed of the worker random generators.
+
+        Returns:
+            list: [directions, min evaluation] for every triple, in itertools.product order.
+        """
+        sequences = list(itertools.product(MOVE_ORDER, repeat=3))
+        group = 16 if self.split == 1 else 4
+        tasks = [
+            (board, sequences[i:i + group], kn, (seed, i))
+            for i in range(0, len(sequences), group)
+        ]
+        scores = itertools.chain.from_iterable(self.start().map(_sample_task, tasks))
+        return [[d, s] for d, s in zip(sequences, scores)]
@@ -1,16 +1,30 @@
 import itertools
+import logging
+import os
+import time
 import numpy as np
-from Game import Grid, Game
+import Bitboard
+import Book
+import Heuristic
+import Packed
+from Batch import move_batch, spawn_batch
+from Cache import TranspositionTable
+from Game import Game, new_grid, to_values
+from Parallel import RootPool
+from Rollout import RolloutSearch
+from Search import Expectimax
+from Stats import SearchStats
 from Constants import *
 
 config = Base()
+logger = logging.getLogger(__name__)
 
 
 def get_grid(tiles, directions):
     """
     Get the grid after applying the given directions on the tiles.
     """
-    g = Grid(config.SIZE)
+    g = new_grid(len(tiles), config.ENGINE)
     g.tiles = tiles.copy()
     for direction in directions:
         g.run(direction)
@@ -18,6 +32,17 @@ def get_grid(tiles, directions):
     return g.tiles
 
 
+def get_grids(tiles, directions, n, rng=None):
+    """
+    Get n random outcomes of applying the given directions on the tiles, as one batch.
+    """
+    boards = np.repeat(np.asarray(tiles, dtype=np.int32)[np.newaxis], n, axis=0)
+    for direction in directions:
+        boards = move_batch(boards, direction)[0]
+        spawn_batch(boards, rng)
+    return boards
+
+
 def printf(tiles):
     """
     Print the tiles in a formatted way.
@@ -44,25 +69,206 @@ class Ai:
     AI player for the 2048 game.
     """
 
-    def __init__(self):
-        self.g = Grid(config.SIZE)
+    def __init__(self, seed=None, mode=None, depth=None, prob_cutoff=None, heuristic=None, workers=None,
+                 rollouts=None, book=None):
+        """
+        Args:
+            seed (int): Seed for the sampling random generator (default: None).
+            mode (str): 'sample', 'expectimax' or 'rollout' (default: config.AI_MODE).
+            depth (int): Expectimax look-ahead in moves (default: config.SEARCH_DEPTH).
+            prob_cutoff (float): Expectimax probability cutoff (default: config.PROB_CUTOFF).
+            heuristic (str): Evaluation, 'compat', 'log2', 'corners' or 'ntuple' (default: config.HEURISTIC).
+            workers (int): Processes for the parallel root search, 0 or 1 to search serially (default: config.WORKERS).
+            rollouts (int): Rollouts per root move in the 'rollout' mode (default: config.ROLLOUTS).
+            book (str): Opening book file, see Book (default: config.OPENING_BOOK).
+        """
+        depth = config.SEARCH_DEPTH if depth is None else depth
+        if depth < 1:
+            raise ValueError('The search depth must be at least 1, got {}'.format(depth))
+        rollouts = config.ROLLOUTS if rollouts is None else rollouts
+        if rollouts < 1:
+            raise ValueError('The number of rollouts must be at least 1, got {}'.format(rollouts))
+        self.rng = np.random.default_rng(seed)
+        self.mode = mode or config.AI_MODE
+        self.heuristic = heuristic or config.HEURISTIC
+        # A symmetric evaluation lets the caches share one entry between the 8 symmetries of a board
+        canonical = config.CANONICAL_CACHE and Heuristic.is_symmetric(self.heuristic)
+        # Both tables live as long as the Ai (and the grid size), so consecutive moves reuse each other's work
+        self.eval_cache = TranspositionTable(config.CACHE_BYTES)
+        self.search_cache = TranspositionTable(config.CACHE_BYTES, policy='depth')
+        self.expectimax = Expectimax(
+            self.evaluate_board,
+            depth,
+            config.PROB_CUTOFF if prob_cutoff is None else prob_cutoff,
+            self.search_cache,
+            config.MAX_DEPTH
+        )
+        workers = config.WORKERS if workers is None else workers
+        self.pool = (
+            RootPool(
+                workers, self.heuristic, config.PARALLEL_SPLIT, weights=config.NTUPLE_WEIGHTS,
+                canonical=canonical, fresh_cache=config.PARALLEL_FRESH_CACHE
+            )
+            if workers > 1 else None
+        )
+        self.rollout = RolloutSearch(
+            rollouts, config.ROLLOUT_DEPTH, config.ROLLOUT_POLICY, config.ROLLOUT_BATCH, self.rng
+        )
+        self.book = self.open_book(book or config.OPENING_BOOK)
+        self.stats = SearchStats()
+        self.timing = False
+        self.sample_nodes = 0
+        # Value of every move considered by the last get_next, by direction, and in the 'rollout' mode
+        # the variance of the rollout scores behind it
+        self.move_values = {}
+        self.move_variances = {}
+        self.size = None
+        self.set_size(config.SIZE)
+
+    def set_size(self, size):
+        """
+        Set up the board engine, evaluation and search for a grid size; get_next calls it when the size changes.
+
+        The 'ntuple' heuristic only exists for 4x4 grids; other sizes fall back to 'compat'.
+
+        Args:
+            size (int): The size of the grid.
+        """
+        canonical = config.CANONICAL_CACHE and Heuristic.is_symmetric(self.heuristic)
+        self.size = size
+        self.g = new_grid(size, config.ENGINE)
+        self.engine = Packed.engine(size)
+        try:
+            self.eval_packed, self.eval_batch = Heuristic.evaluator(self.heuristic, config.NTUPLE_WEIGHTS, size)
+        except ValueError as e:
+            logger.warning('%s, using the compat heuristic', e)
+            self.eval_packed, self.eval_batch = Heuristic.evaluator('compat', size=size)
+        self.cache_key = Bitboard.canonical_key if canonical and size == Bitboard.SIZE else None
+        self.expectimax.engine = self.engine
+        self.expectimax.key = self.cache_key
+        # Packed boards of two sizes can be equal integers
+        self.clear_cache()
+        self.set_timing(self.timing)
+
+    def open_book(self, path):
+        """
+        Open the opening book of the heuristic, if there is one.
+
+        Args:
+            path (str): The book file, or None.
+
+        Returns:
+            Book.OpeningBook: The book, or None if there is no book or it was built for another evaluation.
+        """
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            return Book.OpeningBook(path, Book.evaluator_stamp(self.heuristic, config.NTUPLE_WEIGHTS))
+        except (OSError, ValueError) as e:
+            logger.warning('%s, playing without it', e)
+            return None
+
+    def set_timing(self, enabled):
+        """
+        Turn on or off the measurement of the time spent moving boards versus evaluating them.
+
+        It costs a clock read around every move and evaluation, so it is off by default.
+        """
+        self.timing = enabled
+        if enabled:
+            self.expectimax.move = self.stats.timed(self.engine.move, 'move_time')
+            self.expectimax.evaluate = self.stats.timed(self.evaluate_board, 'eval_time')
+        else:
+            self.expectimax.move = self.engine.move
+            self.expectimax.evaluate = self.evaluate_board
+
+    def get_stats(self):
+        """
+        Get the search statistics, including the hit rate of the caches, as a dict.
+        """
+        return self.stats.summary((self.eval_cache, self.search_cache))
+
+    def stop(self):
+        """
+        Make a running get_next with a deadline return now with its best move so far.
+        """
+        self.expectimax.stop()
+        self.rollout.stop()
 
-    def get_next(self, tiles):
+    def close(self):
+        """
+        Shut down the worker processes of the parallel search, if any.
+        """
+        if self.pool is not None:
+            self.pool.close()
+
+    def get_next(self, tiles, deadline=None, exponents=False):
         """
         Get the next move for the AI player based on the current tiles configuration.
+
+        With a deadline (a time.time() value) the expectimax mode deepens iteratively and returns
+        the best move of the deepest search that finished in time; the sampling mode ignores it.
+        With exponents the tiles are uint8 exponents (Grid.exponents), which the expectimax mode
+        packs directly.
+        """
+        start = time.perf_counter()
+        if len(tiles) != self.size:
+            self.set_size(len(tiles))
+        self.move_variances = {}
+        if self.book is not None and self.size == Bitboard.SIZE:
+            board = Bitboard.pack_exponents(tiles) if exponents else Bitboard.pack(tiles)
+            hit = self.book.lookup(board)
+            if hit is not None:
+                self.move_values = {hit[0]: hit[1]}
+                self.stats.book_hits += 1
+                self.stats.record_move(time.perf_counter() - start, self.book.depth, 0)
+                return hit
+        if self.mode == 'expectimax':
+            nodes = self.expectimax.nodes
+            board = self.engine.pack_exponents(tiles) if exponents else self.engine.pack(tiles)
+            result = self.get_next_expectimax(board, deadline)
+            depth, nodes = self.expectimax.completed_depth, self.expectimax.nodes - nodes
+        elif self.mode == 'rollout':
+            result = self.get_next_rollout(to_values(tiles) if exponents else tiles, deadline)
+            depth, nodes = self.rollout.completed_depth, self.rollout.nodes
+        else:
+            result = self.get_next_sample(to_values(tiles) if exponents else tiles)
+            depth, nodes = 3, self.sample_nodes
+        self.stats.record_move(time.perf_counter() - start, depth, nodes)
+        return result
+
+    def get_next_sample(self, tiles):
+        """
+        Get the next move by sampling random outcomes of every sequence of three moves.
         """
         score_list = []
+        self.sample_nodes = 0
+        self.move_values = {}
         tn = self.get_tile_num(tiles)
         if tn >= self.g.size ** 2 / 3:
-            return "RD"[np.random.randint(0, 2)], 0
-        kn = min(max(tn ** 2, 20), 40)
-        for directions in itertools.product("ULRD", repeat=3):
-            fen = []
-            for i in range(kn):
-                t_g = get_grid(tiles, directions)
-                fen.append(self.get_score(t_g))
-            print(directions, min(fen))
-            score_list.append([directions, min(fen)])
+            return "RD"[self.rng.integers(0, 2)], 0
+        kn = min(max(tn ** 2, config.SAMPLE_MIN), config.SAMPLE_MAX)
+        self.sample_nodes = 64 * 3 * kn
+        if self.pool is not None and self.size == Bitboard.SIZE and tn >= self.pool.min_empty:
+            seed = int(self.rng.integers(1 << 32))
+            score_list = self.pool.search_sample(Bitboard.pack(tiles), kn, seed)
+        else:
+            for directions in itertools.product("ULRD", repeat=3):
+                if self.timing:
+                    t0 = time.perf_counter()
+                    boards = get_grids(tiles, directions, kn, self.rng)
+                    t1 = time.perf_counter()
+                    fen = self.evaluate_batch(boards)
+                    self.stats.move_time += t1 - t0
+                    self.stats.eval_time += time.perf_counter() - t1
+                else:
+                    fen = self.evaluate_batch(get_grids(tiles, directions, kn, self.rng))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('%s %s', directions, min(fen))
+                score_list.append([directions, min(fen)])
+        for directions, score in score_list:
+            d = directions[0]
+            self.move_values[d] = max(self.move_values.get(d, score / kn), score / kn)
         score_list = sorted(score_list, key=(lambda x: [x[1]]))
         # print(score_list)
         for d in score_list[::-1]:
@@ -72,14 +278,82 @@ class Ai:
         self.g.tiles = tiles.copy()
         return score_list[-1][0][0], score_list[-1][1] / kn
 
+    def get_next_rollout(self, tiles, deadline=None):
+        """
+        Get the next move by batched Monte Carlo rollouts from every legal move.
+        """
+        if deadline is None and config.ROLLOUT_TIME:
+            deadline = time.time() + config.ROLLOUT_TIME
+        direction, value = self.rollout.search(tiles, deadline)
+        stats = self.rollout.root_stats
+        self.move_values = {d: mean for d, (mean, _, _) in stats.items()}
+        self.move_variances = {d: variance for d, (_, variance, _) in stats.items()}
+        if direction is None:
+            return "RD"[self.rng.integers(0, 2)], value
+        return direction, value
+
+    def get_next_expectimax(self, board, deadline=None):
+        """
+        Get the next move for a packed board by expectimax search over the tile spawns.
+        """
+        search = self.expectimax
+        pool = self.pool if self.size == Bitboard.SIZE else None
+        if deadline is None and pool is not None and pool.worth_it(board, search.depth):
+            direction, value = pool.search_expectimax(board, search.depth, search.prob_cutoff)
+            self.move_values = dict(pool.root_values)
+        else:
+            direction, value = search.search(board, deadline)
+            self.move_values = dict(search.root_values)
+        if direction is None:
+            return "RD"[self.rng.integers(0, 2)], value
+        return direction, value
+
+    def evaluate(self, tiles):
+        """
+        Calculate the score for a given tiles configuration, like get_score but without logging.
+
+        Uses the Heuristic lookup tables (or the n-tuple network); in 'compat' mode the result equals get_score.
+        """
+        if len(tiles) == self.size:
+            return self.eval_packed(self.engine.pack(tiles))
+        return self.eval_batch(np.asarray(tiles)[np.newaxis])[0]
+
+    def evaluate_batch(self, boards):
+        """
+        Calculate the score of every board of an (N, size, size) stack.
+        """
+        self.stats.evals += len(boards)
+        return self.eval_batch(boards)
+
+    def evaluate_board(self, board):
+        """
+        Calculate the score for a packed board through the evaluation cache.
+        """
+        if self.cache_key is not None:
+            board = self.cache_key(board)
+        value = self.eval_cache.get(board)
+        if value is None:
+            self.stats.evals += 1
+            value = self.eval_packed(board)
+            self.eval_cache.put(board, value)
+        return value
+
+    def clear_cache(self):
+        """
+        Empty the evaluation and search caches, e.g. when the evaluation changes.
+        """
+        self.eval_cache.clear()
+        self.search_cache.clear()
+
     def get_score(self, tiles):
         """
         Calculate the score for a given tiles configuration.
         """
         a = self.get_bj2__4(tiles)
         b = self.get_bj__4(tiles)
-        print(a, b)
-        return a * 2.8 + b
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s %s', a, b)
+        return a * Heuristic.BJ2_WEIGHT + b
 
     def debug(self, tiles):
         """
@@ -107,12 +381,7 @@ class Ai:
         """
         Get the number of empty tiles on the grid.
         """
-        n = 0
-        for row in tiles:
-            for i in row:
-                if i == 0:
-                    n += 1
-        return n
+        return int(np.count_nonzero(np.asarray(tiles) == 0))
 
     def get_bj(self, tiles):
         """
@@ -126,13 +395,31 @@ class Ai:
         ]
         return gjs
 
+    def get_bj__1(self, tiles):
+        """
+        Get the evaluation score for the first quadrant (top left corner) of the grid.
+        """
+        return self.get_bj__4(np.asarray(tiles)[::-1, ::-1])
+
+    def get_bj__2(self, tiles):
+        """
+        Get the evaluation score for the second quadrant (top right corner) of the grid.
+        """
+        return self.get_bj__4(np.asarray(tiles)[::-1, :])
+
+    def get_bj__3(self, tiles):
+        """
+        Get the evaluation score for the third quadrant (bottom left corner) of the grid.
+        """
+        return self.get_bj__4(np.asarray(tiles)[:, ::-1])
+
     def get_bj__4(self, tiles):
         """
         Get the evaluation score for the fourth quadrant of the grid.
         """
         bj = 0
         l = len(tiles)
-        size = self.g.size - 1
+        size = l - 1
         for y in range(l):
             for x in range(l):
                 z = tiles[y][x]
@@ -143,8 +430,6 @@ class Ai:
                     bj += (100 - 20 * (x + y - (size * 2 - 1)))
         return bj
 
-    # Implement the other get_bj__ functions similarly
-
     def get_bj2(self, tiles):
         """
         Get the second evaluation scores for each quadrant of the grid.
@@ -157,7 +442,23 @@ class Ai:
         ]
         return gjs
 
-    # Implement the get_bj2__ functions similarly
+    def get_bj2__1(self, tiles):
+        """
+        Get the second evaluation score for the first quadrant (top left corner) of the grid.
+        """
+        return self.get_bj2__4(np.asarray(tiles)[::-1, ::-1])
+
+    def get_bj2__2(self, tiles):
+        """
+        Get the second evaluation score for the second quadrant (top right corner) of the grid.
+        """
+        return self.get_bj2__4(np.asarray(tiles)[::-1, :])
+
+    def get_bj2__3(self, tiles):
+        """
+        Get the second evaluation score for the third quadrant (bottom left corner) of the grid.
+        """
+        return self.get_bj2__4(np.asarray(tiles)[:, ::-1])
 
     def get_bj2__4(self, tiles):
         """
@@ -0,0 +1,213 @@
+"""
+Binary game recordings.
+
+A recording is a small header (format version, grid size, seed of the game
+and keyframe interval), a keyframe with the starting board, then one 4-byte
+record per move: the direction, the cell a tile spawned in and the exponent
+of that tile. After every `interval` moves a keyframe with the board and the
+score is written, so a reader can jump to any move by replaying at most
+`interval` moves:
+
+    header | keyframe 0 | interval moves | keyframe 1 | interval moves | ...
+
+The file is append-only and written through a buffer that is flushed at
+every keyframe, so recording costs a few bytes per move. A recording cut off
+by a crash is still readable up to its last complete move.
+"""
+
+import struct
+
+import numpy as np
+
+from Bitboard import DIRECTIONS
+
+MAGIC = b'2048REC\0'
+VERSION = 1
+# Magic, version, grid size, keyframe interval, seed (-1 if unknown)
+HEADER = struct.Struct('<8sHHHxxq')
+MOVE_DTYPE = np.dtype([('direction', 'u1'), ('cell', 'u1'), ('exponent', 'u1'), ('flags', 'u1')])
+NO_SPAWN = 255
+
+
+def keyframe_bytes(size):
+    """Size of a keyframe of a grid size: the score (int64) and one exponent byte per cell, 8-byte aligned."""
+    return 8 + -(-size * size // 8) * 8
+
+
+def _exponent(value):
+    return int(value).bit_length() - 1 if value else 0
+
+
+class Recorder:
+    """Writes a game to a recording file as it is played."""
+
+    def __init__(self, path, size, seed=None, interval=64):
+        """
+        Create the file and write its header.
+
+        Args:
+            path (str): The file to write.
+            size (int): The size of the grid.
+            seed (int): The seed of the game, stored for reference (default: None).
+            interval (int): The number of moves between two keyframes (default: 64).
+        """
+        if size * size > NO_SPAWN:
+            raise ValueError('Grids of more than {} cells cannot be recorded'.format(NO_SPAWN))
+        self.path = path
+        self.size = size
+        self.interval = interval
+        self.moves = 0
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, size, interval, -1 if seed is None else seed))
+
+    def keyframe(self, tiles, score):
+        """
+        Write a keyframe and flush the file.
+
+        Args:
+            tiles (np.ndarray): The tile values.
+            score (int): The score of the game.
+        """
+        frame = bytearray(keyframe_bytes(self.size))
+        struct.pack_into('<q', frame, 0, int(score))
+        exponents = [_exponent(v) for v in np.asarray(tiles).ravel()]
+        frame[8:8 + len(exponents)] = bytes(exponents)
+        self.file.write(frame)
+        self.file.flush()
+
+    def record(self, direction, spawn, tiles, score):
+        """
+        Write one move.
+
+        Args:
+            direction (str): The direction of the move.
+            spawn (tuple): ((x, y), value) of the tile added after the move, or None.
+            tiles (np.ndarray): The tile values after the move and the spawn, for keyframes.
+            score (int): The score after the move, for keyframes.
+        """
+        if spawn is None:
+            cell, exponent = NO_SPAWN, 0
+        else:
+            (x, y), value = spawn
+            cell, exponent = y * self.size + x, _exponent(value)
+        self.file.write(bytes((DIRECTIONS.index(direction), cell, exponent, 0)))
+        self.moves += 1
+        if self.moves % self.interval == 0:
+            self.keyframe(tiles, score)
+
+    def close(self):
+        """Flush and close the file."""
+        if not self.file.closed:
+            self.file.close()
+
+
+class GameReader:
+    """Memory-mapped recording with random access to every position."""
+
+    def __init__(self, path):
+        """
+        Open a recording.
+
+        Args:
+            path (str): The recording file.
+        """
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if len(self.data) < HEADER.size:
+            raise ValueError('Not a game recording: {}'.format(path))
+        magic, version, self.size, self.interval, seed = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a game recording (or an unknown version): {}'.format(path))
+        self.seed = None if seed < 0 else seed
+        self.keyframe_size = keyframe_bytes(self.size)
+        self.block_size = self.interval * MOVE_DTYPE.itemsize + self.keyframe_size
+        body = len(self.data) - HEADER.size - self.keyframe_size
+        if body < 0:
+            raise ValueError('Truncated game recording: {}'.format(path))
+        blocks, rest = divmod(body, self.block_size)
+        self.keyframes = 1 + blocks
+        self.moves = blocks * self.interval + min(rest // MOVE_DTYPE.itemsize, self.interval)
+
+    def __len__(self):
+        """The number of recorded moves."""
+        return self.moves
+
+    def close(self):
+        """Release the memory map."""
+        self.data = None
+
+    def keyframe(self, index):
+        """
+        Read a keyframe.
+
+        Args:
+            index (int): The number of the keyframe; keyframe i is the position after i * interval moves.
+
+        Returns:
+            tuple: The tile values (np.ndarray) and the score.
+        """
+        offset = HEADER.size + index * self.block_size
+        (score,) = struct.unpack_from('<q', self.data, offset)
+        cells = self.data[offset + 8:offset + 8 + self.size * self.size].astype(np.int32)
+        tiles = np.where(cells > 0, np.left_shift(1, cells), 0).astype(np.int32)
+        return tiles.reshape(self.size, self.size), score
+
+    def move_records(self, start, stop):
+        """
+        Read the records of a range of moves within one keyframe block.
+
+        Args:
+            start (int): The first move.
+            stop (int): The move after the last one; start and stop - 1 must share a block.
+
+        Returns:
+            np.ndarray: The records, with MOVE_DTYPE.
+        """
+        block, first = divmod(start, self.interval)
+        offset = HEADER.size + self.keyframe_size + block * self.block_size + first * MOVE_DTYPE.itemsize
+        return self.data[offset:offset + (stop - start) * MOVE_DTYPE.itemsize].view(MOVE_DTYPE)
+
+    def move(self, n):
+        """
+        Read one move.
+
+        Args:
+            n (int): The number of the move, from 0.
+
+        Returns:
+            tuple: The direction, ((x, y), value) of the spawned tile or None.
+        """
+        if not 0 <= n < self.moves:
+            raise IndexError('Move {} out of range (0-{})'.format(n, self.moves - 1))
+        record = self.move_records(n, n + 1)[0]
+        return DIRECTIONS[record['direction']], self._spawn(record)
+
+    def _spawn(self, record):
+        if record['cell'] == NO_SPAWN:
+            return None
+        y, x = divmod(int(record['cell']), self.size)
+        return (x, y), 1 << int(record['exponent'])
+
+    def board(self, n):
+        """
+        Get the position after n moves, replaying from the closest keyframe.
+
+        Args:
+            n (int): The number of moves, from 0 to len(self).
+
+        Returns:
+            tuple: The tile values (np.ndarray) and the score.
+        """
+        from Game import Grid
+
+        if not 0 <= n <= self.moves:
+            raise IndexError('Position {} out of range (0-{})'.format(n, self.moves))
+        index = min(n // self.interval, self.keyframes - 1)
+        tiles, score = self.keyframe(index)
+        grid = Grid(self.size)
+        grid.tiles = tiles
+        for record in self.move_records(index * self.interval, n):
+            score += grid.run(DIRECTIONS[record['direction']])
+            spawn = self._spawn(record)
+            if spawn is not None:
+                grid.set_tiles(*spawn)
+        return grid.tiles, score
@@ -0,0 +1,150 @@
+"""
+Monte Carlo rollout search.
+
+Every legal root move is scored by playing many games on from the board after
+it, to the end or for a fixed number of moves, and averaging the score they
+make. The rollouts of all root moves are one NumPy batch: each step moves
+every live board in the four directions (Batch.move_batch), picks one of the
+moves that change it by the rollout policy and spawns a tile, so the cost of
+a step grows with the number of boards rather than with Python loops.
+
+Rollouts run in rounds of batch_size per move until the rollout count is
+reached or the deadline passes; an unfinished round is dropped, so a deadline
+never skews the averages towards short games.
+
+Policies:
+    - 'random': a uniformly random move among those that change the board.
+    - 'greedy': the move that scores most right away, ties broken at random.
+"""
+
+import time
+
+import numpy as np
+
+from Batch import move_batch, spawn_batch
+from Bitboard import DIRECTIONS
+from Search import MOVE_ORDER
+
+POLICIES = ('random', 'greedy')
+
+
+class RolloutSearch:
+    """Root move values estimated by batched random playouts."""
+
+    def __init__(self, rollouts=256, depth=None, policy='random', batch_size=64, rng=None):
+        """
+        Initialize the search.
+
+        Args:
+            rollouts (int): The number of rollouts per root move (default: 256).
+            depth (int): The number of moves a rollout plays after the root move, None to play to the end
+                (default: None).
+            policy (str): 'random' or 'greedy' (default: 'random').
+            batch_size (int): The number of rollouts per root move played together in one round (default: 64).
+            rng (np.random.Generator): The random generator (default: a fresh one).
+        """
+        if policy not in POLICIES:
+            raise ValueError('Unknown rollout policy: {}'.format(policy))
+        self.rollouts = rollouts
+        self.depth = depth
+        self.policy = policy
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.deadline = None
+        self.stopped = False
+        # Boards moved during the last search, and the longest rollout of it
+        self.nodes = 0
+        self.completed_depth = 0
+        # (mean, variance, count) of the rollout scores of every root move of the last search
+        self.root_stats = {}
+
+    def stop(self):
+        """Make a running search with a deadline return now with the rounds it has finished."""
+        self.stopped = True
+
+    def search(self, tiles, deadline=None):
+        """
+        Find the best move for a board.
+
+        Args:
+            tiles (np.ndarray): The tile values, shape (size, size).
+            deadline (float): A time.time() value after which no new round is started and the
+                current one is dropped, unless it is the first (default: None).
+
+        Returns:
+            tuple: The best direction and its mean rollout score, or (None, 0.0) if no move is possible.
+        """
+        tiles = np.asarray(tiles, dtype=np.int32)
+        roots = []
+        for d in MOVE_ORDER:
+            new, score, changed = move_batch(tiles[np.newaxis], d)
+            if changed[0]:
+                roots.append((d, new[0], int(score[0])))
+        self.root_stats = {}
+        self.nodes = 0
+        self.completed_depth = 0
+        if not roots:
+            return None, 0.0
+        self.stopped = False
+        self.deadline = deadline
+        total = np.zeros(len(roots))
+        squares = np.zeros(len(roots))
+        count = 0
+        while count < self.rollouts:
+            n = min(self.batch_size, self.rollouts - count)
+            scores = self.play(roots, n, first=count == 0)
+            if scores is None:
+                break
+            total += scores.sum(axis=1)
+            squares += (scores ** 2).sum(axis=1)
+            count += n
+        mean = total / count
+        variance = np.maximum(squares / count - mean ** 2, 0.0) * count / max(count - 1, 1)
+        self.root_stats = {d: (float(m), float(v), count) for (d, _, _), m, v in zip(roots, mean, variance)}
+        best = int(np.argmax(mean))
+        return roots[best][0], float(mean[best])
+
+    def play(self, roots, n, first=False):
+        """
+        Play one round of rollouts.
+
+        Args:
+            roots (list): (direction, board after the move, score of the move) of every root move.
+            n (int): The number of rollouts per root move.
+            first (bool): Whether this is the first round, which is always finished (default: False).
+
+        Returns:
+            np.ndarray: The score of every rollout including its root move, shape (len(roots), n), or
+                None if the deadline passed or the search was stopped before the round finished.
+        """
+        boards = np.repeat(np.stack([board for _, board, _ in roots]), n, axis=0)
+        scores = np.repeat(np.array([score for _, _, score in roots], dtype=np.int64), n)
+        spawn_batch(boards, self.rng)
+        live = np.arange(len(boards))
+        step = 0
+        while len(live) and (self.depth is None or step < self.depth):
+            if not first and (self.stopped or (self.deadline is not None and time.time() > self.deadline)):
+                return None
+            current = boards[live]
+            moved = [move_batch(current, d) for d in DIRECTIONS]
+            changed = np.stack([m[2] for m in moved])
+            gained = np.stack([m[1] for m in moved])
+            if self.policy == 'greedy':
+                keys = gained + self.rng.random(changed.shape)
+            else:
+                keys = self.rng.random(changed.shape)
+            keys[~changed] = -1
+            choice = keys.argmax(axis=0)
+            over = ~changed.any(axis=0)
+            index = np.arange(len(live))
+            new = np.stack([m[0] for m in moved])[choice, index]
+            scores[live] += np.where(over, 0, gained[choice, index])
+            self.nodes += 4 * len(live)
+            keep = ~over
+            live, new = live[keep], new[keep]
+            if len(live):
+                spawn_batch(new, self.rng)
+                boards[live] = new
+            step += 1
+        self.completed_depth = max(self.completed_depth, step + 1)
+        return scores.reshape(len(roots), n).astype(np.float64)
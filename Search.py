@@ -0,0 +1,194 @@
+"""
+Expectimax search over packed boards.
+
+Max nodes try every move, chance nodes average over every empty cell getting
+a 2 (probability 0.9) or a 4 (probability 0.1). A branch stops at the depth
+limit or once the probability of reaching it drops below the cutoff, and is
+then scored by the evaluation function.
+
+With a deadline the search deepens iteratively, one move deeper per
+iteration, and returns the best move of the deepest iteration that finished
+in time.
+"""
+
+import time
+
+import Bitboard
+
+# Same move order as Ai.get_next, ties go to the first one
+MOVE_ORDER = 'ULRD'
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when its deadline has passed or it was stopped."""
+
+
+class Expectimax:
+    """Depth and probability limited expectimax search."""
+
+    def __init__(self, evaluate, depth=2, prob_cutoff=1e-3, cache=None, max_depth=6, key=None, engine=Bitboard):
+        """
+        Initialize the search.
+
+        Args:
+            evaluate (callable): Maps a packed board to its evaluation.
+            depth (int): The number of moves to look ahead, including the root move (default: 2).
+            prob_cutoff (float): Branches less likely than this are evaluated instead of expanded (default: 1e-3).
+            cache (TranspositionTable): Table for chance node values, kept between searches (default: None).
+            max_depth (int): The deepest iteration of a search with a deadline (default: 6).
+            key (callable): Maps a board to its cache key, e.g. Bitboard.canonical_key when the evaluation
+                is symmetric (default: None, the board itself).
+            engine: The board engine, Bitboard or a Packed.PackedEngine for other sizes (default: Bitboard).
+        """
+        self.evaluate = evaluate
+        self.depth = depth
+        self.prob_cutoff = prob_cutoff
+        self.cache = cache
+        self.max_depth = max_depth
+        self.key = key
+        self.engine = engine
+        # Replaceable, e.g. by a timed wrapper (see Stats.SearchStats.timed)
+        self.move = engine.move
+        self.nodes = 0
+        self.deadline = None
+        self.stopped = False
+        self.completed_depth = 0
+        # Value of every root move of the last search
+        self.root_values = {}
+
+    def search(self, board, deadline=None):
+        """
+        Find the best move for a board.
+
+        Args:
+            board (int): The packed board.
+            deadline (float): A time.time() value; if given, deepen iteratively until it passes (default: None).
+
+        Returns:
+            tuple: The best direction and its expected evaluation, or (None, evaluation) if no move is possible.
+        """
+        roots = []
+        for d in MOVE_ORDER:
+            new, _ = self.move(board, d)
+            if new != board:
+                roots.append((d, new))
+        self.root_values = {}
+        if not roots:
+            return None, self.evaluate(board)
+        self.stopped = False
+        if deadline is None:
+            values = self.search_roots(roots, self.depth)
+            self.completed_depth = self.depth
+            self.root_values = values
+            return self.best(values)
+
+        # Depth 1 only evaluates the moves, so there is always a move to return
+        values = self.search_roots(roots, 1)
+        self.completed_depth = 1
+        self.deadline = deadline
+        try:
+            for depth in range(2, self.max_depth + 1):
+                # Search the best moves of the last iteration first, so their subtrees get into the cache first
+                roots.sort(key=lambda root: -values[root[0]])
+                values = self.search_roots(roots, depth)
+                self.completed_depth = depth
+        except SearchTimeout:
+            pass
+        finally:
+            self.deadline = None
+        self.root_values = values
+        return self.best(values)
+
+    def search_roots(self, roots, depth):
+        """
+        Get the value of every root move.
+
+        Args:
+            roots (list): (direction, board after the move) pairs.
+            depth (int): The number of moves to look ahead, including the root move.
+
+        Returns:
+            dict: The value of each direction.
+        """
+        return {d: self.chance_node(new, depth - 1, 1.0) for d, new in roots}
+
+    def best(self, values):
+        """
+        Pick the best move, ties going to the first one in MOVE_ORDER.
+
+        Args:
+            values (dict): The value of each direction.
+
+        Returns:
+            tuple: The best direction and its value.
+        """
+        best_d, best = None, None
+        for d in MOVE_ORDER:
+            if d in values and (best is None or values[d] > best):
+                best_d, best = d, values[d]
+        return best_d, best
+
+    def stop(self):
+        """Make a running search with a deadline return as if its deadline had passed."""
+        self.stopped = True
+
+    def max_node(self, board, depth, prob):
+        """
+        Get the value of the best move from a board.
+
+        Args:
+            board (int): The packed board, after a tile was spawned.
+            depth (int): The number of moves left, at least 1.
+            prob (float): The probability of reaching this board.
+
+        Returns:
+            float: The value of the best move, or the evaluation of the board if no move is possible.
+        """
+        self.nodes += 1
+        best = None
+        for d in MOVE_ORDER:
+            new, _ = self.move(board, d)
+            if new == board:
+                continue
+            value = self.chance_node(new, depth - 1, prob)
+            if best is None or value > best:
+                best = value
+        if best is None:
+            return self.evaluate(board)
+        return best
+
+    def chance_node(self, board, depth, prob):
+        """
+        Get the expected value of a board over the possible tile spawns.
+
+        Args:
+            board (int): The packed board, after a move.
+            depth (int): The number of moves left.
+            prob (float): The probability of reaching this board.
+
+        Returns:
+            float: The expected value.
+        """
+        if depth <= 0 or prob < self.prob_cutoff:
+            return self.evaluate(board)
+        shifts = self.engine.empty_shifts(board)
+        if not shifts:
+            return self.evaluate(board)
+        cache = self.cache
+        if cache is not None:
+            key = board if self.key is None else self.key(board)
+            value = cache.get(key, depth)
+            if value is not None:
+                return value
+        if self.deadline is not None and (self.stopped or time.time() > self.deadline):
+            raise SearchTimeout()
+        self.nodes += 1
+        prob /= len(shifts)
+        total = 0.0
+        for s in shifts:
+            total += 0.9 * self.max_node(board | (1 << s), depth, prob * 0.9)
+            total += 0.1 * self.max_node(board | (2 << s), depth, prob * 0.1)
+        value = total / len(shifts)
+        if cache is not None:
+            cache.put(key, value, depth)
+        return value
@@ -0,0 +1,513 @@
+"""
+Game server: Game sessions and AI move suggestions over TCP.
+
+Clients send one JSON object per line and get one JSON object per line back.
+Requests are answered as soon as they are done, so a client that sends
+several at once should give each an "id", which its response repeats. Moves
+are applied in the order they arrive.
+
+    {"op": "new", "size": 4, "seed": 1}         -> {"ok": true, "session": ..., "tiles": ..., "score": 0, "state": "run"}
+    {"op": "state", "session": s}               -> the same fields
+    {"op": "move", "session": s, "direction": "U"}
+    {"op": "suggest", "session": s}             -> {"ok": true, "direction": "L", "values": {"U": ..., ...}}
+    {"op": "close", "session": s}
+    {"op": "stats"}
+
+A failed request gets {"ok": false, "error": ...}; a move that changes
+nothing is refused as "Illegal move". The pool holds at most
+max_sessions games; the least recently used one is dropped to make room, and
+sessions unused for idle_timeout seconds are dropped as well.
+
+Suggestions are one-ply expectimax: every legal move, then every empty cell
+getting a 2 or a 4, scored by the AI evaluation. Requests from all sessions
+are queued and evaluated together, one Ai.evaluate_batch call per grid size
+for up to max_batch requests, in a worker thread. Requests arriving while
+one batch is evaluated make up the next, and when the last batch had more
+than one request a batch waits up to max_delay seconds for more, so batches
+grow with the load while a lone client is answered right away and the wait
+of a request stays bounded.
+
+    python -m Server --port 2048
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import Heuristic
+from Batch import move_batch
+from Game import Game, fmap
+from PlayerAI import Ai, config
+from Search import MOVE_ORDER
+
+# Requests about one session, besides 'new' and 'stats'
+SESSION_OPS = ('state', 'move', 'suggest', 'close')
+SIZES = (config.SIZE, config.SIZE_5x5, config.SIZE_6x6, config.SIZE_8x8)
+PORT = 2048
+# Longest request line, in bytes
+MAX_LINE = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+
+def suggest_batch(evaluate_batch, boards):
+    """
+    Score every move of a stack of boards by the expected evaluation after the tile spawn.
+
+    Args:
+        evaluate_batch (callable): Maps an (N, size, size) stack of tile values to N evaluations.
+        boards (np.ndarray): The tile values, shape (N, size, size).
+
+    Returns:
+        list: For each board, the best direction and the value of every legal move by direction,
+            or (None, {}) if no move is possible.
+    """
+    n, size = len(boards), boards.shape[-1]
+    children, owners, weights = [], [], []
+    for k, d in enumerate(MOVE_ORDER):
+        new, _, changed = move_batch(boards, d)
+        index = np.nonzero(changed)[0]
+        after = new[index].reshape(len(index), size * size)
+        # A move that changes a board always leaves an empty cell
+        cells = np.argwhere(after == 0)
+        share = 1.0 / (after == 0).sum(axis=1)[cells[:, 0]]
+        for tile, p in ((2, 0.9), (4, 0.1)):
+            child = after[cells[:, 0]]
+            child[np.arange(len(cells)), cells[:, 1]] = tile
+            children.append(child)
+            owners.append(index[cells[:, 0]] * len(MOVE_ORDER) + k)
+            weights.append(p * share)
+    children = np.concatenate(children).reshape(-1, size, size)
+    values = np.zeros(n * len(MOVE_ORDER))
+    legal = np.zeros(n * len(MOVE_ORDER), dtype=bool)
+    if len(children):
+        owners = np.concatenate(owners)
+        values = np.bincount(
+            owners, weights=np.concatenate(weights) * evaluate_batch(children), minlength=len(values)
+        )
+        legal[owners] = True
+    values = values.reshape(n, len(MOVE_ORDER))
+    legal = legal.reshape(n, len(MOVE_ORDER))
+    results = []
+    for row, mask in zip(values, legal):
+        moves = {d: float(v) for d, v, ok in zip(MOVE_ORDER, row, mask) if ok}
+        best = max(moves, key=moves.get) if moves else None
+        results.append((best, moves))
+    return results
+
+
+class SuggestBatcher:
+    """Queue of suggestion requests, evaluated in batches in a worker thread."""
+
+    def __init__(self, heuristic=None, max_batch=64, max_delay=0.002):
+        """
+        Initialize the batcher.
+
+        Args:
+            heuristic (str): The evaluation (default: config.HEURISTIC).
+            max_batch (int): The largest number of requests evaluated together (default: 64).
+            max_delay (float): The longest wait for more requests after the first of a batch, in seconds
+                (default: 0.002).
+        """
+        self.heuristic = heuristic
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        # One thread, so the Ai objects are only used by one thread at a time
+        self.executor = ThreadPoolExecutor(1)
+        # One Ai (evaluation) per grid size, made in the worker thread
+        self.ais = {}
+        self.task = None
+        self.batches = 0
+        self.requests = 0
+        self.last_batch = 0
+
+    def start(self):
+        """Start evaluating queued requests."""
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self):
+        """Stop evaluating and fail the requests still queued."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError('The server is shutting down'))
+        self.executor.shutdown()
+        for ai in self.ais.values():
+            ai.close()
+
+    async def suggest(self, tiles):
+        """
+        Get the suggested move for a board.
+
+        Args:
+            tiles (np.ndarray): The tile values.
+
+        Returns:
+            tuple: The best direction, or None if no move is possible, and the value of every legal move.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((np.array(tiles, dtype=np.int32), future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # Only wait for company when the last batch had some; a lone client is answered right away
+            if self.last_batch > 1 and self.queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            batch = [(tiles, future) for tiles, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self.executor, self.evaluate, [tiles for tiles, _ in batch])
+            except Exception:
+                logger.exception('Suggestion batch failed')
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError('Suggestion batch failed'))
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            self.last_batch = len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def evaluate(self, boards):
+        """
+        Get the suggestions of a batch of boards, in the worker thread.
+
+        Args:
+            boards (list): The tile values of every request.
+
+        Returns:
+            list: The suggestion of every request, see suggest_batch.
+        """
+        results = [None] * len(boards)
+        by_size = {}
+        for i, tiles in enumerate(boards):
+            by_size.setdefault(len(tiles), []).append(i)
+        for size, index in by_size.items():
+            ai = self.ais.get(size)
+            if ai is None:
+                ai = self.ais[size] = Ai(heuristic=self.heuristic, workers=0, book=None)
+                ai.set_size(size)
+            for i, result in zip(index, suggest_batch(ai.evaluate_batch, np.stack([boards[i] for i in index]))):
+                results[i] = result
+        return results
+
+
+class SessionPool:
+    """Games by session id, least recently used first."""
+
+    def __init__(self, max_sessions=1024, idle_timeout=600.0, engine=None):
+        """
+        Initialize the pool.
+
+        Args:
+            max_sessions (int): The largest number of sessions (default: 1024).
+            idle_timeout (float): Seconds after its last use a session is dropped (default: 600).
+            engine (str): The grid engine of the games (default: config.ENGINE).
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.engine = engine or config.ENGINE
+        # session id -> [game, time of last use]
+        self.sessions = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def expire(self):
+        """Drop the sessions unused for idle_timeout seconds."""
+        limit = time.monotonic() - self.idle_timeout
+        while self.sessions:
+            session, (game, used) = next(iter(self.sessions.items()))
+            if used > limit:
+                break
+            self.drop(session)
+            self.evicted += 1
+
+    def new(self, size=4, seed=None):
+        """
+        Start a game.
+
+        Args:
+            size (int): The size of the grid (default: 4).
+            seed (int): The seed of the game (default: None, random).
+
+        Returns:
+            tuple: The session id and the game.
+        """
+        if size not in SIZES:
+            raise ValueError('Unsupported grid size: {}'.format(size))
+        self.expire()
+        while len(self.sessions) >= self.max_sessions:
+            self.drop(next(iter(self.sessions)))
+            self.evicted += 1
+        session = secrets.token_hex(8)
+        game = Game(size, engine=self.engine, seed=seed)
+        self.sessions[session] = [game, time.monotonic()]
+        return session, game
+
+    def get(self, session):
+        """
+        Get the game of a session and mark the session as used.
+
+        Args:
+            session (str): The session id.
+
+        Returns:
+            Game: The game.
+        """
+        self.expire()
+        entry = self.sessions.get(session)
+        if entry is None:
+            raise ValueError('Unknown session: {}'.format(session))
+        entry[1] = time.monotonic()
+        self.sessions.move_to_end(session)
+        return entry[0]
+
+    def drop(self, session):
+        """End a session."""
+        game, _ = self.sessions.pop(session)
+        game.stop_recording()
+
+
+def game_state(game):
+    """Get the fields of a response that describe a game."""
+    return {'tiles': game.grid.tiles.tolist(), 'score': int(game.score), 'state': game.state}
+
+
+class GameServer:
+    """JSON-lines TCP server of a session pool and a suggestion batcher."""
+
+    def __init__(self, max_sessions=1024, idle_timeout=600.0, heuristic=None, max_batch=64, max_delay=0.002,
+                 engine=None):
+        """
+        Initialize the server.
+
+        Args:
+            max_sessions (int): The largest number of sessions (default: 1024).
+            idle_timeout (float): Seconds after its last use a session is dropped (default: 600).
+            heuristic (str): The evaluation of the suggestions (default: config.HEURISTIC).
+            max_batch (int): The largest number of suggestions evaluated together (default: 64).
+            max_delay (float): The longest wait for more suggestions before a batch, in seconds (default: 0.002).
+            engine (str): The grid engine of the games (default: config.ENGINE).
+        """
+        self.pool = SessionPool(max_sessions, idle_timeout, engine)
+        self.heuristic = heuristic
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batcher = None
+        self.server = None
+        # Handler task -> stream writer of every open client connection
+        self.connections = {}
+
+    async def start(self, host='127.0.0.1', port=PORT):
+        """
+        Start listening.
+
+        Args:
+            host (str): The address to listen on (default: '127.0.0.1').
+            port (int): The port, 0 for any free one (default: PORT).
+
+        Returns:
+            asyncio.Server: The listening server.
+        """
+        self.batcher = SuggestBatcher(self.heuristic, self.max_batch, self.max_delay)
+        self.batcher.start()
+        self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        return self.server
+
+    async def close(self):
+        """Stop listening, close the client connections and stop the batcher."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        # Closing the transport ends a handler's readline, so it finishes its pending requests and returns
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        if self.batcher is not None:
+            await self.batcher.close()
+            self.batcher = None
+
+    async def handle(self, reader, writer):
+        connection = asyncio.current_task()
+        self.connections[connection] = writer
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than MAX_LINE; the stream cannot be resynchronized
+                    writer.write(self.encode({'ok': False, 'error': 'Request too long'}))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self.respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.connections.pop(connection, None)
+
+    async def respond(self, line, writer):
+        request = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('A request must be a JSON object')
+            response = await self.dispatch(request)
+            response['ok'] = True
+        except ValueError as e:
+            response = {'ok': False, 'error': str(e)}
+        except Exception:
+            logger.exception('Request failed: %r', line)
+            response = {'ok': False, 'error': 'Internal error'}
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        if not writer.is_closing():
+            writer.write(self.encode(response))
+            await writer.drain()
+
+    @staticmethod
+    def encode(response):
+        return (json.dumps(response) + '\n').encode()
+
+    async def dispatch(self, request):
+        """
+        Carry out one request.
+
+        Args:
+            request (dict): The request.
+
+        Returns:
+            dict: The response, without 'ok' and 'id'.
+        """
+        op = request.get('op')
+        if op == 'new':
+            size = request.get('size', config.SIZE)
+            seed = request.get('seed')
+            if not isinstance(size, int) or not (seed is None or isinstance(seed, int)):
+                raise ValueError('size and seed must be integers')
+            session, game = self.pool.new(size, seed)
+            return dict(session=session, **game_state(game))
+        if op == 'stats':
+            return self.stats()
+        if op not in SESSION_OPS:
+            raise ValueError('Unknown op: {}'.format(op))
+        game = self.pool.get(request.get('session'))
+        if op == 'state':
+            return game_state(game)
+        if op == 'move':
+            direction = request.get('direction')
+            if not isinstance(direction, str) or len(direction) != 1 or direction not in MOVE_ORDER:
+                raise ValueError('direction must be one of U, D, L, R')
+            if game.state != 'run':
+                raise ValueError('The game is {}'.format(game.state))
+            # Game.run spawns a tile even when the move changes nothing
+            if not game.grid.legal_moves() & (1 << fmap[direction]):
+                raise ValueError('Illegal move')
+            game.run(direction)
+            return game_state(game)
+        if op == 'suggest':
+            if game.state != 'run':
+                return {'direction': None, 'values': {}}
+            direction, values = await self.batcher.suggest(game.grid.tiles)
+            return {'direction': direction, 'values': values}
+        self.pool.drop(request['session'])
+        return {}
+
+    def stats(self):
+        """Get the counters of the server."""
+        batcher = self.batcher
+        return {
+            'sessions': len(self.pool),
+            'evicted': self.pool.evicted,
+            'suggestions': batcher.requests,
+            'batches': batcher.batches,
+            'mean_batch': batcher.requests / batcher.batches if batcher.batches else 0.0,
+            'pending': batcher.queue.qsize(),
+        }
+
+
+async def serve(host='127.0.0.1', port=PORT, **options):
+    """
+    Run a server until it is cancelled.
+
+    Args:
+        host (str): The address to listen on (default: '127.0.0.1').
+        port (int): The port (default: PORT).
+        **options: Keyword arguments for GameServer.
+    """
+    server = GameServer(**options)
+    listening = await server.start(host, port)
+    logger.info('Listening on %s', ', '.join(str(s.getsockname()) for s in listening.sockets))
+    try:
+        await listening.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve 2048 games and AI move suggestions over TCP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on')
+    parser.add_argument('--max-sessions', type=int, default=1024, help='largest number of sessions')
+    parser.add_argument('--idle-timeout', type=float, default=600.0, help='seconds before an unused session ends')
+    parser.add_argument('--heuristic', default=None, choices=Heuristic.EVALUATORS,
+                        help='evaluation')
+    parser.add_argument('--max-batch', type=int, default=64, help='largest number of suggestions evaluated together')
+    parser.add_argument('--max-delay-ms', type=float, default=2.0, help='longest wait for more suggestions')
+    parser.add_argument('--engine', default=None, choices=['numpy', 'exponent', 'bitboard'], help='grid engine')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        asyncio.run(serve(
+            args.host, args.port, max_sessions=args.max_sessions, idle_timeout=args.idle_timeout,
+            heuristic=args.heuristic, max_batch=args.max_batch, max_delay=args.max_delay_ms / 1000,
+            engine=args.engine
+        ))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
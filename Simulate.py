@@ -0,0 +1,205 @@
+"""
+Headless batch simulator.
+
+Plays many AI games without pygame and reports throughput and results:
+
+    python -m Simulate --games 10000 --size 4 --workers 8 --seed 1
+
+Every game gets its own seed derived from --seed and the game number, so a
+run is reproducible and can be split across processes (or machines, with
+--first) without changing any single game. With --record DIR every game is
+also written to DIR/<game seed>.rec, to be replayed with Main.py --replay.
+With --dataset DIR every position is added to a self-play dataset (see
+Dataset).
+"""
+
+import argparse
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Dataset import DatasetWriter
+from Game import Game
+from PlayerAI import Ai
+
+
+def game_seed(seed, index):
+    """
+    Get the seed of one game of a run.
+
+    Args:
+        seed (int): The seed of the run.
+        index (int): The number of the game in the run.
+
+    Returns:
+        int: The seed of the game.
+    """
+    return int(np.random.SeedSequence([seed, index]).generate_state(1)[0])
+
+
+def play_game(seed, size=4, engine='numpy', ai_options=None, record_dir=None, collect=False):
+    """
+    Play one AI game to the end.
+
+    Args:
+        seed (int): The seed of the game.
+        size (int): The size of the grid (default: 4).
+        engine (str): The grid engine (default: 'numpy').
+        ai_options (dict): Keyword arguments for Ai (default: None).
+        record_dir (str): Record the game to <record_dir>/<seed>.rec (default: None).
+        collect (bool): Also return the positions (as exponents), moves and move values, for DatasetWriter
+            (default: False).
+
+    Returns:
+        dict: The score, max tile, number of moves and CPU seconds of the game, and with collect
+            the 'records' of the game.
+    """
+    start = time.process_time()
+    game = Game(size, engine=engine, seed=seed)
+    if record_dir is not None:
+        game.record(os.path.join(record_dir, '{}.rec'.format(seed)))
+    ai = Ai(seed=seed, **(ai_options or {}))
+    moves = 0
+    records = {'boards': [], 'moves': [], 'values': []}
+    while game.state == 'run':
+        exponents = game.grid.exponents.copy()
+        direction, _ = ai.get_next(exponents, exponents=True)
+        if collect:
+            records['boards'].append(exponents)
+            records['moves'].append(direction)
+            records['values'].append(ai.move_values)
+        game.run(direction)
+        moves += 1
+    game.stop_recording()
+    ai.close()
+    result = {
+        'seed': seed,
+        'score': int(game.score),
+        'max_tile': int(np.max(game.grid.tiles)),
+        'moves': moves,
+        'cpu': time.process_time() - start,
+    }
+    if collect:
+        records['boards'] = np.array(records['boards'], dtype=np.uint8).reshape(-1, size, size)
+        result['records'] = records
+    return result
+
+
+def _play(args):
+    return play_game(*args)
+
+
+def run(games, size=4, workers=1, seed=0, first=0, engine='numpy', ai_options=None, record_dir=None,
+        dataset_dir=None):
+    """
+    Play a batch of games, in parallel if more than one worker is asked for.
+
+    Args:
+        games (int): The number of games.
+        size (int): The size of the grid (default: 4).
+        workers (int): The number of worker processes (default: 1).
+        seed (int): The seed of the run (default: 0).
+        first (int): The number of the first game, to split a run (default: 0).
+        engine (str): The grid engine (default: 'numpy').
+        ai_options (dict): Keyword arguments for Ai (default: None).
+        record_dir (str): Record every game to this directory (default: None).
+        dataset_dir (str): Write every position to a self-play dataset in this directory (default: None).
+
+    Returns:
+        list: The result of every game, in game order.
+    """
+    if record_dir is not None:
+        os.makedirs(record_dir, exist_ok=True)
+    writer = DatasetWriter(dataset_dir, size) if dataset_dir is not None else None
+    tasks = [
+        (game_seed(seed, i), size, engine, ai_options, record_dir, writer is not None)
+        for i in range(first, first + games)
+    ]
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    results = []
+    try:
+        if executor is None:
+            played = map(_play, tasks)
+        else:
+            played = executor.map(_play, tasks, chunksize=max(1, games // (workers * 8)))
+        for result in played:
+            records = result.pop('records', None)
+            if writer is not None:
+                writer.add_game(
+                    game=result['seed'], score=result['score'], max_tile=result['max_tile'], exponents=True, **records
+                )
+            results.append(result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if writer is not None:
+            writer.close()
+    return results
+
+
+def report(results, elapsed, win_tile=2048):
+    """
+    Format the statistics of a batch of games.
+
+    Args:
+        results (list): The results returned by run.
+        elapsed (float): The wall time of the run in seconds.
+        win_tile (int): The tile that counts as a win (default: 2048).
+
+    Returns:
+        str: The report.
+    """
+    scores = np.array([r['score'] for r in results])
+    moves = sum(r['moves'] for r in results)
+    tiles = Counter(r['max_tile'] for r in results)
+    wins = sum(r['max_tile'] >= win_tile for r in results)
+    lines = [
+        'Games: {}  Time: {:.1f}s  Games/sec: {:.2f}  Moves/sec: {:.1f}'.format(
+            len(results), elapsed, len(results) / elapsed, moves / elapsed
+        ),
+        'CPU per move: {:.2f} ms'.format(1000 * sum(r['cpu'] for r in results) / max(moves, 1)),
+        'Score: mean {:.0f}  median {:.0f}  min {}  max {}  p10 {:.0f}  p90 {:.0f}'.format(
+            scores.mean(), np.median(scores), scores.min(), scores.max(),
+            np.percentile(scores, 10), np.percentile(scores, 90)
+        ),
+        'Win rate ({}): {:.1%}'.format(win_tile, wins / len(results)),
+        'Max tile:',
+    ]
+    for tile in sorted(tiles):
+        lines.append('{:>8}: {:>6} ({:.1%})'.format(tile, tiles[tile], tiles[tile] / len(results)))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play 2048 AI games without a window.')
+    parser.add_argument('--games', type=int, default=100, help='number of games')
+    parser.add_argument('--size', type=int, default=4, help='grid size')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the run')
+    parser.add_argument('--first', type=int, default=0, help='number of the first game, to split a run')
+    parser.add_argument('--engine', default='numpy', choices=['numpy', 'exponent', 'bitboard'], help='grid engine')
+    parser.add_argument('--mode', default='expectimax', choices=['sample', 'expectimax', 'rollout'], help='AI mode')
+    parser.add_argument('--depth', type=int, default=None, help='expectimax depth')
+    parser.add_argument('--rollouts', type=int, default=None, help='rollouts per root move (rollout mode)')
+    parser.add_argument('--book', metavar='FILE', help='opening book of the heuristic (see Book)')
+    parser.add_argument('--heuristic', default=None, choices=['compat', 'log2', 'corners', 'ntuple'], help='evaluation')
+    parser.add_argument('--win-tile', type=int, default=2048, help='tile that counts as a win')
+    parser.add_argument('--record', metavar='DIR', help='record every game to DIR/<seed>.rec')
+    parser.add_argument('--dataset', metavar='DIR', help='write every position to a self-play dataset in DIR')
+    args = parser.parse_args(argv)
+
+    ai_options = {
+        'mode': args.mode, 'depth': args.depth, 'heuristic': args.heuristic, 'workers': 0,
+        'rollouts': args.rollouts, 'book': args.book,
+    }
+    start = time.time()
+    results = run(args.games, args.size, args.workers, args.seed, args.first, args.engine, ai_options, args.record,
+                  args.dataset)
+    print(report(results, time.time() - start, args.win_tile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Search instrumentation.
+
+SearchStats collects what the AI did: moves searched, nodes expanded,
+evaluations, depth reached, time per move and moves taken from the opening
+book, plus (when timing is turned on) the time spent moving boards versus
+evaluating them. Ai keeps one in Ai.stats; Main shows it next to the
+evaluation.
+"""
+
+import time
+
+
+class SearchStats:
+    """Counters of the searches of one Ai."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Set every counter back to zero."""
+        self.moves = 0
+        self.book_hits = 0
+        self.nodes = 0
+        self.evals = 0
+        self.search_time = 0.0
+        self.last_time = 0.0
+        self.last_depth = 0
+        self.last_nodes = 0
+        self.move_time = 0.0
+        self.eval_time = 0.0
+
+    def record_move(self, seconds, depth, nodes):
+        """
+        Record one finished search.
+
+        Args:
+            seconds (float): The time the search took.
+            depth (int): The depth the search reached.
+            nodes (int): The nodes the search expanded.
+        """
+        self.moves += 1
+        self.search_time += seconds
+        self.last_time = seconds
+        self.last_depth = depth
+        self.last_nodes = nodes
+        self.nodes += nodes
+
+    def timed(self, func, field):
+        """
+        Wrap a function so that the time spent in it is added to a counter.
+
+        Args:
+            func (callable): The function to wrap.
+            field (str): 'move_time' or 'eval_time'.
+
+        Returns:
+            callable: The wrapped function.
+        """
+        perf_counter = time.perf_counter
+
+        def wrapper(*args):
+            start = perf_counter()
+            try:
+                return func(*args)
+            finally:
+                setattr(self, field, getattr(self, field) + perf_counter() - start)
+
+        return wrapper
+
+    @property
+    def evals_per_second(self):
+        """float: Evaluations per second of search time."""
+        return self.evals / self.search_time if self.search_time else 0.0
+
+    @property
+    def time_per_move(self):
+        """float: The average search time per move, in seconds."""
+        return self.search_time / self.moves if self.moves else 0.0
+
+    def summary(self, caches=()):
+        """
+        Get the counters as a dict.
+
+        Args:
+            caches (iterable): TranspositionTables whose hit rate to include (default: ()).
+
+        Returns:
+            dict: The counters and derived rates.
+        """
+        hits = sum(c.hits for c in caches)
+        lookups = hits + sum(c.misses for c in caches)
+        return {
+            'moves': self.moves,
+            'book_hits': self.book_hits,
+            'nodes': self.nodes,
+            'evals': self.evals,
+            'evals_per_second': self.evals_per_second,
+            'time_per_move': self.time_per_move,
+            'last_time': self.last_time,
+            'last_depth': self.last_depth,
+            'last_nodes': self.last_nodes,
+            'move_time': self.move_time,
+            'eval_time': self.eval_time,
+            'cache_hit_rate': hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,49 @@
+"""
+Tests of the arena's sequential probability ratio test and setting overrides.
+
+    python -m pytest
+"""
+
+import math
+
+import pytest
+
+import Arena
+import Heuristic
+
+
+def test_sprt_bounds():
+    sprt = Arena.SPRT(0.45, 0.55, alpha=0.05, beta=0.1)
+    assert sprt.lower == pytest.approx(math.log(0.1 / 0.95))
+    assert sprt.upper == pytest.approx(math.log(0.9 / 0.05))
+
+
+@pytest.mark.parametrize('b_wins, decision', ((True, 'H1'), (False, 'H0')))
+def test_sprt_decides_when_the_ratio_leaves_the_bounds(b_wins, decision):
+    sprt = Arena.SPRT(0.45, 0.55, 0.05, 0.05)
+    a_score, b_score = (1, 2) if b_wins else (2, 1)
+    # Every pair moves the ratio by log(11 / 9) and the bounds are at log(19), 14.7 pairs away
+    for _ in range(15):
+        assert sprt.decision is None
+        sprt.add(a_score, b_score)
+        sprt.add(3, 3)
+    assert sprt.decision == decision
+    assert sprt.draws == 15
+    assert (sprt.wins, sprt.losses) == ((15, 0) if b_wins else (0, 15))
+
+
+@pytest.mark.parametrize('p0, p1', ((0.55, 0.45), (0.5, 0.5), (0.0, 0.5), (0.5, 1.0)))
+def test_sprt_rejects_bad_hypotheses(p0, p1):
+    with pytest.raises(ValueError):
+        Arena.SPRT(p0, p1)
+
+
+def test_overrides_are_restored():
+    weight, sample_max = Heuristic.BJ2_WEIGHT, Arena.PlayerAI.config.SAMPLE_MAX
+    with Arena.overrides({'Heuristic.BJ2_WEIGHT': 3.5, 'config.SAMPLE_MAX': 7}):
+        assert Heuristic.BJ2_WEIGHT == 3.5
+        assert Arena.PlayerAI.config.SAMPLE_MAX == 7
+    assert (Heuristic.BJ2_WEIGHT, Arena.PlayerAI.config.SAMPLE_MAX) == (weight, sample_max)
+    with pytest.raises(ValueError):
+        with Arena.overrides({'Heuristic.NO_SUCH_SETTING': 1}):
+            pass
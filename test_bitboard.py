@@ -0,0 +1,56 @@
+"""
+Tests of the 4x4 board symmetries of Bitboard.
+
+A move on a transformed board, with its direction mapped by
+transform_direction, must be the transform of the move on the board; the
+canonical form and inverse_direction rely on it to map a move found for the
+canonical board back to the board it was asked for.
+
+    python -m pytest
+"""
+
+import numpy as np
+import pytest
+
+import Bitboard
+import Heuristic
+
+DIRECTIONS = Bitboard.DIRECTIONS
+
+
+def random_boards(n=200, seed=0):
+    """Get seeded random packed boards with every exponent and many empty cells."""
+    rng = np.random.default_rng(seed)
+    exponents = rng.integers(1, 12, (n, Bitboard.SIZE, Bitboard.SIZE))
+    exponents[rng.random(exponents.shape) < 0.4] = 0
+    return [Bitboard.pack_exponents(e) for e in exponents]
+
+
+@pytest.mark.parametrize('k', range(8))
+def test_moves_commute_with_the_transforms(k):
+    for board in random_boards():
+        assert Bitboard.symmetries(board)[k] == Bitboard.apply_symmetry(board, k)
+        for d in DIRECTIONS:
+            new, score = Bitboard.move(board, d)
+            moved, moved_score = Bitboard.move(Bitboard.apply_symmetry(board, k), Bitboard.transform_direction(d, k))
+            assert moved == Bitboard.apply_symmetry(new, k)
+            assert moved_score == score
+            assert Bitboard.inverse_direction(Bitboard.transform_direction(d, k), k) == d
+
+
+def test_canonical_moves_map_back():
+    for board in random_boards(seed=1):
+        canonical, k = Bitboard.canonical(board)
+        assert canonical == Bitboard.apply_symmetry(board, k) == Bitboard.canonical_key(board)
+        for other in Bitboard.symmetries(board):
+            assert Bitboard.canonical_key(other) == canonical
+        for d in DIRECTIONS:
+            # A move found on the canonical board, played on the board it stands for
+            new, _ = Bitboard.move(board, Bitboard.inverse_direction(d, k))
+            assert Bitboard.apply_symmetry(new, k) == Bitboard.move(canonical, d)[0]
+
+
+def test_corners_evaluation_is_symmetric():
+    for board in random_boards(seed=2):
+        values = [Heuristic.evaluate_corners(b) for b in Bitboard.symmetries(board)]
+        assert values == pytest.approx([values[0]] * len(values))
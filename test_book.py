@@ -0,0 +1,41 @@
+"""
+Tests of the opening book stamp: a book is refused as soon as the evaluation it was built for changes.
+
+    python -m pytest
+"""
+
+import pytest
+
+import Book
+import Heuristic
+
+
+def test_stamp_is_stable():
+    assert Book.evaluator_stamp('compat') == Book.evaluator_stamp('compat')
+    assert Book.evaluator_stamp('compat') != Book.evaluator_stamp('log2')
+
+
+def test_stamp_changes_with_the_weight(monkeypatch):
+    stamp = Book.evaluator_stamp('compat')
+    monkeypatch.setattr(Heuristic, 'BJ2_WEIGHT', Heuristic.BJ2_WEIGHT + 0.5)
+    assert Book.evaluator_stamp('compat') != stamp
+
+
+@pytest.mark.parametrize('heuristic', ('compat', 'corners'))
+def test_stamp_changes_with_the_tables(monkeypatch, heuristic):
+    stamp = Book.evaluator_stamp(heuristic)
+    # Tables built from a changed position term
+    monkeypatch.setattr(Heuristic, '_tables', {})
+    monkeypatch.setattr(Heuristic, '_smallest', lambda mode: 0)
+    assert Book.evaluator_stamp(heuristic) != stamp
+
+
+def test_book_built_for_another_evaluation_is_refused(monkeypatch, tmp_path):
+    path = str(tmp_path / 'book.bin')
+    Book.write(path, {0x21: ('U', 1.0)}, 2, False, Book.evaluator_stamp('compat'))
+    book = Book.OpeningBook(path, Book.evaluator_stamp('compat'))
+    assert book.lookup(0x21) == ('U', 1.0)
+    book.close()
+    monkeypatch.setattr(Heuristic, 'BJ2_WEIGHT', Heuristic.BJ2_WEIGHT + 0.5)
+    with pytest.raises(ValueError):
+        Book.OpeningBook(path, Book.evaluator_stamp('compat'))
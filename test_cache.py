@@ -0,0 +1,53 @@
+"""
+Tests of the transposition table and of the AI caches built on it.
+
+    python -m pytest
+"""
+
+import numpy as np
+
+from Cache import DEPTH_WINDOW, ENTRY_BYTES, TranspositionTable
+from PlayerAI import Ai
+
+
+def test_lru_drops_the_least_recently_used_entry():
+    table = TranspositionTable(3 * ENTRY_BYTES)
+    for key in 'abc':
+        table.put(key, key.upper())
+    assert table.get('a') == 'A'
+    table.put('d', 'D')
+    assert len(table) == 3
+    assert table.get('b') is None
+    assert [table.get(key) for key in 'acd'] == ['A', 'C', 'D']
+
+
+def test_values_are_only_returned_at_their_depth_or_shallower():
+    table = TranspositionTable()
+    table.put('a', 1.0, depth=2)
+    assert table.get('a', 3) is None
+    assert table.get('a', 2) == 1.0
+    assert table.get('a') == 1.0
+    assert (table.hits, table.misses) == (2, 1)
+
+
+def test_depth_policy_drops_the_shallowest_of_the_oldest_entries():
+    table = TranspositionTable((DEPTH_WINDOW + 2) * ENTRY_BYTES, policy='depth')
+    depths = [5] * (DEPTH_WINDOW + 2)
+    depths[3] = 1
+    # Shallower still, but more recently used than the entries the policy chooses from
+    depths[-1] = 0
+    for key, depth in enumerate(depths):
+        table.put(key, key, depth)
+    table.put('new', 0, 5)
+    assert 3 not in table.entries
+    assert all(key in table.entries for key in (0, len(depths) - 1, 'new'))
+
+
+def test_search_results_carry_over_between_moves():
+    tiles = np.array([[2, 4, 8, 16], [0, 2, 0, 4], [0, 0, 2, 0], [0, 0, 0, 2]], dtype=np.int32)
+    ai = Ai(seed=0, mode='expectimax', depth=2, workers=0, book=None)
+    first = ai.get_next(tiles)
+    hits = ai.search_cache.hits
+    assert ai.get_next(tiles) == first
+    assert ai.search_cache.hits > hits
+    ai.close()
@@ -0,0 +1,114 @@
+"""
+Consistency tests of the fast board engines and heuristic tables.
+
+Every fast path claims to give exactly what the reference code gives: the
+packed and batched moves the boards and scores of Grid.run (including its
+point per slid tile), and the heuristic tables the value of Ai.get_score.
+The tests check both on seeded random boards.
+
+    python -m pytest
+"""
+
+import numpy as np
+import pytest
+
+import Batch
+import Bitboard
+import Heuristic
+import Packed
+from Game import Grid
+from PlayerAI import Ai
+
+SIZES = (4, 5, 6, 8)
+DIRECTIONS = Bitboard.DIRECTIONS
+# Random boards per grid size
+BOARDS = 300
+
+
+def random_boards(size, n=BOARDS, seed=0):
+    """
+    Get seeded random boards of tile values, with empty cells and many equal neighbours.
+
+    Args:
+        size (int): The size of the grid.
+        n (int): The number of boards (default: BOARDS).
+        seed (int): The seed (default: 0).
+
+    Returns:
+        np.ndarray: The boards, shape (n, size, size), int32.
+    """
+    rng = np.random.default_rng([seed, size])
+    exponents = rng.integers(1, 12, (n, size, size))
+    # Small tiles on half of the boards, so that merges are common
+    exponents[: n // 2] = rng.integers(1, 5, (n // 2, size, size))
+    exponents[rng.random((n, size, size)) < 0.35] = 0
+    return np.where(exponents > 0, np.left_shift(1, exponents), 0).astype(np.int32)
+
+
+def grid_move(tiles, direction):
+    """Move a copy of the tiles with Grid.run and return the new tiles and the score."""
+    grid = Grid(len(tiles))
+    grid.tiles = tiles.copy()
+    score = grid.run(direction)
+    return grid.tiles, score
+
+
+@pytest.fixture(scope='module')
+def ai():
+    ai = Ai(seed=0, workers=0)
+    yield ai
+    ai.close()
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_packed_move_matches_grid(size):
+    engine = Packed.engine(size)
+    for tiles in random_boards(size):
+        board = engine.pack(tiles)
+        for d in DIRECTIONS:
+            new, score = engine.move(board, d)
+            expected, expected_score = grid_move(tiles, d)
+            np.testing.assert_array_equal(engine.unpack(new), expected)
+            assert score == expected_score
+
+
+def test_bitboard_move_matches_grid():
+    for tiles in random_boards(Bitboard.SIZE, seed=1):
+        board = Bitboard.pack(tiles)
+        for d in DIRECTIONS:
+            new, score = Bitboard.move(board, d)
+            expected, expected_score = grid_move(tiles, d)
+            np.testing.assert_array_equal(Bitboard.unpack(new), expected)
+            assert score == expected_score
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_move_batch_matches_grid(size):
+    boards = random_boards(size, seed=2)
+    for d in DIRECTIONS:
+        new, scores, changed = Batch.move_batch(boards, d)
+        for tiles, moved, score, was_changed in zip(boards, new, scores, changed):
+            expected, expected_score = grid_move(tiles, d)
+            np.testing.assert_array_equal(moved, expected)
+            assert score == expected_score
+            assert was_changed == (not np.array_equal(expected, tiles))
+
+
+def test_evaluate_packed_matches_get_score(ai):
+    for tiles in random_boards(Bitboard.SIZE, seed=3):
+        assert Heuristic.evaluate_packed(Bitboard.pack(tiles)) == pytest.approx(ai.get_score(tiles))
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_evaluate_batch_matches_get_score(ai, size):
+    boards = random_boards(size, seed=4)
+    expected = [ai.get_score(tiles) for tiles in boards]
+    np.testing.assert_allclose(Heuristic.evaluate_batch(boards), expected)
+
+
+@pytest.mark.parametrize('size', [size for size in SIZES if size != Bitboard.SIZE])
+def test_row_heuristic_matches_get_score(ai, size):
+    engine = Packed.engine(size)
+    heuristic = Heuristic.RowHeuristic(engine)
+    for tiles in random_boards(size, seed=5):
+        assert heuristic.evaluate(engine.pack(tiles)) == pytest.approx(ai.get_score(tiles))
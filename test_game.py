@@ -0,0 +1,52 @@
+"""
+Tests of the grid engines of Game.
+
+The numpy, exponent and bitboard grids keep the board in different ways but
+must play the same game: the same moves, tile spawns and score for a seed.
+The numpy and exponent grids update their index of empty cells and board
+summary cell by cell, which must give what a full reindex gives.
+
+    python -m pytest
+"""
+
+import random
+
+import pytest
+
+from Game import ENGINES, new_grid, nmap
+from Simulate import play_game
+
+# A short search, so that a whole game stays fast
+AI_OPTIONS = {'mode': 'expectimax', 'depth': 1, 'workers': 0}
+
+
+@pytest.mark.parametrize('size', (4, 5))
+def test_engines_play_the_same_game(size):
+    results = [play_game(7, size, engine, AI_OPTIONS) for engine in ENGINES]
+    for result in results[1:]:
+        for key in ('score', 'max_tile', 'moves'):
+            assert result[key] == results[0][key]
+
+
+def summary(grid):
+    """The index of empty cells and the board summary of a grid."""
+    positions = [(i, pos) for i, pos in enumerate(grid.empty_pos) if pos >= 0]
+    assert all(grid.empty[pos] == i for i, pos in positions)
+    return sorted(grid.empty), len(positions), grid.hash, grid.highest, grid.legal_moves()
+
+
+@pytest.mark.parametrize('engine', ('numpy', 'exponent'))
+@pytest.mark.parametrize('size', (4, 5, 8))
+def test_moves_keep_the_index_of_a_full_reindex(engine, size):
+    rng = random.Random(size)
+    grid = new_grid(size, engine, rng)
+    grid.add_tile_init()
+    for _ in range(300):
+        legal = grid.legal_moves()
+        if not legal:
+            break
+        grid.run(nmap[rng.choice([i for i in range(4) if legal & (1 << i)])])
+        grid.add_random_tile()
+        reference = new_grid(size, engine)
+        reference.tiles = grid.tiles
+        assert summary(grid) == summary(reference)
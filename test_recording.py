@@ -0,0 +1,57 @@
+"""
+Tests of game recordings: every position of a recorded game can be read back.
+
+    python -m pytest
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from Game import Game, nmap
+from Recording import GameReader
+
+
+def play_recorded(path, size, engine, interval, moves=150):
+    """Play a seeded game with random moves while recording it, and return the position after every move."""
+    rng = random.Random(1)
+    game = Game(size, engine=engine, seed=1)
+    game.record(path, interval)
+    positions = [(game.grid.tiles.copy(), game.score)]
+    while game.state == 'run' and len(positions) <= moves:
+        game.run(nmap[rng.randrange(4)])
+        positions.append((game.grid.tiles.copy(), game.score))
+    game.stop_recording()
+    return positions
+
+
+@pytest.mark.parametrize('engine', ('numpy', 'bitboard'))
+@pytest.mark.parametrize('size, interval', ((4, 8), (4, 64), (5, 1)))
+def test_board_replays_every_position(tmp_path, engine, size, interval):
+    path = str(tmp_path / 'game.rec')
+    positions = play_recorded(path, size, engine, interval)
+    reader = GameReader(path)
+    assert len(reader) == len(positions) - 1
+    assert reader.seed == 1
+    # Out of order, so that positions are not only read by stepping forward
+    for n in random.Random(2).sample(range(len(positions)), len(positions)):
+        tiles, score = reader.board(n)
+        np.testing.assert_array_equal(tiles, positions[n][0])
+        assert score == positions[n][1]
+    with pytest.raises(IndexError):
+        reader.board(len(positions))
+    reader.close()
+
+
+def test_cut_off_recording_reads_up_to_its_last_move(tmp_path):
+    path = str(tmp_path / 'game.rec')
+    positions = play_recorded(path, 4, 'numpy', 64)
+    # Cut in the middle of a move record
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 6)
+    reader = GameReader(path)
+    last = len(reader)
+    assert last < len(positions) - 1
+    np.testing.assert_array_equal(reader.board(last)[0], positions[last][0])
+    reader.close()
@@ -0,0 +1,104 @@
+"""
+Tests of the game server protocol, over a real connection to a server on a free port.
+
+    python -m pytest
+"""
+
+import asyncio
+import json
+
+import numpy as np
+
+from Server import GameServer
+
+
+async def session_requests(requests, before=None):
+    """
+    Send requests one at a time to a fresh server and collect the responses.
+
+    Args:
+        requests (list): The requests; '$session' in a value is replaced by the last session started.
+        before (callable): Called with the server and the session after the first session is started, to set up
+            its game (default: None).
+
+    Returns:
+        list: The responses.
+    """
+    server = GameServer(max_delay=0)
+    listening = await server.start(port=0)
+    reader, writer = await asyncio.open_connection(*listening.sockets[0].getsockname()[:2])
+    responses = []
+    session = None
+    try:
+        for request in requests:
+            request = {k: session if v == '$session' else v for k, v in request.items()}
+            writer.write((json.dumps(request) + '\n').encode())
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+            if 'session' in responses[-1]:
+                if before is not None and session is None:
+                    before(server, responses[-1]['session'])
+                session = responses[-1]['session']
+    finally:
+        writer.close()
+        await server.close()
+    return responses
+
+
+def test_new_move_state_and_close():
+    new, moved, state, closed, gone = asyncio.run(session_requests([
+        {'op': 'new', 'size': 4, 'seed': 1, 'id': 7},
+        {'op': 'move', 'session': '$session', 'direction': 'L'},
+        {'op': 'state', 'session': '$session'},
+        {'op': 'close', 'session': '$session'},
+        {'op': 'state', 'session': '$session'},
+    ], lambda server, session: setattr(server.pool.get(session).grid, 'tiles', np.array(
+        [[0, 2, 0, 2], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]], dtype=np.int32
+    ))))
+    assert new['ok'] and new['id'] == 7 and new['state'] == 'run'
+    assert np.count_nonzero(new['tiles']) == 2
+    assert moved['ok'] and moved['tiles'][0][0] == 4
+    # The merged tile and a new one
+    assert np.count_nonzero(moved['tiles']) == 2
+    assert state == {'ok': True, 'tiles': moved['tiles'], 'score': moved['score'], 'state': 'run'}
+    assert closed == {'ok': True}
+    assert not gone['ok'] and gone['error'].startswith('Unknown session')
+
+
+def test_illegal_move_changes_nothing():
+    tiles = [[2, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
+    _, refused, state = asyncio.run(session_requests([
+        {'op': 'new', 'size': 4, 'seed': 1},
+        {'op': 'move', 'session': '$session', 'direction': 'U'},
+        {'op': 'state', 'session': '$session'},
+    ], lambda server, session: setattr(server.pool.get(session).grid, 'tiles', np.array(tiles, dtype=np.int32))))
+    assert refused == {'ok': False, 'error': 'Illegal move'}
+    assert state['tiles'] == tiles
+
+
+def test_suggest_scores_the_legal_moves():
+    tiles = [[2, 4, 8, 16], [0, 0, 0, 32], [0, 0, 0, 0], [0, 0, 0, 0]]
+    _, suggestion = asyncio.run(session_requests([
+        {'op': 'new', 'size': 4, 'seed': 1},
+        {'op': 'suggest', 'session': '$session'},
+    ], lambda server, session: setattr(server.pool.get(session).grid, 'tiles', np.array(tiles, dtype=np.int32))))
+    assert suggestion['ok']
+    # Up and right change nothing on this board
+    assert set(suggestion['values']) == {'L', 'D'}
+    values = suggestion['values']
+    assert suggestion['direction'] == max(values, key=values.get)
+
+
+def test_bad_requests():
+    responses = asyncio.run(session_requests([
+        {'op': 'new', 'size': 3},
+        {'op': 'fly'},
+        {'op': 'state', 'session': 'nope'},
+        {'op': 'new', 'size': 4},
+        {'op': 'move', 'session': '$session', 'direction': 'X'},
+    ]))
+    assert not any(response['ok'] for response in responses[:3])
+    assert responses[0]['error'] == 'Unsupported grid size: 3'
+    assert responses[1]['error'] == 'Unknown op: fly'
+    assert responses[2]['error'] == 'Unknown session: nope'
+    assert responses[4] == {'ok': False, 'error': 'direction must be one of U, D, L, R'}